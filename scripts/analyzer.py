@@ -5,53 +5,519 @@
 # file: analyzer.py
 #
 # Generates statistics from annotated text files
-# When executed separately, outputs statistics only as a text file in the directory ./statistics_output
+# When executed separately, outputs statistics as a text file in the directory ./statistics_output,
+# and into a statistics file for the synthesizer when one is given with --statistics
 # Imported as a module in main file synthesizer.py
 
+# Usage: python analyzer.py [--source DIR ...] [--workers N] [--unnecessary-top N] [--missing-top N]
+#                           [--statistics FILE] [--cache DIR | --no-cache] [--log-level LEVEL] [--profile [PREFIX]]
+# Where
+#   --source - directories of gold token files, grouped into subdirectories by language level
+#   --workers - number of processes counting files in parallel, 1 by default
+#   --cache - directory of the parse-once cache of the gold token files, ./m2_cache by default
+#   --no-cache - parse every gold token file instead of using the cache
+#   --unnecessary-top - number of unnecessary character and following word combinations kept, 5 by default, 0 keeps all
+#   --missing-top - number of missing character and following word combinations kept, 10 by default, 0 keeps all
+#   --statistics - also save the statistics into this statistics file for the synthesizer
+#   --log-level - DEBUG, INFO, WARNING or ERROR, INFO by default
+#   --profile - profile the run with cProfile into PREFIX.prof and PREFIX.worker-PID.prof files, analyzer by default,
+#               and log the time of counting the files, merging the counts and calculating the percentages
+
 import os
 import glob
+import hashlib
+import json
+import logging
+import argparse
+import multiprocessing
 from datetime import datetime
+import reporting
+import instrumentation
+import statistics_store
+import m2cache
+from m2cache import numpy
+
+logger = logging.getLogger("analyzer")
 
 # Storing statistics in human-readable way
+# The summary file is named by the date the analysis starts, the directory is created only when writing it
 output_dir = "./statistics_output"
-os.makedirs(output_dir, exist_ok=True)
-time = datetime.now().strftime("%Y-%m-%d")
+summary_filename = None
+
+# Parse-once cache of the gold token files used by the command line
+CACHE_DIR = "./m2_cache"
+
+
+def start_summary_file():
+    global summary_filename
+    os.makedirs(output_dir, exist_ok=True)
+    filenametime = datetime.now().strftime("%Y-%m-%d") + "_statistics_summary.txt"
+    summary_filename = os.path.join(output_dir, filenametime)
+    file = open(summary_filename, "w", encoding="utf8")
+    file.close()
 
 
 def save_to_file(data):
-    filenametime = time + "_statistics_summary.txt"
-    filename = (os.path.join(output_dir, filenametime))
-    file = open(filename, "a", encoding="utf8")
+    file = open(summary_filename, "a", encoding="utf8")
     file.write(f"{data}\n")
-    file.close
+    file.close()
+
+
+# Counters collected from annotated files, partial counts of single files are merged together
+def new_counts():
+    return {
+        "sentenceCount": 0,
+        "sentenceCountByLevel": {"A2": 0, "B1": 0, "B2": 0, "C1": 0},
+        "punctErrorCounts": {"M:PUNCT": 0, "U:PUNCT": 0, "R:PUNCT": 0},
+        "punctErrorCountsByLevel": {"A2": 0, "B1": 0, "B2": 0, "C1": 0},
+        "errorSentenceCount": 0,
+        "errorSentenceCountByLevel": {"A2": 0, "B1": 0, "B2": 0, "C1": 0},
+        "missingPunctuation": {},  # Characters that have been missing
+        "replacementPunctuation": {},  # Characters that have been wrong
+        "middleReplacementPunctuation": {},  # Wrong characters in the middle of sentence
+        "endReplacementPunctuation": {},  # Wrong characters in the end of sentence
+        "unnecessaryPunctuation": {},  # Characters that have been unnecessary
+        "replacementMapping": {},
+        # Corrections for each wrong character in the middle of sentence
+        "middleReplacementMapping": {},
+        # Corrections for each wrong character in the end of sentence
+        "endReplacementMapping": {},
+        "combinationsUnnecessaryNext": {},
+        "combinationsPrecedingUnnecessaryNext": {},
+        "combinationsMissing": {}
+    }
 
 
-def generate_statistics():
+# Add partial counts into the total counts
+# Keys new to the total are appended in the order of the partial counts, so merging files in
+# the order they are read gives the same dictionaries as counting all of them in one loop
+def merge_counts(total, partial):
+    for key, value in partial.items():
+        if isinstance(value, dict):
+            merge_counts(total.setdefault(key, {}), value)
+        else:
+            total[key] = total.get(key, 0) + value
+    return total
+
+
+# Count punctuation errors of a single gold token file
+def count_file(src):
+    counts = new_counts()
+    sentenceCountByLevel = counts["sentenceCountByLevel"]
+    punctErrorCounts = counts["punctErrorCounts"]
+    punctErrorCountsByLevel = counts["punctErrorCountsByLevel"]
+    errorSentenceCountByLevel = counts["errorSentenceCountByLevel"]
+    missingPunctuation = counts["missingPunctuation"]
+    replacementPunctuation = counts["replacementPunctuation"]
+    middleReplacementPunctuation = counts["middleReplacementPunctuation"]
+    endReplacementPunctuation = counts["endReplacementPunctuation"]
+    unnecessaryPunctuation = counts["unnecessaryPunctuation"]
+    replacementMapping = counts["replacementMapping"]
+    middleReplacementMapping = counts["middleReplacementMapping"]
+    endReplacementMapping = counts["endReplacementMapping"]
+    combinationsUnnecessaryNext = counts["combinationsUnnecessaryNext"]
+    combinationsPrecedingUnnecessaryNext = counts["combinationsPrecedingUnnecessaryNext"]
+    combinationsMissing = counts["combinationsMissing"]
     sentenceCount = 0
-    sentenceCountByLevel = {"A2": 0, "B1": 0, "B2": 0, "C1": 0}
-    punctErrorCounts = {"M:PUNCT": 0, "U:PUNCT": 0, "R:PUNCT": 0}
-    punctErrorCountsByLevel = {"A2": 0, "B1": 0, "B2": 0, "C1": 0}
     errorSentenceCount = 0
-    errorSentenceCountByLevel = {"A2": 0, "B1": 0, "B2": 0, "C1": 0}
     isErrorSentence = False
-    missingPunctuation = {}  # Characters that have been missing
-    replacementPunctuation = {}  # Characters that have been wrong
-    middleReplacementPunctuation = {}  # Wrong characters in the middle of sentence
-    endReplacementPunctuation = {}  # Wrong characters in the end of sentence
-    unnecessaryPunctuation = {}  # Characters that have been unnecessary
-    replacementMapping = {}
-    # Corrections for each wrong character in the middle of sentence
-    middleReplacementMapping = {}
-    # Corrections for each wrong character in the end of sentence
-    endReplacementMapping = {}
     parameters = []  # Container for M2 markup
     characterToReplace = ''  # Character in the sentence needing to be replaced
     characterToReplaceIndex = 0  # Index of the character
-    nextWordsForUnnecessary = {}
-    combinationsUnnecessary = {}  # Unnecessary characters paired with following words
-    combinationsUnnecessaryNext = {}
-    combinationsPrecedingUnnecessaryNext = {}
-    combinationsMissing = {}
+
+    with open(src, "r", encoding="utf-8") as f:
+        language_level = os.path.basename(os.path.dirname(src))
+        # Annotations outside of the known language levels are counted under their directory name
+        for levelCounts in (sentenceCountByLevel, punctErrorCountsByLevel, errorSentenceCountByLevel):
+            levelCounts.setdefault(language_level, 0)
+        activeSentence = []
+
+        for line in f:
+            line = line.strip()
+
+            if not line:
+                continue
+
+            # Splitting the sentence using "|||"
+            parts = line.split("|||")
+
+            # Splitting the index part of the markup separated by whitespace, in case of source sentence ("S") this splits the whole sentence
+            parameters = parts[0].split()
+
+            if parameters[0] == "S":
+                isErrorSentence = False
+                sentenceCount += 1
+                sentenceCountByLevel[language_level] += 1
+                activeSentence = parameters  # Active sentence currently analyzed
+
+            if parameters[0] == "A":
+                if parts[-1] == "0":
+                    errorType = parts[1]
+
+                    # Count error types
+                    if errorType in punctErrorCounts:
+                        if isErrorSentence == False:
+                            errorSentenceCount += 1
+                            errorSentenceCountByLevel[language_level] += 1
+                            isErrorSentence = True
+                        # Punctutation presented as correction, in case of multiple options separated by "||"
+                        correction = parts[2].split("||")
+                        correctionLength = len(correction)
+                        punctErrorCounts[errorType] += 1
+                        punctErrorCountsByLevel[language_level] += 1
+
+                    # Replacement errors
+                    if errorType == "R:PUNCT":
+                        characterToReplaceIndex = int(parameters[1])
+                        characterToReplace = activeSentence[characterToReplaceIndex+1]
+
+                        position = "middle"
+                        if characterToReplaceIndex == len(activeSentence) - 2:
+                            position = "end"
+
+                        if characterToReplace not in replacementPunctuation:
+                            replacementPunctuation[characterToReplace] = 0
+                        replacementPunctuation[characterToReplace] += 1
+
+                        if position == "middle":
+                            if characterToReplace not in middleReplacementPunctuation:
+                                middleReplacementPunctuation[characterToReplace] = 0
+                            middleReplacementPunctuation[characterToReplace] += 1
+
+                        elif position == "end":
+                            if characterToReplace not in endReplacementPunctuation:
+                                endReplacementPunctuation[characterToReplace] = 0
+                            endReplacementPunctuation[characterToReplace] += 1
+
+                        for option in correction:
+                            if characterToReplace not in replacementMapping:
+                                replacementMapping[characterToReplace] = {}
+                            if option[0] not in replacementMapping[characterToReplace]:
+                                replacementMapping[characterToReplace][option[0]] = 0
+                            if correctionLength == 1:
+                                replacementMapping[characterToReplace][option[0]] += 1
+                            elif correctionLength > 1:
+                                replacementMapping[characterToReplace][option[0]] += 0.5
+
+                            if position == "middle":
+                                if characterToReplace not in middleReplacementMapping:
+                                    middleReplacementMapping[characterToReplace] = {
+                                    }
+                                if option[0] not in middleReplacementMapping[characterToReplace]:
+                                    middleReplacementMapping[characterToReplace][option[0]] = 0
+                                if correctionLength == 1:
+                                    middleReplacementMapping[characterToReplace][option[0]] += 1
+                                elif correctionLength > 1:
+                                    middleReplacementMapping[characterToReplace][option[0]] += 0.5
+
+                            elif position == "end":
+                                if characterToReplace not in endReplacementMapping:
+                                    endReplacementMapping[characterToReplace] = {
+                                    }
+                                if option[0] not in endReplacementMapping[characterToReplace]:
+                                    endReplacementMapping[characterToReplace][option[0]] = 0
+                                if correctionLength == 1:
+                                    endReplacementMapping[characterToReplace][option[0]] += 1
+                                elif correctionLength > 1:
+                                    endReplacementMapping[characterToReplace][option[0]] += 0.5
+
+                    # Missing errors
+                    if errorType == "M:PUNCT":
+                        missingPunctuations = correction
+                        missingPunctuationIndex = int(parameters[1])
+                        nextWord = None
+                        if missingPunctuationIndex < len(activeSentence) - 2:
+                            nextWord = activeSentence[missingPunctuationIndex + 1]
+                            if nextWord not in combinationsMissing:
+                                combinationsMissing[nextWord] = {}
+                        for missingPunctuationMark in missingPunctuations:
+                            if missingPunctuationMark not in missingPunctuation:
+                                missingPunctuation[missingPunctuationMark] = 0
+                            if correctionLength == 1:
+                                missingPunctuation[missingPunctuationMark] += 1
+                            elif correctionLength > 1:
+                                missingPunctuation[missingPunctuationMark] += 0.5
+                            if nextWord:
+                                if missingPunctuationMark not in combinationsMissing[nextWord]:
+                                    combinationsMissing[nextWord][missingPunctuationMark] = 0
+                                combinationsMissing[nextWord][missingPunctuationMark] += 1
+
+                    # Unnecessary errors
+                    if errorType == "U:PUNCT":
+                        unnecessaryCharacterIndex = int(parameters[1])
+                        unnecessaryCharacter = activeSentence[unnecessaryCharacterIndex + 1]
+                        precedingWord = activeSentence[unnecessaryCharacterIndex]
+                        nextWord = None
+
+                        if unnecessaryCharacterIndex < len(activeSentence) - 2:
+                            nextWord = activeSentence[unnecessaryCharacterIndex + 2]
+
+                        if unnecessaryCharacter not in unnecessaryPunctuation:
+                            unnecessaryPunctuation[unnecessaryCharacter] = 0
+                        unnecessaryPunctuation[unnecessaryCharacter] += 1
+
+                        # Handle combinations of "unnecessary character + nextWord"
+                        if nextWord:
+                            combination = f"{unnecessaryCharacter} + {nextWord}"
+                            if combination not in combinationsUnnecessaryNext:
+                                combinationsUnnecessaryNext[combination] = 0
+                            combinationsUnnecessaryNext[combination] += 1
+
+                        # Handle combinations of "precedingWord + unnecessary character + nextWord"
+                        if nextWord:
+                            combination = f"{precedingWord} + {unnecessaryCharacter} + {nextWord}"
+                            if combination not in combinationsPrecedingUnnecessaryNext:
+                                combinationsPrecedingUnnecessaryNext[combination] = 0
+                            combinationsPrecedingUnnecessaryNext[combination] += 1
+
+    counts["sentenceCount"] = sentenceCount
+    counts["errorSentenceCount"] = errorSentenceCount
+    return counts
+
+
+# Paths to gold token files, annotated files are grouped into directories by language level
+def collect_paths(source_dirs=None):
+    if not source_dirs:
+        source_dirs = ["./source_test"]
+    paths = []
+    for source_dir in source_dirs:
+        paths.extend(glob.glob(os.path.join(source_dir, "*", "*.txt")))
+    return paths
+
+
+# Hash of the annotated files, stored with the statistics to tell which data they were generated from
+# Files are hashed in a fixed order by their language level and name, so moving the directory keeps the hash
+def hash_sources(paths):
+    digest = hashlib.sha256()
+    for path in sorted(paths, key=lambda path: (os.path.basename(os.path.dirname(path)), os.path.basename(path))):
+        name = os.path.basename(os.path.dirname(path)) + "/" + os.path.basename(path)
+        with open(path, "rb") as f:
+            content = f.read()
+        digest.update(f"{name}\0{len(content)}\0".encode("utf8"))
+        digest.update(content)
+    return digest.hexdigest()
+
+
+# Count punctuation errors of all files, in worker processes if more than one worker is given
+# Partial counts are reduced in the order of the paths, so the result does not depend on the number of workers
+# Workers are profiled into files of their own when a profile prefix is given
+def count_files(paths, workers=1, profile_prefix=None):
+    counts = new_counts()
+    started = instrumentation.start()
+    if workers > 1:
+        initializer = instrumentation.profile_worker if profile_prefix else None
+        with multiprocessing.Pool(workers, initializer=initializer, initargs=(profile_prefix,)) as pool:
+            for partial in pool.imap(count_file, paths, chunksize=max(1, len(paths) // (workers * 8))):
+                started = instrumentation.lap("counting", started)
+                merge_counts(counts, partial)
+                started = instrumentation.lap("merging", started)
+            # Workers write their profiles only when they exit normally
+            pool.close()
+            pool.join()
+    else:
+        for src in paths:
+            partial = count_file(src)
+            started = instrumentation.lap("counting", started)
+            merge_counts(counts, partial)
+            started = instrumentation.lap("merging", started)
+    return counts
+
+
+# Single key for every row of the given columns of symbols, equal rows get equal keys
+# Columns are added one at a time to the ranks of the rows so far, so the keys don't overflow
+def row_keys(columns):
+    keys = columns[0]
+    for column in columns[1:]:
+        _, ranks = numpy.unique(keys, return_inverse=True)
+        keys = ranks.reshape(-1) * (int(column.max()) + 1 if len(column) else 1) + column
+    return keys
+
+
+# Sums of weights by key, in the order the keys first appear
+# Returns the index of the first appearance of every distinct key and its sum. A sum stays an integer
+# unless half weights were added to it, like the counts of count_file
+def ordered_sums(keys, weights=None):
+    unique, first, inverse = numpy.unique(keys, return_index=True, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    if weights is None:
+        sums = numpy.bincount(inverse, minlength=len(unique))
+        halves = numpy.zeros(len(unique), dtype=bool)
+    else:
+        sums = numpy.bincount(inverse, weights, minlength=len(unique))
+        halves = numpy.bincount(inverse, weights != 1, minlength=len(unique)) > 0
+    order = numpy.argsort(first, kind="stable")
+    return first[order], [float(value) if half else int(value)
+                          for value, half in zip(sums[order].tolist(), halves[order].tolist())]
+
+
+# Dictionary of the sums of weights by symbol, in the order the symbols first appear
+def symbol_sums(corpus, symbols, weights=None):
+    first, values = ordered_sums(symbols, weights)
+    return dict(zip([corpus.symbols[symbol] for symbol in symbols[first].tolist()], values))
+
+
+# Nested dictionary of the sums of weights by outer and inner symbol, in the order the symbols first appear
+def nested_symbol_sums(corpus, outer, inner, weights=None):
+    table = {}
+    first, values = ordered_sums(row_keys([outer, inner]), weights)
+    for outer_symbol, inner_symbol, value in zip(outer[first].tolist(), inner[first].tolist(), values):
+        table.setdefault(corpus.symbols[outer_symbol], {})[corpus.symbols[inner_symbol]] = value
+    return table
+
+
+# Correction options of the given edits, split at "||" like in count_file
+# Returns the edit of every option, the option and its first character as symbols, and its weight,
+# 1 for a single option and 0.5 for each of several options
+def correction_options(corpus, corrections):
+    unique, inverse = numpy.unique(corrections, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    option_lists = [corpus.string(correction).split("||") for correction in unique.tolist()]
+    lengths = numpy.array([len(options) for options in option_lists], dtype=numpy.int64)
+    starts = numpy.cumsum(lengths) - lengths
+    options = numpy.array([corpus.intern(option) for options in option_lists for option in options],
+                          dtype=numpy.int64)
+    firsts = numpy.array([corpus.intern(option[0]) for options in option_lists for option in options],
+                         dtype=numpy.int64)
+
+    option_counts = lengths[inverse]
+    edits = numpy.repeat(numpy.arange(len(corrections)), option_counts)
+    positions = (numpy.repeat(starts[inverse] - (numpy.cumsum(option_counts) - option_counts), option_counts)
+                 + numpy.arange(len(edits)))
+    weights = numpy.where(option_counts[edits] == 1, 1.0, 0.5)
+    return edits, options[positions], firsts[positions], weights
+
+
+# Count punctuation errors of the columns of the gold token files, giving the same counts as count_files
+# Every table is a single aggregation over the edit columns instead of a loop over the lines
+def count_corpus(corpus):
+    counts = new_counts()
+    for level, sentences in zip(corpus.levels, corpus.file_sentences):
+        for levelCounts in (counts["sentenceCountByLevel"], counts["punctErrorCountsByLevel"],
+                            counts["errorSentenceCountByLevel"]):
+            levelCounts.setdefault(level, 0)
+        counts["sentenceCountByLevel"][level] += sentences
+    counts["sentenceCount"] = corpus.sentence_count
+
+    # Only the edits of the first annotator are counted
+    annotated = corpus.symbols_of(corpus.edit_annotators) == corpus.intern("0")
+    types = corpus.symbols_of(corpus.edit_types)
+    type_edits = {errorType: annotated & (types == corpus.intern(errorType))
+                  for errorType in counts["punctErrorCounts"]}
+    punctEdits = numpy.logical_or.reduce(list(type_edits.values()))
+    for errorType, edits in type_edits.items():
+        counts["punctErrorCounts"][errorType] = int(numpy.count_nonzero(edits))
+
+    level_count = len(corpus.level_names)
+    errorLevels = numpy.bincount(corpus.sentence_levels[corpus.edit_sentences[punctEdits]], minlength=level_count)
+    errorSentences = numpy.unique(corpus.edit_sentences[punctEdits])
+    errorSentenceLevels = numpy.bincount(corpus.sentence_levels[errorSentences], minlength=level_count)
+    for index, level in enumerate(corpus.level_names):
+        counts["punctErrorCountsByLevel"][level] += int(errorLevels[index])
+        counts["errorSentenceCountByLevel"][level] += int(errorSentenceLevels[index])
+    counts["errorSentenceCount"] = len(errorSentences)
+
+    # Replacement errors, the replaced character is the token at the start of the edit
+    edits = type_edits["R:PUNCT"]
+    sentences = corpus.edit_sentences[edits]
+    indexes = corpus.edit_starts[edits]
+    characters = corpus.symbols_of(corpus.token_at(sentences, indexes))
+    atEnd = indexes == corpus.sentence_lengths[sentences] - 1
+    counts["replacementPunctuation"] = symbol_sums(corpus, characters)
+    counts["middleReplacementPunctuation"] = symbol_sums(corpus, characters[~atEnd])
+    counts["endReplacementPunctuation"] = symbol_sums(corpus, characters[atEnd])
+    optionEdits, _, firsts, weights = correction_options(corpus, corpus.edit_corrections[edits])
+    optionCharacters = characters[optionEdits]
+    optionAtEnd = atEnd[optionEdits]
+    counts["replacementMapping"] = nested_symbol_sums(corpus, optionCharacters, firsts, weights)
+    counts["middleReplacementMapping"] = nested_symbol_sums(
+        corpus, optionCharacters[~optionAtEnd], firsts[~optionAtEnd], weights[~optionAtEnd])
+    counts["endReplacementMapping"] = nested_symbol_sums(
+        corpus, optionCharacters[optionAtEnd], firsts[optionAtEnd], weights[optionAtEnd])
+
+    # Missing errors, the following word is the token at the start of the edit unless it is the last token
+    edits = type_edits["M:PUNCT"]
+    sentences = corpus.edit_sentences[edits]
+    indexes = corpus.edit_starts[edits]
+    hasNext = indexes < corpus.sentence_lengths[sentences] - 1
+    nextWords = numpy.zeros(len(indexes), dtype=numpy.int64)
+    nextWords[hasNext] = corpus.symbols_of(corpus.token_at(sentences[hasNext], indexes[hasNext]))
+    optionEdits, options, _, weights = correction_options(corpus, corpus.edit_corrections[edits])
+    counts["missingPunctuation"] = symbol_sums(corpus, options, weights)
+    optionHasNext = hasNext[optionEdits]
+    counts["combinationsMissing"] = nested_symbol_sums(
+        corpus, nextWords[optionEdits][optionHasNext], options[optionHasNext])
+
+    # Unnecessary errors, with the preceding word ("S" before the first token) and the following word
+    edits = type_edits["U:PUNCT"]
+    sentences = corpus.edit_sentences[edits]
+    indexes = corpus.edit_starts[edits]
+    characters = corpus.symbols_of(corpus.token_at(sentences, indexes))
+    counts["unnecessaryPunctuation"] = symbol_sums(corpus, characters)
+    hasNext = indexes < corpus.sentence_lengths[sentences] - 1
+    sentences, indexes, characters = sentences[hasNext], indexes[hasNext], characters[hasNext]
+    nextWords = corpus.symbols_of(corpus.token_at(sentences, indexes + 1))
+    precedingWords = numpy.full(len(indexes), corpus.intern("S"), dtype=numpy.int64)
+    hasPreceding = indexes > 0
+    precedingWords[hasPreceding] = corpus.symbols_of(
+        corpus.token_at(sentences[hasPreceding], indexes[hasPreceding] - 1))
+    symbols = corpus.symbols
+    first, values = ordered_sums(row_keys([characters, nextWords]))
+    counts["combinationsUnnecessaryNext"] = {
+        f"{symbols[character]} + {symbols[nextWord]}": count
+        for character, nextWord, count in zip(characters[first].tolist(), nextWords[first].tolist(), values)}
+    first, values = ordered_sums(row_keys([precedingWords, characters, nextWords]))
+    counts["combinationsPrecedingUnnecessaryNext"] = {
+        f"{symbols[precedingWord]} + {symbols[character]} + {symbols[nextWord]}": count
+        for precedingWord, character, nextWord, count
+        in zip(precedingWords[first].tolist(), characters[first].tolist(), nextWords[first].tolist(), values)}
+    return counts
+
+
+# Count punctuation errors of all files from their columns, parsing only the files missing from the cache
+def count_cached(paths, cache_dir, workers=1, profile_prefix=None):
+    started = instrumentation.start()
+    files = m2cache.load_files(paths, cache_dir, workers, profile_prefix)
+    parsed = sum(not parsed_file.cached for parsed_file in files)
+    logger.info("Loaded %d gold token files from the cache in %s, parsed %d", len(files) - parsed, cache_dir, parsed)
+    corpus = m2cache.Corpus(files, [os.path.basename(os.path.dirname(path)) for path in paths])
+    started = instrumentation.lap("loading", started)
+    counts = count_corpus(corpus)
+    instrumentation.stop("counting", started)
+    return counts
+
+
+# Statistics of the gold token files, counted from the parse-once cache in cache_dir when it is given
+# and NumPy is installed, and by parsing every file otherwise
+# unnecessary_top and missing_top are the numbers of the most frequent unnecessary and missing punctuation
+# combinations kept, 0 keeps every combination
+def generate_statistics(source_dirs=None, workers=1, unnecessary_top=5, profile_prefix=None, cache_dir=None,
+                        missing_top=10):
+    paths = collect_paths(source_dirs)
+    if cache_dir and numpy is not None:
+        counts = count_cached(paths, cache_dir, workers, profile_prefix)
+    else:
+        if cache_dir:
+            logger.info("NumPy is not installed, the gold token files are parsed without the cache")
+        counts = count_files(paths, workers, profile_prefix)
+    started = instrumentation.start()
+    sentenceCount = counts["sentenceCount"]
+    sentenceCountByLevel = counts["sentenceCountByLevel"]
+    punctErrorCounts = counts["punctErrorCounts"]
+    punctErrorCountsByLevel = counts["punctErrorCountsByLevel"]
+    errorSentenceCount = counts["errorSentenceCount"]
+    errorSentenceCountByLevel = counts["errorSentenceCountByLevel"]
+    missingPunctuation = counts["missingPunctuation"]
+    replacementPunctuation = counts["replacementPunctuation"]
+    middleReplacementPunctuation = counts["middleReplacementPunctuation"]
+    endReplacementPunctuation = counts["endReplacementPunctuation"]
+    unnecessaryPunctuation = counts["unnecessaryPunctuation"]
+    replacementMapping = counts["replacementMapping"]
+    middleReplacementMapping = counts["middleReplacementMapping"]
+    endReplacementMapping = counts["endReplacementMapping"]
+    combinationsUnnecessaryNext = counts["combinationsUnnecessaryNext"]
+    combinationsPrecedingUnnecessaryNext = counts["combinationsPrecedingUnnecessaryNext"]
+    combinationsMissing = counts["combinationsMissing"]
+    combinationsUnnecessary = []  # (unnecessary character, following word, count) rows
     totalFixes = {}  # Characters that have been used as corrections
     endFixes = {}
     middleFixes = {}
@@ -71,152 +537,6 @@ def generate_statistics():
 
     combination_entries = []
 
-    # Path to gold token files
-    paths = glob.glob(r"./source_test/*/*.txt")
-
-    for src in paths:
-        with open(src, "r", encoding="utf-8") as f:
-            language_level = os.path.basename(os.path.dirname(src))
-            activeSentence = []
-
-            for line in f:
-                line = line.strip()
-
-                if not line:
-                    continue
-
-                # Splitting the sentence using "|||"
-                parts = line.split("|||")
-
-                # Splitting the index part of the markup separated by whitespace, in case of source sentence ("S") this splits the whole sentence
-                parameters = parts[0].split()
-
-                if parameters[0] == "S":
-                    isErrorSentence = False
-                    sentenceCount += 1
-                    sentenceCountByLevel[language_level] += 1
-                    activeSentence = parameters  # Active sentence currently analyzed
-
-                if parameters[0] == "A":
-                    if parts[-1] == "0":
-                        errorType = parts[1]
-
-                        # Count error types
-                        if errorType in punctErrorCounts:
-                            if isErrorSentence == False:
-                                errorSentenceCount += 1
-                                errorSentenceCountByLevel[language_level] += 1
-                                isErrorSentence = True
-                            # Punctutation presented as correction, in case of multiple options separated by "||"
-                            correction = parts[2].split("||")
-                            correctionLength = len(correction)
-                            punctErrorCounts[errorType] += 1
-                            punctErrorCountsByLevel[language_level] += 1
-
-                        # Replacement errors
-                        if errorType == "R:PUNCT":
-                            characterToReplaceIndex = int(parameters[1])
-                            characterToReplace = activeSentence[characterToReplaceIndex+1]
-
-                            position = "middle"
-                            if characterToReplaceIndex == len(activeSentence) - 2:
-                                position = "end"
-
-                            if characterToReplace not in replacementPunctuation:
-                                replacementPunctuation[characterToReplace] = 0
-                            replacementPunctuation[characterToReplace] += 1
-
-                            if position == "middle":
-                                if characterToReplace not in middleReplacementPunctuation:
-                                    middleReplacementPunctuation[characterToReplace] = 0
-                                middleReplacementPunctuation[characterToReplace] += 1
-
-                            elif position == "end":
-                                if characterToReplace not in endReplacementPunctuation:
-                                    endReplacementPunctuation[characterToReplace] = 0
-                                endReplacementPunctuation[characterToReplace] += 1
-
-                            for option in correction:
-                                if characterToReplace not in replacementMapping:
-                                    replacementMapping[characterToReplace] = {}
-                                if option[0] not in replacementMapping[characterToReplace]:
-                                    replacementMapping[characterToReplace][option[0]] = 0
-                                if correctionLength == 1:
-                                    replacementMapping[characterToReplace][option[0]] += 1
-                                elif correctionLength > 1:
-                                    replacementMapping[characterToReplace][option[0]] += 0.5
-
-                                if position == "middle":
-                                    if characterToReplace not in middleReplacementMapping:
-                                        middleReplacementMapping[characterToReplace] = {
-                                        }
-                                    if option[0] not in middleReplacementMapping[characterToReplace]:
-                                        middleReplacementMapping[characterToReplace][option[0]] = 0
-                                    if correctionLength == 1:
-                                        middleReplacementMapping[characterToReplace][option[0]] += 1
-                                    elif correctionLength > 1:
-                                        middleReplacementMapping[characterToReplace][option[0]] += 0.5
-
-                                elif position == "end":
-                                    if characterToReplace not in endReplacementMapping:
-                                        endReplacementMapping[characterToReplace] = {
-                                        }
-                                    if option[0] not in endReplacementMapping[characterToReplace]:
-                                        endReplacementMapping[characterToReplace][option[0]] = 0
-                                    if correctionLength == 1:
-                                        endReplacementMapping[characterToReplace][option[0]] += 1
-                                    elif correctionLength > 1:
-                                        endReplacementMapping[characterToReplace][option[0]] += 0.5
-
-                        # Missing errors
-                        if errorType == "M:PUNCT":
-                            missingPunctuations = correction
-                            missingPunctuationIndex = int(parameters[1])
-                            nextWord = None
-                            if missingPunctuationIndex < len(activeSentence) - 2:
-                                nextWord = activeSentence[missingPunctuationIndex + 1]
-                                if nextWord not in combinationsMissing:
-                                    combinationsMissing[nextWord] = {}
-                            for missingPunctuationMark in missingPunctuations:
-                                if missingPunctuationMark not in missingPunctuation:
-                                    missingPunctuation[missingPunctuationMark] = 0
-                                if correctionLength == 1:
-                                    missingPunctuation[missingPunctuationMark] += 1
-                                elif correctionLength > 1:
-                                    missingPunctuation[missingPunctuationMark] += 0.5
-                                if nextWord:
-                                    if missingPunctuationMark not in combinationsMissing[nextWord]:
-                                        combinationsMissing[nextWord][missingPunctuationMark] = 0
-                                    combinationsMissing[nextWord][missingPunctuationMark] += 1
-
-                        # Unnecessary errors
-                        if errorType == "U:PUNCT":
-                            unnecessaryCharacterIndex = int(parameters[1])
-                            unnecessaryCharacter = activeSentence[unnecessaryCharacterIndex + 1]
-                            precedingWord = activeSentence[unnecessaryCharacterIndex]
-                            nextWord = None
-
-                            if unnecessaryCharacterIndex < len(activeSentence) - 2:
-                                nextWord = activeSentence[unnecessaryCharacterIndex + 2]
-
-                            if unnecessaryCharacter not in unnecessaryPunctuation:
-                                unnecessaryPunctuation[unnecessaryCharacter] = 0
-                            unnecessaryPunctuation[unnecessaryCharacter] += 1
-
-                            # Handle combinations of "unnecessary character + nextWord"
-                            if nextWord:
-                                combination = f"{unnecessaryCharacter} + {nextWord}"
-                                if combination not in combinationsUnnecessaryNext:
-                                    combinationsUnnecessaryNext[combination] = 0
-                                combinationsUnnecessaryNext[combination] += 1
-
-                            # Handle combinations of "precedingWord + unnecessary character + nextWord"
-                            if nextWord:
-                                combination = f"{precedingWord} + {unnecessaryCharacter} + {nextWord}"
-                                if combination not in combinationsPrecedingUnnecessaryNext:
-                                    combinationsPrecedingUnnecessaryNext[combination] = 0
-                                combinationsPrecedingUnnecessaryNext[combination] += 1
-
     # Percentages
     totalPunctErrors = sum(punctErrorCounts.values())
     totalPunctErrorsPercentage = (errorSentenceCount / sentenceCount * 100)
@@ -228,11 +548,7 @@ def generate_statistics():
     rErrCount = punctErrorCounts["R:PUNCT"]
 
     # Statistics output
-
-    filenametime = time + "_statistics_summary.txt"
-    filename = (os.path.join(output_dir, filenametime))
-    file = open(filename, "w", encoding="utf8")
-    file.close
+    start_summary_file()
 
     flattened_counts = []
     for word, punct_counts in combinationsMissing.items():
@@ -242,10 +558,10 @@ def generate_statistics():
     # Sort the list of tuples by count in descending order
     sorted_counts = sorted(flattened_counts, key=lambda x: x[2], reverse=True)
 
-    # Extract and print the top 5 combinations
-    missingCombinations = sorted_counts[:10]
-    for word, punct, count in missingCombinations:
-        print(f"{punct} + {word}: {count} korda")
+    # Keep the top combinations and log the top 10 of them
+    missingCombinations = sorted_counts[:missing_top] if missing_top else sorted_counts
+    for punct, word, count in missingCombinations[:10]:
+        logger.debug("%s + %s: %s korda", punct, word, count)
 
     save_to_file(f"Kõikide lausete arv: {sentenceCount}\n")
 
@@ -279,12 +595,13 @@ def generate_statistics():
         percentage_unnecessary_punctuation[mark] = round(
             (unnecessaryPunctuation[mark] / uErrCount * 100), 2)
 
-   # Iterate through the sorted combinationsUnnecessaryNext and save the top 5 entries
+   # Iterate through the sorted combinationsUnnecessaryNext and save the top entries
+    # Every character seen before a following word is kept, like the missing combinations
     for index, (combination, count) in enumerate(sorted(combinationsUnnecessaryNext.items(), key=lambda item: item[1], reverse=True)):
-        if index < 5:
+        if not unnecessary_top or index < unnecessary_top:
             parts = combination.split(" + ")
             unnecessaryChar, nextWord = parts[0], parts[1]
-            combinationsUnnecessary[nextWord] = unnecessaryChar
+            combinationsUnnecessary.append((unnecessaryChar, nextWord, count))
             entry = f"{unnecessaryChar} + {nextWord}: {count} korda"
             combination_entries.append(entry)
 
@@ -369,7 +686,8 @@ def generate_statistics():
         percentage_middle_fixes[fix] = round(
             (count / totalFixes[fix] * 100), 2)
 
-    print(combinationsUnnecessary)
+    logger.debug("Unnecessary combinations: %s", combinationsUnnecessary)
+    instrumentation.stop("percentages", started)
 
     return {
         # Total punctuation errors percentage
@@ -398,11 +716,60 @@ def generate_statistics():
         "endFixPercentages": percentage_end_fixes,
         # Characters used as corrections in the middle
         "middleFixPercentages": percentage_middle_fixes,
-        # Pairs of unnecessary character and following word,
+        # Unnecessary character, following word and count
         "unnecessaryCombinations": combinationsUnnecessary,
         # Pairs of missing character and following word
         "missingCombinations": missingCombinations
     }
 
 
-generate_statistics()
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generates statistics of punctuation errors from annotated text files")
+    parser.add_argument("--source", nargs="+", metavar="DIR",
+                        help="directories of gold token files grouped by language level, ./source_test by default")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes counting files in parallel")
+    parser.add_argument("--unnecessary-top", type=int, default=5,
+                        help="number of the most frequent unnecessary character and following word combinations kept, "
+                             "0 keeps all")
+    parser.add_argument("--missing-top", type=int, default=10,
+                        help="number of the most frequent missing character and following word combinations kept, "
+                             "0 keeps all")
+    parser.add_argument("--statistics", metavar="FILE",
+                        help="also save the statistics into this statistics file for the synthesizer")
+    cache = parser.add_mutually_exclusive_group()
+    cache.add_argument("--cache", default=CACHE_DIR, metavar="DIR",
+                       help="directory of the parse-once cache of the gold token files, ./m2_cache by default")
+    cache.add_argument("--no-cache", dest="cache", action="store_const", const=None,
+                       help="parse every gold token file instead of using the cache")
+    parser.add_argument("--log-level", choices=reporting.LOG_LEVELS, default="INFO",
+                        help="level of the logged messages, DEBUG logs the most frequent combinations")
+    parser.add_argument("--profile", nargs="?", const="analyzer", metavar="PREFIX",
+                        help="profile the run into PREFIX.prof, and every worker into PREFIX.worker-PID.prof, "
+                             "and time the stages of the analysis. PREFIX is analyzer by default")
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers must be positive")
+    if args.unnecessary_top < 0 or args.missing_top < 0:
+        parser.error("--unnecessary-top and --missing-top can't be negative")
+    reporting.configure_logging(args.log_level)
+
+    profiler = None
+    if args.profile:
+        instrumentation.enable()
+        profiler = instrumentation.start_profile()
+    statistics = generate_statistics(args.source, args.workers, args.unnecessary_top, args.profile, args.cache,
+                                     args.missing_top)
+    if args.statistics:
+        statistics_store.write_statistics(statistics, args.statistics, hash_sources(collect_paths(args.source)))
+        logger.info("Statistics written to %s", args.statistics)
+    if profiler:
+        instrumentation.dump_profile(profiler, f"{args.profile}.prof")
+        logger.info("Stage timers: %s", json.dumps(instrumentation.snapshot()))
+        logger.info("Profile written to %s.prof", args.profile)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,505 @@
+# This file is part of the EstGEC punctuation error synthesizer
+# Author: Christian-Enrique Hindremäe
+# 2024
+
+# file: benchmark.py
+#
+# Benchmarks of the analyzer, segmentation, tokenization, error generation, the whole synthesizer and
+# the synthesis server on generated Estonian-like corpora of a given size. Runs offline, corpora are
+# generated locally and kept in the work directory for later runs
+
+# Usage: python benchmark.py [--sentences N ...] [--output FILE] [--baseline FILE] [--tolerance SHARE]
+#                            [--fail-on-regression] [--work-dir DIR] [--repeat N] [--micro-limit N]
+#                            [--workers N] [--tokenizer nltk|regex] [--nltk-data DIR] [--seed N]
+# Where
+#   --sentences - sizes of the generated corpora in sentences, 10000 by default
+#   --output - JSON file of the results, benchmark_results.json by default
+#   --baseline - JSON results of an earlier run to compare with
+#   --tolerance - share of throughput which can be lost before a benchmark counts as a regression, 0.1 by default
+#   --fail-on-regression - exit with status 1 if any benchmark is slower than the baseline allows
+#   --work-dir - directory of the generated corpora, ./benchmark_data by default
+#   --repeat - number of runs of every benchmark, the fastest run is reported, 3 by default
+#   --micro-limit - number of sentences used by the benchmarks of single functions, 100000 by default
+#   --workers - number of processes of the analyzer and synthesizer, 1 by default
+#   --tokenizer - word tokenizer used by the synthesis benchmarks, nltk by default
+#   --nltk-data - local directory containing the punkt sentence tokenizer data
+#   --seed - seed of the generated corpora, 1 by default
+
+# Output:
+#   JSON file with the environment, parameters, and for every corpus size the time, number of
+#   items and items per second of every benchmark, compared with the baseline if one is given
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import platform
+import subprocess
+from itertools import islice
+from datetime import datetime
+import threading
+import analyzer
+import client
+import error_generator
+import m2cache
+import reporting
+import segmenter
+import statistics_store
+import synthesizer
+import tokenizer
+
+logger = logging.getLogger("benchmark")
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+LEVELS = ["A2", "B1", "B2", "C1"]
+SENTENCES_PER_FILE = 1000
+NOOP_ANNOTATION = "A -1 -1|||noop|||-NONE-|||-NONE-|||-NONE-|||0"
+
+# Clients sending requests to the synthesis server at once, and sentences in a request
+SERVER_CLIENTS = 32
+SERVER_REQUEST_SENTENCES = 50
+
+# Frequent Estonian words, the rest of the words are made of syllables
+COMMON_WORDS = [
+    "ma", "sa", "ta", "me", "te", "nad", "see", "too", "on", "ei", "ole", "oli", "olen", "oma", "ka", "veel",
+    "väga", "nüüd", "täna", "homme", "eile", "kõik", "midagi", "kedagi", "seal", "siin", "kodus", "koolis",
+    "tööl", "linnas", "aasta", "päeval", "õhtul", "hommikul", "sõber", "ema", "isa", "õde", "vend", "raha",
+    "aega", "tahan", "tahaksin", "saan", "pean", "läksin", "tulin", "arvan", "tean", "loodan", "meeldib",
+    "elan", "töötan", "õpin", "räägin", "kirjutan", "loen", "hea", "halb", "suur", "väike", "uus", "vana",
+    "ilus", "huvitav", "tähtis", "raske", "lihtne", "eesti", "keelt", "raamatut", "kirja", "maja", "autot",
+]
+# Words starting a clause after a comma
+CONJUNCTIONS = ["et", "kui", "aga", "mis", "mida", "sest", "kuid", "kuidas", "siis", "kus", "millal", "ja"]
+SYLLABLES = ["ka", "ma", "ta", "la", "sa", "pa", "ra", "va", "ki", "mi", "ti", "li", "si", "pi", "ri", "ke",
+             "me", "te", "le", "se", "ne", "ku", "mu", "tu", "lu", "su", "ko", "mo", "to", "lo", "sõ", "kä",
+             "mä", "tä", "lö", "sü", "aa", "ee", "ii", "uu", "nd", "st", "ks", "ld", "rt"]
+END_MARKS = [".", ".", ".", ".", ".", ".", ".", ".", "?", "!"]
+WRONG_MARKS = {".": ["!", ",", "?"], "?": [".", "!"], "!": [".", "?"], ",": [".", ":", ";"]}
+
+
+def make_word(rng):
+    if rng.random() < 0.6:
+        return rng.choice(COMMON_WORDS)
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+
+# Tokens of a correct sentence, clauses after the first one start with a comma and a conjunction
+def make_sentence(rng, clauses=None):
+    tokens = []
+    for clause in range(clauses or rng.choice([1, 1, 2, 2, 3])):
+        if clause:
+            if rng.random() < 0.9:
+                tokens.append(",")
+            tokens.append(rng.choice(CONJUNCTIONS))
+        tokens.extend(make_word(rng) for _ in range(rng.randint(2, 7)))
+        if rng.random() < 0.03:
+            tokens.extend([":", make_word(rng), ",", make_word(rng)])
+    tokens[0] = tokens[0].capitalize()
+    tokens.append(rng.choice(END_MARKS))
+    return tokens
+
+
+def detokenize(tokens):
+    return re.sub(r" ([,.!?:;)])", r"\1", " ".join(tokens))
+
+
+# Learner version of a sentence with a single punctuation error and its M2 annotation
+# Returns the tokens unchanged with a noop annotation if the error can't be made in the sentence
+def make_error(rng, tokens, error_type):
+    if error_type == "m":
+        commas = [index for index, token in enumerate(tokens) if token == ","]
+        if commas:
+            index = rng.choice(commas)
+            return tokens[:index] + tokens[index + 1:], f"A {index} {index}|||M:PUNCT|||,|||REQUIRED|||-NONE-|||0"
+        # Clause without a comma, the comma is annotated as missing before the conjunction
+        conjunctions = [index for index, token in enumerate(tokens) if index and token in CONJUNCTIONS]
+        if conjunctions:
+            index = rng.choice(conjunctions)
+            return tokens, f"A {index} {index}|||M:PUNCT|||,|||REQUIRED|||-NONE-|||0"
+    elif error_type == "u":
+        options = [index for index in range(1, len(tokens) - 1)
+                   if tokens[index - 1] not in WRONG_MARKS and tokens[index] not in WRONG_MARKS]
+        if options:
+            index = rng.choice(options)
+            mark = rng.choice([",", ",", ",", '"', "."])
+            return tokens[:index] + [mark] + tokens[index:], \
+                f"A {index} {index + 1}|||U:PUNCT|||-NONE-|||REQUIRED|||-NONE-|||0"
+    else:
+        marks = [index for index, token in enumerate(tokens) if token in WRONG_MARKS]
+        index = rng.choice(marks)
+        wrong = rng.choice(WRONG_MARKS[tokens[index]])
+        return tokens[:index] + [wrong] + tokens[index + 1:], \
+            f"A {index} {index + 1}|||R:PUNCT|||{tokens[index]}|||REQUIRED|||-NONE-|||0"
+    return tokens, NOOP_ANNOTATION
+
+
+# Generate a corpus of the given size into its own directory of the work directory
+#   text.txt - correct sentences as plain text, a few sentences per line and some sentences split over two lines
+#   sentences.txt - the same sentences one per line
+#   gold/LEVEL/*.txt - M2 files of learner versions of the sentences, a quarter of them with a punctuation error
+#   m2_cache - parse-once cache of the M2 files, filled by the analyzer benchmark
+# A finished corpus is marked with a file of its own and reused by later runs
+def generate_corpus(work_dir, sentence_count, seed):
+    corpus_dir = os.path.join(work_dir, f"corpus-{sentence_count}-{seed}")
+    marker = os.path.join(corpus_dir, "complete")
+    if os.path.exists(marker):
+        return corpus_dir
+
+    logger.info("Generating a corpus of %s sentences into %s", sentence_count, corpus_dir)
+    rng = random.Random(seed)
+    gold_file = None
+    with open(prepare_path(corpus_dir, "text.txt"), "w", encoding="utf8") as text_file, \
+            open(os.path.join(corpus_dir, "sentences.txt"), "w", encoding="utf8") as sentence_file:
+        line = []
+        for index in range(sentence_count):
+            tokens = make_sentence(rng, clauses=2 if index == 1 else None)
+            sentence = detokenize(tokens)
+            sentence_file.write(sentence + "\n")
+
+            # Plain text lines of up to five sentences, some sentences continue on the next line
+            split = sentence.find(" ", len(sentence) // 2) if rng.random() < 0.05 else -1
+            if split > 0:
+                line.append(sentence[:split])
+                text_file.write(" ".join(line) + "\n")
+                line = [sentence[split + 1:]]
+            else:
+                line.append(sentence)
+                if len(line) >= rng.randint(1, 5):
+                    text_file.write(" ".join(line) + "\n")
+                    line = []
+
+            if index % SENTENCES_PER_FILE == 0:
+                if gold_file:
+                    gold_file.close()
+                level = LEVELS[index // SENTENCES_PER_FILE % len(LEVELS)]
+                gold_path = prepare_path(os.path.join(corpus_dir, "gold", level),
+                                         f"synthetic_{index // SENTENCES_PER_FILE:05d}.txt")
+                gold_file = open(gold_path, "w", encoding="utf8")
+            # Every kind of error is present from the first sentences on, so the statistics are complete
+            if index < 3:
+                error_type = "umr"[index]
+            else:
+                error_type = rng.choice("umr") if rng.random() < 0.25 else None
+            if error_type:
+                learner_tokens, annotation = make_error(rng, tokens, error_type)
+            else:
+                learner_tokens, annotation = tokens, NOOP_ANNOTATION
+            gold_file.write(f"S {' '.join(learner_tokens)}\n{annotation}\n\n")
+        if line:
+            text_file.write(" ".join(line) + "\n")
+    if gold_file:
+        gold_file.close()
+
+    open(marker, "w").close()
+    return corpus_dir
+
+
+def prepare_path(directory, name):
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, name)
+
+
+# Run a benchmark the given number of times, the function returns the number of items it processed
+def measure(function, repeat=1):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        items = function()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return {"seconds": round(best, 6), "items": items,
+            "items_per_second": round(items / best, 1) if best else None}
+
+
+def read_sentences(path, limit):
+    with open(path, "r", encoding="utf8") as f:
+        return [line.rstrip("\n") for line in islice(f, limit)]
+
+
+def count_items(iterable):
+    count = 0
+    for _ in iterable:
+        count += 1
+    return count
+
+
+# Benchmarks of single functions on the first sentences of a corpus
+# Arguments of the functions are prepared before timing, so only the calls themselves are measured
+def function_benchmarks(sentences, stats, tokenize, rng):
+    parsed = [error_generator.parse_sentence(sentence) for sentence in sentences]
+    u_arguments = [(sentence, ",", rng.randrange(1, len(sentence.words)))
+                   for sentence in parsed if len(sentence.words) > 1]
+    m_arguments = [(sentence, rng.choice(sentence.marks)[0]) for sentence in parsed if sentence.marks]
+    r_arguments = [(sentence, ",", ".", "middle") if "," in sentence.punctuations
+                   else (sentence, sentence.punctuations[-1], "!", "end")
+                   for sentence in parsed if sentence.marks]
+    pairs = [(arguments[0].text, error_generator.generate_u_error(*arguments)) for arguments in u_arguments]
+    u_combinations = stats["u_combinations"]
+
+    def run(function, arguments):
+        for argument in arguments:
+            function(*argument)
+        return len(arguments)
+
+    def synthesize():
+        return sum(len(results) for results, _ in synthesizer.synthesize_serial(sentences, stats, 1000))
+
+    return {
+        "tokenizer.nltk_tokenize": lambda: run(tokenizer.nltk_tokenize, [(sentence,) for sentence in sentences]),
+        "tokenizer.regex_tokenize": lambda: run(tokenizer.regex_tokenize, [(sentence,) for sentence in sentences]),
+        "tokenizer.tokenize_pair": lambda: run(tokenizer.tokenize_pair,
+                                               [pair + (tokenize,) for pair in pairs]),
+        "error_generator.parse_sentence": lambda: run(error_generator.parse_sentence,
+                                                      [(sentence,) for sentence in sentences]),
+        "error_generator.find_unnecessary_candidates": lambda: run(
+            error_generator.find_unnecessary_candidates, [(sentence, u_combinations) for sentence in parsed]),
+        "error_generator.generate_u_error": lambda: run(error_generator.generate_u_error, u_arguments),
+        "error_generator.generate_m_error": lambda: run(error_generator.generate_m_error, m_arguments),
+        "error_generator.generate_r_error": lambda: run(error_generator.generate_r_error, r_arguments),
+        "synthesizer.synthesize_serial": synthesize,
+    }
+
+
+# Run the synthesizer as a separate process on the plain text of a corpus, as it is run by hand
+def synthesize_corpus(corpus_dir, output_dir, args):
+    os.makedirs(output_dir, exist_ok=True)
+    metrics_path = os.path.join(output_dir, "metrics.json")
+    command = [sys.executable, os.path.join(SCRIPT_DIR, "synthesizer.py"), os.path.join(corpus_dir, "text.txt"),
+               "--statistics", os.path.join(SCRIPT_DIR, statistics_store.STATISTICS_FILE),
+               "--workers", str(args.workers), "--tokenizer", args.tokenizer,
+               "--metrics-file", metrics_path, "--log-level", "WARNING"]
+    if args.nltk_data:
+        command += ["--nltk-data", os.path.abspath(args.nltk_data)]
+    subprocess.run(command, cwd=output_dir, check=True)
+    with open(metrics_path, "r", encoding="utf8") as f:
+        return json.load(f)["sentences_read"]
+
+
+# Start the synthesis server on a Unix socket of the work directory, returning once it answers
+def start_server(socket_path, args):
+    command = [sys.executable, os.path.join(SCRIPT_DIR, "server.py"), "--socket", socket_path,
+               "--statistics", os.path.join(SCRIPT_DIR, statistics_store.STATISTICS_FILE),
+               "--workers", str(args.workers), "--tokenizer", args.tokenizer, "--log-level", "WARNING"]
+    if args.nltk_data:
+        command += ["--nltk-data", os.path.abspath(args.nltk_data)]
+    process = subprocess.Popen(command)
+    deadline = time.monotonic() + 60
+    while True:
+        try:
+            with client.SynthesisClient(socket_path=socket_path, timeout=5) as connection:
+                connection.health()
+            return process
+        except OSError:
+            if process.poll() is not None or time.monotonic() > deadline:
+                process.kill()
+                raise RuntimeError("the synthesis server did not start")
+            time.sleep(0.1)
+
+
+# Send the sentences to the server from SERVER_CLIENTS clients connecting at once, every client with a
+# connection of its own. A refused or failed request fails the benchmark, as the server has to queue
+# concurrent clients rather than drop them
+def request_concurrently(socket_path, sentences):
+    requests = [sentences[start:start + SERVER_REQUEST_SENTENCES]
+                for start in range(0, len(sentences), SERVER_REQUEST_SENTENCES)]
+    barrier = threading.Barrier(SERVER_CLIENTS)
+    failures = []
+
+    def send(requests):
+        barrier.wait()
+        try:
+            with client.SynthesisClient(socket_path=socket_path) as connection:
+                for request in requests:
+                    connection.synthesize(request)
+        except (OSError, client.ServerError) as error:
+            failures.append(error)
+
+    threads = [threading.Thread(target=send, args=(requests[number::SERVER_CLIENTS],))
+               for number in range(SERVER_CLIENTS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if failures:
+        raise RuntimeError(f"{len(failures)} of {SERVER_CLIENTS} concurrent clients of the server failed, "
+                           f"e.g. {failures[0]!r}")
+    return len(sentences)
+
+
+# Every benchmark of a corpus of the given size, benchmarks needing punkt are skipped without its data
+def run_benchmarks(sentence_count, args, stats, punkt_error):
+    corpus_dir = generate_corpus(args.work_dir, sentence_count, args.seed)
+    text_path = os.path.join(corpus_dir, "text.txt")
+    results = {}
+
+    logger.info("Benchmarking %s sentences", sentence_count)
+
+    def analyze():
+        analyzer.generate_statistics([os.path.join(corpus_dir, "gold")], args.workers)
+        return sentence_count
+    results["analyzer.generate_statistics"] = measure(analyze, args.repeat)
+
+    # The cache is filled before the runs, so they time reading it
+    cache_dir = os.path.join(corpus_dir, "m2_cache")
+    m2cache.load_files(analyzer.collect_paths([os.path.join(corpus_dir, "gold")]), cache_dir, args.workers)
+
+    def analyze_cached():
+        analyzer.generate_statistics([os.path.join(corpus_dir, "gold")], args.workers, cache_dir=cache_dir)
+        return sentence_count
+    results["analyzer.generate_statistics cached"] = measure(analyze_cached, args.repeat)
+
+    sentences = read_sentences(os.path.join(corpus_dir, "sentences.txt"), args.micro_limit)
+    if punkt_error:
+        for name in ("segmenter.segment_lines", "synthesizer end-to-end", "server concurrent clients"):
+            results[name] = {"skipped": punkt_error}
+    else:
+        def segment():
+            with open(text_path, "r", encoding="utf8") as f:
+                return count_items(segmenter.segment_lines(f))
+        results["segmenter.segment_lines"] = measure(segment, args.repeat)
+        results["synthesizer end-to-end"] = measure(
+            lambda: synthesize_corpus(corpus_dir, os.path.join(args.work_dir, "output"), args), args.repeat)
+
+        socket_path = prepare_path(args.work_dir, "server.sock")
+        server = start_server(socket_path, args)
+        try:
+            results["server concurrent clients"] = measure(
+                lambda: request_concurrently(socket_path, sentences), args.repeat)
+        finally:
+            server.terminate()
+            server.wait()
+
+    benchmarks = function_benchmarks(sentences, stats, synthesizer.tokenize, random.Random(args.seed))
+    for name, function in benchmarks.items():
+        logger.info("Running %s", name)
+        results[name] = measure(function, args.repeat)
+    return results
+
+
+def package_version(name):
+    try:
+        module = __import__(name)
+    except ImportError:
+        return None
+    return getattr(module, "__version__", "unknown")
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=SCRIPT_DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "numpy": package_version("numpy"),
+        "nltk": package_version("nltk"),
+        "commit": commit,
+    }
+
+
+# Compare throughput with the baseline, benchmarks missing from either side are left out
+def compare(results, baseline, tolerance):
+    comparison = {}
+    regressions = []
+    for scale, benchmarks in results.items():
+        for name, result in benchmarks.items():
+            baseline_result = baseline.get("results", {}).get(scale, {}).get(name, {})
+            if not result.get("items_per_second") or not baseline_result.get("items_per_second"):
+                continue
+            ratio = result["items_per_second"] / baseline_result["items_per_second"]
+            regression = ratio < 1 - tolerance
+            comparison.setdefault(scale, {})[name] = {
+                "baseline_items_per_second": baseline_result["items_per_second"],
+                "items_per_second": result["items_per_second"],
+                "ratio": round(ratio, 3),
+                "regression": regression,
+            }
+            if regression:
+                regressions.append(f"{scale} sentences: {name}")
+            logger.info("%10s %-45s %12.1f -> %12.1f items/s (%+.1f%%)%s", scale, name,
+                        baseline_result["items_per_second"], result["items_per_second"], (ratio - 1) * 100,
+                        "  REGRESSION" if regression else "")
+    return comparison, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the synthesizer on generated corpora of the given sizes")
+    parser.add_argument("--sentences", type=int, nargs="+", default=[10000], metavar="N",
+                        help="sizes of the generated corpora in sentences, 10000 by default")
+    parser.add_argument("--output", default="benchmark_results.json", metavar="FILE",
+                        help="JSON file of the results")
+    parser.add_argument("--baseline", metavar="FILE", help="JSON results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1, metavar="SHARE",
+                        help="share of throughput which can be lost before a benchmark counts as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true",
+                        help="exit with status 1 if any benchmark is slower than the baseline allows")
+    parser.add_argument("--work-dir", default="./benchmark_data", metavar="DIR",
+                        help="directory of the generated corpora")
+    parser.add_argument("--repeat", type=int, default=3, help="number of runs of every benchmark, 3 by default")
+    parser.add_argument("--micro-limit", type=int, default=100000, metavar="N",
+                        help="number of sentences used by the benchmarks of single functions")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes of the analyzer and synthesizer")
+    parser.add_argument("--tokenizer", choices=sorted(tokenizer.TOKENIZERS), default="nltk",
+                        help="word tokenizer used by the synthesis benchmarks")
+    parser.add_argument("--nltk-data", metavar="DIR",
+                        help="local directory containing the punkt sentence tokenizer data")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the generated corpora")
+    parser.add_argument("--log-level", choices=reporting.LOG_LEVELS, default="INFO",
+                        help="level of the logged messages")
+    args = parser.parse_args()
+    if min(args.sentences) < 3 or args.repeat < 1 or args.workers < 1 or args.micro_limit < 1:
+        parser.error("--sentences must be at least 3, --repeat, --workers and --micro-limit positive")
+    reporting.configure_logging(args.log_level)
+
+    args.work_dir = os.path.abspath(args.work_dir)
+    analyzer.output_dir = os.path.join(args.work_dir, "statistics_output")
+    synthesizer.tokenize = tokenizer.get_tokenizer(args.tokenizer)
+    stats = synthesizer.map_statistics(synthesizer.import_percentages_data(
+        os.path.join(SCRIPT_DIR, statistics_store.STATISTICS_FILE)))
+    try:
+        segmenter.load_sentence_tokenizer(args.nltk_data)
+        punkt_error = None
+    except SystemExit as error:
+        punkt_error = str(error)
+        logger.warning("Skipping the benchmarks needing punkt: %s", punkt_error)
+
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "environment": environment(),
+        "parameters": {"repeat": args.repeat, "micro_limit": args.micro_limit, "workers": args.workers,
+                       "tokenizer": args.tokenizer, "seed": args.seed},
+        "results": {str(count): run_benchmarks(count, args, stats, punkt_error) for count in args.sentences},
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf8") as f:
+            baseline = json.load(f)
+        report["baseline"] = {"path": args.baseline, "created": baseline.get("created"),
+                              "tolerance": args.tolerance}
+        report["comparison"], regressions = compare(report["results"], baseline, args.tolerance)
+
+    with open(args.output, "w", encoding="utf8") as f:
+        json.dump(report, f, indent=2)
+        f.write("\n")
+    logger.info("Results written to %s", args.output)
+
+    if regressions:
+        logger.warning("Slower than the baseline: %s", ", ".join(regressions))
+        if args.fail_on_regression:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
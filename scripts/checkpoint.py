@@ -0,0 +1,126 @@
+# This file is part of the EstGEC punctuation error synthesizer
+# Author: Christian-Enrique Hindremäe
+# 2024
+
+# file: checkpoint.py
+#
+# Checkpoints of synthesis runs, from which a run that was stopped can be continued with --resume
+# Imported as a module in main file synthesizer.py
+#
+# A checkpoint is taken between two chunks of sentences, after every pair of the earlier chunks has been
+# written. It holds the position in the source and the state of the segmenter there, the sizes of the
+# output files, the lowercasing state carried into the next sentence and the counters of the run, and the
+# number of hashes in the log of the deduplicator when repeated sentences are dropped. The
+# random numbers need no state of their own, as every sentence draws from streams given by the run seed
+# and its index, which is the number of sentences before it. Continuing from a checkpoint writes the same
+# bytes as a run that was never stopped
+
+import os
+import json
+from collections import deque
+
+CHECKPOINT_FILE = "checkpoint.json"
+DEDUP_LOG_FILE = "checkpoint.dedup"
+CHECKPOINT_VERSION = 2
+
+
+# Sentences of a source, keeping track of where reading can be continued from
+# After every line a mark is kept of the number of sentences so far, the offset in the source and the
+# state of the segmenter, until a later mark is known to come before the sentences already written.
+# Reading continues from the last mark before a sentence and skips the sentences of its line before it
+# With a deduplicator repeated sentences are dropped and not counted, the marks also keep the number of
+# hashes in the deduplicator and of dropped sentences
+# In a pipelined run the marks are added by the thread reading the source and released by the thread writing
+# the output, each at its own end of the deque, which is safe without a lock
+class SentenceReader:
+
+    def __init__(self, source, segmenter, position=None, deduplicator=None):
+        self.source = source
+        self.segmenter = segmenter
+        self.deduplicator = deduplicator
+        self.sentence_count = 0
+        self.duplicates = 0
+        self.skip = 0
+        if position:
+            source.skip_to(position["offset"])
+            segmenter.restore(position["segmenter"])
+            self.sentence_count = position["sentences"]
+            self.duplicates = position["duplicates"]
+            self.skip = position["skip"]
+        self.marks = deque([self.mark()])
+
+    def mark(self):
+        return (self.sentence_count, self.source.offset, self.segmenter.state(),
+                self.deduplicator.count if self.deduplicator else 0, self.duplicates)
+
+    # Sentences not seen before
+    def new_sentences(self, sentences):
+        new = [sentence for sentence in sentences if self.deduplicator.is_new(sentence)]
+        self.duplicates += len(sentences) - len(new)
+        return new
+
+    def __iter__(self):
+        skip = self.skip
+        for line in self.source:
+            sentences = self.segmenter.feed(line)
+            if self.deduplicator and sentences:
+                sentences = self.new_sentences(sentences)
+            self.sentence_count += len(sentences)
+            self.marks.append(self.mark())
+            for sentence in sentences:
+                if skip:
+                    skip -= 1
+                    continue
+                yield sentence
+        sentences = self.segmenter.flush()
+        if self.deduplicator:
+            sentences = self.new_sentences(sentences)
+        for sentence in sentences:
+            if skip:
+                skip -= 1
+                continue
+            yield sentence
+
+    # Forget the marks no longer needed once the given number of sentences has been written
+    def release(self, sentence_count):
+        while len(self.marks) > 1 and self.marks[1][0] <= sentence_count:
+            self.marks.popleft()
+
+    # Where to continue reading from to get the sentences after the given number of sentences
+    def position(self, sentence_count):
+        self.release(sentence_count)
+        sentences, offset, segmenter_state, deduplicated, duplicates = self.marks[0]
+        return {"offset": offset, "segmenter": segmenter_state, "sentences": sentences,
+                "skip": sentence_count - sentences, "deduplicated": deduplicated, "duplicates": duplicates}
+
+
+# Write the checkpoint into a temporary file synced to disk, and rename it over the previous checkpoint
+def write_checkpoint(path, checkpoint):
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "w", encoding="utf8") as f:
+        json.dump({"version": CHECKPOINT_VERSION, **checkpoint}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary_path, path)
+
+
+# Read a checkpoint, raising ValueError if it was written by an incompatible version
+def read_checkpoint(path):
+    with open(path, "r", encoding="utf8") as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("version") != CHECKPOINT_VERSION:
+        raise ValueError(f"{path} has checkpoint version {checkpoint.get('version')}, "
+                         f"this version of the synthesizer reads version {CHECKPOINT_VERSION}")
+    return checkpoint
+
+
+def remove_checkpoint(*paths):
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+# Settings which differ between the checkpoint and the continued run, as (name, checkpoint, run) tuples
+def changed_settings(checkpoint, settings):
+    return [(name, checkpoint["settings"].get(name), value) for name, value in settings.items()
+            if checkpoint["settings"].get(name) != value]
@@ -0,0 +1,167 @@
+# This file is part of the EstGEC punctuation error synthesizer
+# Author: Christian-Enrique Hindremäe
+# 2024
+
+# file: client.py
+#
+# Client of the synthesis server started with server.py
+# Imported as a module by code sending synthesis requests, or executed separately
+#
+# Usage: python client.py [input_file] [--url URL] [--socket PATH] [--documents] [--first-index N] [--epoch N]
+#                         [--batch-size N] [--timeout SECONDS] [--health] [--metrics]
+# Where
+#   input_file - sentences to synthesize errors into, one per line, standard input if not given
+#   --url - address of the server, http://127.0.0.1:8765 by default
+#   --socket - Unix socket of the server, used instead of the address
+#   --documents - every line is a document segmented into sentences by the server
+#   --first-index - index of the first sentence for repeatable errors, the server numbers them if not given
+#   --epoch - epoch of the errors, another epoch draws other errors for the same indexes
+#   --batch-size - lines sent in a request, 1000 by default
+#   --timeout - seconds to wait for the server, 60 by default
+#   --health, --metrics - print the health or the metrics of the server instead
+#
+# Output:
+#   a line for every sentence on standard output, the correct sentence, the incorrect sentence and the error
+#   types separated by tabs, the error types are empty for a sentence without an error
+
+import sys
+import json
+import socket
+import argparse
+import itertools
+import http.client
+import urllib.parse
+
+DEFAULT_URL = "http://127.0.0.1:8765"
+DEFAULT_BATCH_SIZE = 1000
+
+
+# Raised for requests the server did not answer with a result
+class ServerError(Exception):
+    pass
+
+
+# HTTP connection over a Unix socket
+class UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, socket_path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+# Client keeping a connection to the server open between requests
+# Pairs are returned as (correct, incorrect, error types) tuples, the error types are None without an error
+class SynthesisClient:
+
+    def __init__(self, url=DEFAULT_URL, socket_path=None, timeout=60.0):
+        if socket_path:
+            self.connection = UnixHTTPConnection(socket_path, timeout)
+        else:
+            address = urllib.parse.urlsplit(url)
+            self.connection = http.client.HTTPConnection(address.hostname, address.port or 80, timeout=timeout)
+
+    def request(self, method, path, body=None):
+        data = json.dumps(body).encode("utf8") if body is not None else None
+        headers = {"Content-Type": "application/json"} if data is not None else {}
+        # A kept connection closed by the server in the meantime is opened again once
+        for attempt in range(2):
+            try:
+                self.connection.request(method, path, data, headers)
+                response = self.connection.getresponse()
+                content = response.read()
+                break
+            except (ConnectionError, http.client.BadStatusLine):
+                self.connection.close()
+                if attempt:
+                    raise
+        result = json.loads(content.decode("utf8"))
+        if response.status != 200:
+            raise ServerError(f"{response.status}: {result.get('error', response.reason)}")
+        return result
+
+    def synthesize(self, sentences, first_index=None, epoch=0):
+        result = self.request("POST", "/synthesize", request_body("sentences", sentences, first_index, epoch))
+        return [tuple(pair) for pair in result["pairs"]]
+
+    # Pairs of the sentences of every document, the documents are segmented by the server
+    def synthesize_documents(self, documents, first_index=None, epoch=0):
+        result = self.request("POST", "/synthesize", request_body("documents", documents, first_index, epoch))
+        return [[tuple(pair) for pair in document] for document in result["documents"]]
+
+    def health(self):
+        return self.request("GET", "/health")
+
+    def metrics(self):
+        return self.request("GET", "/metrics")
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def request_body(name, texts, first_index, epoch):
+    body = {name: list(texts), "epoch": epoch}
+    if first_index is not None:
+        body["first_index"] = first_index
+    return body
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sends sentences to the synthesis server and prints the pairs")
+    parser.add_argument("input_file", nargs="?", help="sentences one per line, standard input if not given")
+    parser.add_argument("--url", default=DEFAULT_URL, help=f"address of the server, {DEFAULT_URL} by default")
+    parser.add_argument("--socket", metavar="PATH", help="Unix socket of the server, used instead of the address")
+    parser.add_argument("--documents", action="store_true",
+                        help="every line is a document segmented into sentences by the server")
+    parser.add_argument("--first-index", type=int, metavar="N",
+                        help="index of the first sentence for repeatable errors")
+    parser.add_argument("--epoch", type=int, default=0, metavar="N",
+                        help="epoch of the errors, another epoch draws other errors for the same indexes")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, metavar="N",
+                        help=f"lines sent in a request, {DEFAULT_BATCH_SIZE} by default")
+    parser.add_argument("--timeout", type=float, default=60.0, metavar="SECONDS",
+                        help="seconds to wait for the server, 60 by default")
+    parser.add_argument("--health", action="store_true", help="print the health of the server")
+    parser.add_argument("--metrics", action="store_true", help="print the metrics of the server")
+    args = parser.parse_args()
+    if args.batch_size < 1:
+        parser.error("--batch-size must be positive")
+    if (args.first_index is not None and args.first_index < 0) or args.epoch < 0:
+        parser.error("--first-index and --epoch must not be negative")
+
+    try:
+        with SynthesisClient(args.url, args.socket, args.timeout) as client:
+            if args.health or args.metrics:
+                print(json.dumps(client.health() if args.health else client.metrics(), indent=2, ensure_ascii=False))
+                return
+            source = open(args.input_file, encoding="utf8") if args.input_file else sys.stdin
+            with source:
+                lines = (line.rstrip("\n") for line in source)
+                first_index = args.first_index
+                while batch := list(itertools.islice(lines, args.batch_size)):
+                    if args.documents:
+                        pairs = [pair for document in client.synthesize_documents(batch, first_index, args.epoch)
+                                 for pair in document]
+                    else:
+                        pairs = client.synthesize([line.strip() for line in batch], first_index, args.epoch)
+                    for correct, incorrect, error_types in pairs:
+                        sys.stdout.write(f"{correct}\t{incorrect}\t{error_types or ''}\n")
+                    if first_index is not None:
+                        first_index += len(pairs)
+    except (OSError, ServerError) as error:
+        parser.exit(1, f"{parser.prog}: error: {error}\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+# This file is part of the EstGEC punctuation error synthesizer
+# Author: Christian-Enrique Hindremäe
+# 2024
+
+# file: corpus_io.py
+#
+# Reading source text and writing corpora as plain or compressed streams
+# Imported as a module in main file synthesizer.py and writers.py
+#
+# Sources compressed with gzip, xz or bzip2 are read directly, as are zstd sources when Python has
+# compression.zstd (3.14+) or the zstandard package is installed. Compression is recognized by
+# the magic bytes at the start of the stream, so it also works for standard input given as "-"
+#
+# Outputs can be checkpointed: everything written so far is flushed into the file and a compressed
+# stream ends its member (gzip member, xz stream, bzip2 stream or zstd frame), so the file can be cut at
+# that size and continued later. The members of a file are read back as one stream by every decompressor
+
+import io
+import os
+import sys
+import gzip
+import lzma
+import bz2
+import hashlib
+
+# Size of the buffers between the text layer and the file or compressor
+BUFFER_SIZE = 1 << 20
+
+# Magic bytes at the start of compressed streams
+MAGIC_BYTES = {
+    "gz": b"\x1f\x8b",
+    "xz": b"\xfd7zXZ\x00",
+    "bz2": b"BZh",
+    "zst": b"\x28\xb5\x2f\xfd",
+}
+COMPRESSIONS = list(MAGIC_BYTES)
+
+
+def detect_compression(head, path=None):
+    for compression, magic in MAGIC_BYTES.items():
+        if head.startswith(magic):
+            return compression
+    # Streams too short for magic bytes fall back to the extension
+    if path:
+        extension = os.path.splitext(path)[1].lstrip(".")
+        if extension in MAGIC_BYTES and len(head) < len(MAGIC_BYTES[extension]):
+            return extension
+    return None
+
+
+def zstd_module():
+    try:
+        from compression import zstd
+        return zstd
+    except ImportError:
+        pass
+    try:
+        import zstandard
+        return zstandard
+    except ImportError:
+        raise SystemExit("Reading and writing zstd needs Python 3.14 or the zstandard package")
+
+
+# Binary stream decompressing the raw stream
+# Streams of several compressed members one after another, like appended gzip files, are read as one
+def decompressing_stream(raw, compression):
+    if compression == "gz":
+        return gzip.GzipFile(fileobj=raw, mode="rb")
+    if compression == "xz":
+        return lzma.LZMAFile(raw, mode="rb")
+    if compression == "bz2":
+        return bz2.BZ2File(raw, mode="rb")
+    zstd = zstd_module()
+    if hasattr(zstd, "ZstdFile"):
+        return zstd.ZstdFile(raw, mode="rb")
+    return io.BufferedReader(zstd.ZstdDecompressor().stream_reader(raw, read_across_frames=True),
+                             buffer_size=BUFFER_SIZE)
+
+
+# Binary stream compressing into the raw stream, the raw stream is left open when it is closed
+def compressing_stream(raw, compression, level=None):
+    if compression == "gz":
+        # No time in the header, so the same text is always compressed into the same bytes
+        return gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6 if level is None else level, mtime=0)
+    if compression == "xz":
+        return lzma.LZMAFile(raw, mode="wb", preset=level)
+    if compression == "bz2":
+        return bz2.BZ2File(raw, mode="wb", compresslevel=9 if level is None else level)
+    zstd = zstd_module()
+    if hasattr(zstd, "ZstdFile"):
+        return zstd.ZstdFile(raw, mode="wb", level=level)
+    compressor = zstd.ZstdCompressor(level=3 if level is None else level)
+    return compressor.stream_writer(raw, closefd=False, write_return_read=True)
+
+
+# Source text read from a file or standard input, decompressed if it is compressed
+# Iterating the reader yields the lines of the source
+#   size - size of the source file in bytes, None for standard input
+#   position() - bytes of the source file read so far, compressed bytes for a compressed source
+#   offset - bytes of text read so far, counted after decompression
+class SourceReader:
+
+    def __init__(self, path):
+        self.path = path
+        if path == "-":
+            self.raw = sys.stdin.buffer
+            self.size = None
+        else:
+            self.raw = open(path, "rb", buffering=BUFFER_SIZE)
+            self.size = os.fstat(self.raw.fileno()).st_size
+        self.compression = detect_compression(self.raw.peek(8)[:8], None if path == "-" else path)
+        self.stream = decompressing_stream(self.raw, self.compression) if self.compression else self.raw
+        self.offset = 0
+
+    def position(self):
+        if self.size is None:
+            return 0
+        return self.raw.tell()
+
+    def __iter__(self):
+        for line in self.stream:
+            self.offset += len(line)
+            yield line.decode("utf8")
+
+    # Continue reading from an offset of the text, streams which can't seek are read up to it
+    def skip_to(self, offset):
+        if self.stream.seekable():
+            self.stream.seek(offset)
+            skipped = self.stream.tell()
+        else:
+            skipped = 0
+            while skipped < offset:
+                data = self.stream.read(min(offset - skipped, BUFFER_SIZE))
+                if not data:
+                    break
+                skipped += len(data)
+        if skipped != offset:
+            raise ValueError(f"{self.path} is shorter than {offset} bytes")
+        self.offset = offset
+
+    def close(self):
+        if self.stream is not self.raw:
+            self.stream.close()
+        # Standard input stays open
+        if self.path != "-":
+            self.raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def open_source(path):
+    return SourceReader(path)
+
+
+# Name of an output file with the extension of its compression
+def output_path(path, compression=None):
+    return f"{path}.{compression}" if compression else path
+
+
+# File written through a running checksum, so the file doesn't have to be read again to hash it
+class HashingFile(io.RawIOBase):
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    # Hash the content already in the file, leaving the file positioned at its end
+    def read_existing(self):
+        self.raw.seek(0)
+        while True:
+            data = self.raw.read(BUFFER_SIZE)
+            if not data:
+                break
+            self.digest.update(data)
+            self.size += len(data)
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        written = self.raw.write(data)
+        self.digest.update(memoryview(data)[:written])
+        self.size += written
+        return written
+
+    def close(self):
+        if not self.closed:
+            self.raw.close()
+        super().close()
+
+
+# Text file written with large buffered writes, compressed if a compression is given
+# A file continued from a checkpoint is cut to the size returned by checkpoint() and written on from there
+#   size, sha256() - size and checksum of the written file, final once the file is closed
+class OutputFile:
+
+    def __init__(self, path, compression=None, level=None, resume_size=None):
+        self.path = path
+        self.compression = compression
+        self.level = level
+        if resume_size is None:
+            self.raw = HashingFile(open(path, "wb", buffering=0))
+        else:
+            raw = open(path, "r+b", buffering=0)
+            if os.fstat(raw.fileno()).st_size < resume_size:
+                raw.close()
+                raise ValueError(f"{path} is shorter than at the checkpoint")
+            raw.truncate(resume_size)
+            self.raw = HashingFile(raw)
+            self.raw.read_existing()
+        self.open_streams()
+
+    def open_streams(self):
+        if self.compression:
+            self.stream = io.BufferedWriter(compressing_stream(self.raw, self.compression, self.level),
+                                            buffer_size=BUFFER_SIZE)
+        else:
+            self.stream = io.BufferedWriter(self.raw, buffer_size=BUFFER_SIZE)
+        self.file = io.TextIOWrapper(self.stream, encoding="utf8", newline="\n")
+
+    def write(self, text):
+        self.file.write(text)
+
+    # Write everything so far into the file and sync it to disk, ending the compressed member
+    # Returns the size of the file, from which it can be continued. The size is taken before the next
+    # member is started, as a compressor may write the header of a member as soon as it is opened
+    def checkpoint(self):
+        self.file.flush()
+        if self.compression:
+            self.file.detach()
+            self.stream.close()
+        os.fsync(self.raw.raw.fileno())
+        size = self.raw.size
+        if self.compression:
+            self.open_streams()
+        return size
+
+    def close(self):
+        self.file.close()
+        if not self.raw.closed:
+            self.raw.close()
+
+    @property
+    def size(self):
+        return self.raw.size
+
+    def sha256(self):
+        return self.raw.digest.hexdigest()
+
+
+def open_output(path, compression=None, level=None, resume_size=None):
+    return OutputFile(path, compression, level, resume_size)
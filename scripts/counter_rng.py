@@ -0,0 +1,111 @@
+# This file is part of the EstGEC punctuation error synthesizer
+# Author: Christian-Enrique Hindremäe
+# 2024
+
+# file: counter_rng.py
+#
+# Counter-based random numbers addressed by the run seed and the index of a sentence
+# Imported as a module in error_generator.py and synthesizer.py
+#
+# Every number is the SplitMix64 mix of a key and a counter, so the n-th number of a stream is computed
+# directly instead of stepping a generator through the numbers before it. The key of a stream is derived
+# from the run seed, the index of the sentence in the source and the number of the stream in the sentence,
+# so a sentence draws the same numbers whichever process synthesizes it and in whatever chunk, and a single
+# sentence can be synthesized again on its own from its index
+#
+# Streams of a sentence:
+#   DECISION_STREAM - whether to place an error and the draw picking its type, for every variant in turn
+#   VARIANT_STREAM + v - sampling of the marks and positions of the errors of variant v
+#
+# Numbers for a block of sentences are computed with NumPy when it is installed, the pure Python
+# functions give the same numbers bit for bit
+
+import os
+
+# NumPy is optional, blocks of sentences fall back to the pure Python mix without it
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MASK = (1 << 64) - 1
+GAMMA = 0x9E3779B97F4A7C15
+MIX_MULTIPLIERS = (0xBF58476D1CE4E5B9, 0x94D049BB133111EB)
+
+# Uniform numbers take the 53 high bits of a mixed number
+UNIFORM_SCALE = 2.0 ** -53
+
+DECISION_STREAM = 0
+VARIANT_STREAM = 1
+
+
+# SplitMix64 finalizer, a bijection of 64-bit numbers
+def mix(value):
+    value = (value ^ (value >> 30)) * MIX_MULTIPLIERS[0] & MASK
+    value = (value ^ (value >> 27)) * MIX_MULTIPLIERS[1] & MASK
+    return value ^ (value >> 31)
+
+
+# The number at a counter of the stream of a key, also used to derive the key of a nested stream
+# Different counters of one key give different numbers
+def derive(key, counter):
+    return mix((key + (counter + 1) * GAMMA) & MASK)
+
+
+def stream_key(seed, sentence, stream):
+    return derive(derive(derive(0, seed & MASK), sentence), stream)
+
+
+# Seed of an epoch of the errors of a run, epoch 0 keeps the seed of the run
+def epoch_seed(seed, epoch):
+    return derive(seed & MASK, epoch - 1) if epoch else seed
+
+
+# Seed of a run without one, non-negative so it fits the signed integers of JSON readers
+def random_seed():
+    return int.from_bytes(os.urandom(8), "little") >> 1
+
+
+# Uniform numbers in [0, 1) from a stream of a sentence, drawn one after another
+# Has the random() and choice() methods of the random module used by the samplers and error generators
+class StreamRandom:
+    __slots__ = ("key", "counter")
+
+    def __init__(self, seed, sentence, stream):
+        self.key = stream_key(seed, sentence, stream)
+        self.counter = 0
+
+    def random(self):
+        value = derive(self.key, self.counter)
+        self.counter += 1
+        return (value >> 11) * UNIFORM_SCALE
+
+    def choice(self, sequence):
+        return sequence[int(self.random() * len(sequence))]
+
+
+def mix_array(values):
+    values = (values ^ (values >> numpy.uint64(30))) * numpy.uint64(MIX_MULTIPLIERS[0])
+    values = (values ^ (values >> numpy.uint64(27))) * numpy.uint64(MIX_MULTIPLIERS[1])
+    return values ^ (values >> numpy.uint64(31))
+
+
+def derive_array(keys, counters):
+    return mix_array(keys + (counters + numpy.uint64(1)) * numpy.uint64(GAMMA))
+
+
+# The first count numbers of a stream of every sentence in a block, sentence after sentence
+# Returns a list of length sentences * count, the numbers of sentence i start at i * count
+def block_uniforms(seed, first_sentence, sentences, stream, count):
+    if numpy is not None:
+        seed_key = numpy.uint64(derive(0, seed & MASK))
+        indexes = numpy.arange(first_sentence, first_sentence + sentences, dtype=numpy.uint64)
+        keys = derive_array(derive_array(seed_key, indexes), numpy.full(sentences, stream, dtype=numpy.uint64))
+        values = derive_array(keys[:, None], numpy.arange(count, dtype=numpy.uint64)[None, :])
+        return ((values >> numpy.uint64(11)).astype(numpy.float64) * UNIFORM_SCALE).ravel().tolist()
+
+    uniforms = []
+    for sentence in range(first_sentence, first_sentence + sentences):
+        key = stream_key(seed, sentence, stream)
+        uniforms.extend((derive(key, counter) >> 11) * UNIFORM_SCALE for counter in range(count))
+    return uniforms
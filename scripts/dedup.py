@@ -0,0 +1,161 @@
+# This file is part of the EstGEC punctuation error synthesizer
+# Author: Christian-Enrique Hindremäe
+# 2024
+
+# file: dedup.py
+#
+# Dropping repeated source sentences before synthesis
+# Imported as a module in main file synthesizer.py
+#
+# Sentences are normalized by case and whitespace and hashed into 64 bits, and the hashes of the sentences
+# seen so far are kept in an open addressing table of 8 bytes per slot, which takes about 11 bytes per
+# sentence. The table grows up to a memory limit; once it is full, sentences which are not in it yet are
+# kept without being added, so repeats after that point are only dropped for sentences seen before it.
+# Two different sentences share a hash with a probability of about n^2 / 2^65 for n sentences
+#
+# For checkpoints the hashes are also appended to a log file in the order they were added. A run continued
+# from a checkpoint cuts the log to the number of hashes at the checkpoint and builds the table from it
+
+import os
+import array
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Memory limit of the table in megabytes when none is given
+DEFAULT_MEMORY_MB = 512
+
+# Slots of a new table, and the share of the slots filled before the table is doubled
+INITIAL_SLOTS = 1 << 16
+MAX_LOAD = 0.75
+
+HASH_BYTES = 8
+LOG_BUFFER_SIZE = 1 << 20
+
+
+# Sentences differing only in case or whitespace are the same sentence
+def normalize(sentence):
+    return " ".join(sentence.casefold().split())
+
+
+# 64-bit hash of the normalized sentence, never 0 as 0 marks an empty slot
+def sentence_hash(sentence):
+    value = int.from_bytes(hashlib.blake2b(normalize(sentence).encode("utf8"), digest_size=HASH_BYTES).digest(),
+                           "little")
+    return value or 1
+
+
+# Set of 64-bit hashes in an open addressing table with linear probing
+class HashSet:
+
+    def __init__(self, memory_limit):
+        self.memory_limit = memory_limit
+        self.count = 0
+        self.full = False
+        self.allocate(INITIAL_SLOTS)
+
+    def allocate(self, size):
+        self.slots = array.array("Q", bytes(size * HASH_BYTES))
+        self.mask = size - 1
+        self.max_count = int(size * MAX_LOAD)
+
+    # Double the table, or mark it full if the doubled table would not fit into the memory limit
+    def grow(self):
+        size = (self.mask + 1) * 2
+        if size * HASH_BYTES > self.memory_limit:
+            self.full = True
+            return
+        old_slots = self.slots
+        self.allocate(size)
+        for value in old_slots:
+            if value:
+                self.insert(value)
+
+    def insert(self, value):
+        slots = self.slots
+        mask = self.mask
+        index = value & mask
+        while slots[index]:
+            index = (index + 1) & mask
+        slots[index] = value
+
+    def __contains__(self, value):
+        slots = self.slots
+        mask = self.mask
+        index = value & mask
+        while True:
+            slot = slots[index]
+            if slot == value:
+                return True
+            if not slot:
+                return False
+            index = (index + 1) & mask
+
+    # Add the hash, returns whether it was added; a full table only answers whether it contains the hash
+    def add(self, value):
+        if value in self:
+            return False
+        if self.count >= self.max_count and not self.full:
+            self.grow()
+        if self.full:
+            return False
+        self.insert(value)
+        self.count += 1
+        return True
+
+    @property
+    def memory(self):
+        return len(self.slots) * HASH_BYTES
+
+
+# Drops sentences seen before, logging the added hashes into log_path when it is given
+# A deduplicator continued from a checkpoint gives the number of hashes logged at the checkpoint as resume_count
+class Deduplicator:
+
+    def __init__(self, memory_mb=DEFAULT_MEMORY_MB, log_path=None, resume_count=None):
+        self.hashes = HashSet(memory_mb * 1024 * 1024)
+        self.warned = False
+        self.log = None
+        if log_path and resume_count is not None:
+            self.log = open(log_path, "r+b", buffering=LOG_BUFFER_SIZE)
+            data = self.log.read(resume_count * HASH_BYTES)
+            if len(data) != resume_count * HASH_BYTES:
+                raise ValueError(f"{log_path} is shorter than at the checkpoint")
+            for value in array.array("Q", data):
+                self.hashes.add(value)
+            self.log.truncate(resume_count * HASH_BYTES)
+            self.log.seek(resume_count * HASH_BYTES)
+        elif log_path:
+            self.log = open(log_path, "wb", buffering=LOG_BUFFER_SIZE)
+
+    # Whether the sentence is seen for the first time
+    def is_new(self, sentence):
+        value = sentence_hash(sentence)
+        if self.hashes.add(value):
+            if self.log:
+                self.log.write(value.to_bytes(HASH_BYTES, "little"))
+            return True
+        if self.hashes.full and value not in self.hashes:
+            if not self.warned:
+                self.warned = True
+                logger.warning("Deduplication table is full at %d sentences, later sentences are only "
+                               "compared with these", self.hashes.count)
+            return True
+        return False
+
+    # Number of hashes added so far, the state of the deduplicator for a checkpoint
+    @property
+    def count(self):
+        return self.hashes.count
+
+    # Sync the log to disk so every hash added so far is in it
+    def checkpoint(self):
+        if self.log:
+            self.log.flush()
+            os.fsync(self.log.fileno())
+
+    def close(self):
+        if self.log:
+            self.log.close()
+            self.log = None
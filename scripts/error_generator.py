@@ -7,180 +7,194 @@
 # Contains functions necessary for error synthesis
 # Imported as a module in main file synthesizer.py
 
+import re
 import string
 import random
-
-# Collect correct punctuations from input sentence
-
-
-def collect_punctuations(sentence):
-    correct_punctuations = []
-    for char in sentence:
-        if char in string.punctuation:
-            correct_punctuations.append(char)
-    return correct_punctuations
-
-# Determine whether to synthesize an error
-
-
-def determine_punct_error(percentage):
-    introduce = percentage
-    no_introduce = 100 - percentage
-    choices = ["yes", "no"]
-    choice = random.choices(choices, weights=[introduce, no_introduce], k=1)
-
-    return choice[0]
-
-
-def determine_error_type(u, m, r, u_error_is_possible):
+import logging
+import counter_rng
+
+logger = logging.getLogger(__name__)
+
+# Sentence parsed once and shared by all functions determining and generating errors
+# words - whitespace separated words, like sentence.split()
+# word_spans - (start, end) offsets of every word in the sentence
+# marks - (offset, character, preceding word, following word) of every punctuation mark in order,
+#   where the neighbouring words are stripped of punctuation and empty at the edges of the sentence
+# punctuations - characters of the marks, the correct punctuations of the sentence
+class ParsedSentence:
+    __slots__ = ("text", "words", "word_spans", "marks", "punctuations")
+
+    def __init__(self, text, words, word_spans, marks):
+        self.text = text
+        self.words = words
+        self.word_spans = word_spans
+        self.marks = marks
+        self.punctuations = [mark[1] for mark in marks]
+
+    # Sentence with the text between the offsets replaced
+    def replace(self, start, end, replacement):
+        return self.text[:start] + replacement + self.text[end:]
+
+
+WORD_PATTERN = re.compile(r"\S+")
+PUNCTUATION = frozenset(string.punctuation)
+
+
+# Parse the sentence with a single pass over its words
+def parse_sentence(sentence):
+    words = []
+    word_spans = []
+    mark_words = []  # (offset, character, index of the word containing the mark)
+    for match in WORD_PATTERN.finditer(sentence):
+        word = match.group()
+        start = match.start()
+        for offset, char in enumerate(word):
+            if char in PUNCTUATION:
+                mark_words.append((start + offset, char, len(words)))
+        words.append(word)
+        word_spans.append(match.span())
+
+    marks = []
+    for position, char, word_index in mark_words:
+        start, end = word_spans[word_index]
+        before = sentence[start:position]
+        after = sentence[position + 1:end]
+        # Marks at the edge of a word take the neighbouring word
+        if not before and word_index > 0:
+            before = words[word_index - 1]
+        if not after and word_index + 1 < len(words):
+            after = words[word_index + 1]
+        marks.append((position, char, before.strip(string.punctuation), after.strip(string.punctuation)))
+
+    return ParsedSentence(sentence, words, word_spans, marks)
+
+
+# Determine whether to synthesize an error, for a block of sentences at once
+# The decisions of a sentence come from its decision stream, given by the run seed and the index of the
+# sentence in the source, so they do not depend on how the sentences are split into blocks
+# Returns whether to synthesize an error into each variant of each sentence and a uniform number for each
+# of them which picks the error type with determine_error_type_from_draw, the variants of a sentence one
+# after another. Error types are resolved per sentence, as the possibility of an unnecessary punctuation
+# error is only known after inspecting the sentence
+def determine_batch_errors(percentage, seed, first_sentence, size, variants=1):
+    draws = counter_rng.block_uniforms(seed, first_sentence, size, counter_rng.DECISION_STREAM, 2 * variants)
+    introduce_errors = [draw * 100 < percentage for draw in draws[0::2]]
+    return introduce_errors, draws[1::2]
+
+
+# Determine the error type with a uniform number drawn in advance
+# The weights are accumulated in the same way random.choices does
+def determine_error_type_from_draw(draw, u, m, r, u_error_is_possible):
     if u_error_is_possible == False:
         u = 0
-    choices = ["u", "m", "r"]
-    choice = random.choices(choices, weights=[u, m, r], k=1)
-
-    return choice[0]
-
-
-def determine_unnecessary_character(unnecessaryPunctuation, u_punctuation_options):
-    # Map statistics based on available characters in the sentence
-    options = {key: value for key, value in unnecessaryPunctuation.items(
-    ) if key in u_punctuation_options}
-    choices = list(options.keys())
-    weights = list(options.values())
-    choice = random.choices(choices, weights=weights, k=1)
-
-    return choice[0]
-
-
-def determine_missing_character(correct_punctuations, missingPunctuation, correct_end_punctuation, sentence, missingCombinations):
+    position = draw * (u + m + r)
+    if position < u:
+        return "u"
+    if position < u + m:
+        return "m"
+    return "r"
+
+
+# Find every position where an unnecessary character could precede a word common for U_ERROR
+# A single pass over the words with a hash table lookup per word into the combinations grouped by following
+# word, so the cost does not grow with the number of combinations. The preceding word must not end with punctuation
+# u_combinations are the unnecessary combinations of the statistics file, a statistics_store.CombinationsView
+# Returns a list of (word index, following word, character), with every character seen before the word
+def find_unnecessary_candidates(parsed, u_combinations):
+    words = parsed.words
+    candidates = []
+    for index in range(1, len(words)):
+        if words[index - 1][-1] in PUNCTUATION:
+            continue
+        word = words[index]
+        candidates.extend((index, word, character) for character in u_combinations.marks(word))
+    return candidates
+
+
+def determine_unnecessary_character(samplers, u_punctuation_options, rng=random):
+    # Draw based on available characters in the sentence
+    return samplers.unnecessary(u_punctuation_options, rng)
+
+
+# Choose one of the occurrences of the following words the character is combined with
+def determine_unnecessary_position(candidates, character, rng=random):
+    options = [index for index, word, candidate_character in candidates if candidate_character == character]
+    return rng.choice(options)
+
+
+# Determine the missing character and its offset in the sentence
+# Marks followed by a word from the known combinations are preferred, otherwise the character
+# is drawn from the punctuation of the sentence and one of its occurrences is chosen
+# missing_combinations are the missing combinations of the statistics file, a statistics_store.CombinationsView
+def determine_missing_character(parsed, samplers, missing_combinations, rng=random):
     top_combination_weights = {}
-    print(f"Sentence: {sentence}")
+    logger.debug("Sentence: %s", parsed.text)
 
-    # Create a list of pairs (punctuation, word) from the sentence
-    punct_word_pairs = []
-    for punct in correct_punctuations:
-        parts = sentence.split(punct)
-        for i in range(1, len(parts)):
-            word = parts[i].strip().split()[0] if parts[i].strip() else ""
-            if word:
-                punct_word_pairs.append((punct, word))
+    # Pairs (punctuation, following word) and the offset of their first occurrence
+    punct_word_pairs = {}
+    for position, punct, preceding_word, following_word in parsed.marks:
+        if following_word:
+            punct_word_pairs.setdefault((punct, following_word), position)
 
-    print(f"Punctuation-word pairs: {punct_word_pairs}")
+    logger.debug("Punctuation-word pairs and their offsets: %s", punct_word_pairs)
 
-    # Check if any pairs exist in known top combinations
+    # Check if any pairs exist in known combinations
     for punct, word in punct_word_pairs:
-        for combination in missingCombinations:
-            comb_punct, comb_word, comb_weight = combination
-            if word == comb_word and punct == comb_punct:
-                top_combination_weights[(word, punct)] = comb_weight
+        weight = missing_combinations.count(punct, word)
+        if weight is not None:
+            top_combination_weights[(word, punct)] = weight
 
     if top_combination_weights:
-        print("Got combinations:")
-        print(top_combination_weights)
+        logger.debug("Got combinations: %s", top_combination_weights)
         selected_word, selected_punct = max(
             top_combination_weights, key=top_combination_weights.get)
-        print(f"Chose {selected_punct} and {selected_word}")
-        return selected_punct, selected_word
+        logger.debug("Chose %s and %s", selected_punct, selected_word)
+        return selected_punct, selected_word, punct_word_pairs[(selected_punct, selected_word)]
     else:
-        options = {key: value for key, value in missingPunctuation.items()
-                   if key in correct_punctuations}
-        if not options:
-            return None, ""
-        choices = list(options.keys())
-        weights = list(options.values())
-        choice = random.choices(choices, weights=weights, k=1)
-
-        print(f"Chose {choice[0]}")
-        return choice[0], ""
+        choice = samplers.missing(parsed.punctuations, rng)
+        if choice is None:
+            return None, "", None
 
+        logger.debug("Chose %s", choice)
+        positions = [mark[0] for mark in parsed.marks if mark[1] == choice]
+        return choice, "", rng.choice(positions)
 
-def determine_replacement_character(r_punctuation, total, correct_punctuations, total_fixes, middle_fixes, end_fixes):
 
+def determine_replacement_character(samplers, correct_punctuations, rng=random):
     # Choose wrong character - options are all wrong characters which corrections sub-directory contains any from correct_punctuations
-    wrong_options = {key: value for key, value in r_punctuation.items() if set(
-        total_fixes[key]) & set(correct_punctuations)}
-    wrong_choice = random.choices(
-        list(wrong_options.keys()), weights=list(wrong_options.values()), k=1)[0]
-
-    # Choose correct character
-    correct_options = {key: value for key, value in total_fixes[wrong_choice].items(
-    ) if key in correct_punctuations}
-    correct_choice = random.choices(
-        list(correct_options.keys()), weights=list(correct_options.values()), k=1)[0]
-
-    # Choose position
-    position_options = ["end", "middle"]
-    middle_percentage = 0
-    end_percentage = 0
-    if wrong_choice in middle_fixes:
-        middle_percentage = middle_fixes[wrong_choice].get(correct_choice, 0)
-    if wrong_choice in end_fixes:
-        end_percentage = end_fixes[wrong_choice].get(correct_choice, 0)
-    position_choice = random.choices(position_options, weights=[
-                                     end_percentage, middle_percentage], k=1)[0]
-
-    return correct_choice, wrong_choice, position_choice
-
-
-def generate_u_error(sentence, words, character, word):
-    # Check if the chosen word is the first word in the sentence
-    if word == words[0]:
-        return sentence  # Do nothing if it's the first word
-
-    # Find the index of the word in the list of words
-    word_index = words.index(word)
+    # Then choose the correct character it replaces and the position of the replacement
+    # Returns None for all three if the sentence contains no punctuation which has been corrected
+    return samplers.replacement(correct_punctuations, rng)
+
+
+# Generators return the sentence with the error, or None if the error cannot be placed in the sentence
+
+
+def generate_u_error(parsed, character, word_index):
+    # Do nothing if it's the first word, there is no preceding word to append the character to
+    if word_index == 0:
+        return None
 
     # Append the character to the preceding word
-    preceding_word = words[word_index - 1]
-    word_with_character = preceding_word + character
-
-    # Replace the original word with the word containing the unnecessary character
-    error_sentence = sentence.replace(preceding_word, word_with_character, 1)
-
-    return error_sentence
-
-
-def generate_m_error(sentence, character, word):
-    if word:
-        print(f"Got {character} and {word}")
-        # Construct the combination string to be removed
-        combination = character + " " + word
-        # Find all occurrences of the combination
-        start = 0
-        positions = []
-        while True:
-            start = sentence.find(combination, start)
-            if start == -1:
-                break
-            positions.append(start)
-            start += len(combination)
-
-        # Ensure we replace the specific occurrence
-        if positions:
-            pos = positions[0]
-            error_sentence = sentence[:pos] + " " + \
-                word + sentence[pos + len(combination):]
-        else:
-            error_sentence = sentence
+    position = parsed.word_spans[word_index - 1][1]
+    return parsed.replace(position, position, character)
+
+
+def generate_m_error(parsed, position):
+    # Remove the mark at the offset
+    return parsed.replace(position, position + 1, "")
+
+
+def generate_r_error(parsed, correct_character, wrong_character, position, rng=random):
+    if position == "end":
+        # Replace the punctuation ending the sentence
+        if not parsed.marks or parsed.marks[-1][0] != len(parsed.text) - 1:
+            return None
+        offset = parsed.marks[-1][0]
     else:
-        pos = -1
-        for _ in range(sentence.count(character)):
-            pos = sentence.find(character, pos + 1)
-            if pos != -1 and sentence[pos:pos + len(character)] == character:
-                break
-        if pos != -1:
-            error_sentence = sentence[:pos] + sentence[pos + len(character):]
-        else:
-            error_sentence = sentence
-
-    return error_sentence
-
-
-def generate_r_error(sentence, correct_end_punctuation, correct_character, wrong_character, position):
-    if position == "middle":
-        error_sentence = sentence.replace(correct_character, wrong_character)
-    elif position == "end":
-        error_sentence = sentence.replace(
-            correct_end_punctuation, wrong_character)
-
-    return error_sentence
+        # Replace an occurrence of the correct character inside the sentence, the last character if it is the only one
+        offsets = [mark[0] for mark in parsed.marks if mark[1] == correct_character]
+        inside = [offset for offset in offsets if offset != len(parsed.text) - 1]
+        offset = rng.choice(inside or offsets)
+
+    return parsed.replace(offset, offset + 1, wrong_character)
@@ -0,0 +1,140 @@
+# This file is part of the EstGEC punctuation error synthesizer
+# Author: Christian-Enrique Hindremäe
+# 2024
+
+# file: instrumentation.py
+#
+# Stage timers and cProfile hooks
+# Imported as a module in synthesizer.py and analyzer.py, timers can be read by any code embedding them
+#
+# Timers are off until enable() is called. A timed section starts with start() and ends with stop()
+# or lap(), both do nothing when the timers are off, so the sections cost two function calls per sentence:
+#
+#     started = instrumentation.start()
+#     ...
+#     instrumentation.stop("tokenization", started)
+#
+# Timings of worker processes are collected with collect() and added to the main process with merge(),
+# after which the seconds of a stage are the sum over every process. Threads of a process share the timers
+
+import os
+import time
+import cProfile
+import threading
+import multiprocessing.util
+
+enabled = False
+
+# Stage name to [calls, seconds]
+timings = {}
+# Held while a timer is updated, as the stages of a pipelined run update them from several threads
+lock = threading.Lock()
+
+
+def enable(on=True):
+    global enabled
+    enabled = on
+
+
+def reset():
+    timings.clear()
+
+
+# Start of a timed section, None when the timers are off
+def start():
+    if enabled:
+        return time.perf_counter()
+    return None
+
+
+# End a timed section started with start()
+def stop(name, started):
+    if started is None:
+        return
+    seconds = time.perf_counter() - started
+    with lock:
+        timing = timings.get(name)
+        if timing is None:
+            timing = timings[name] = [0, 0.0]
+        timing[0] += 1
+        timing[1] += seconds
+
+
+# End a timed section and start the next one at the same moment
+def lap(name, started):
+    if started is None:
+        return None
+    now = time.perf_counter()
+    with lock:
+        timing = timings.get(name)
+        if timing is None:
+            timing = timings[name] = [0, 0.0]
+        timing[0] += 1
+        timing[1] += now - started
+    return now
+
+
+# Time every item drawn from an iterable as a call of the stage
+def timed_iterator(name, iterable):
+    if not enabled:
+        return iterable
+    return timed_items(name, iterable)
+
+
+def timed_items(name, iterable):
+    iterator = iter(iterable)
+    while True:
+        started = start()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            stop(name, started)
+            return
+        stop(name, started)
+        yield item
+
+
+# Stage timers as a dictionary of calls and seconds
+def snapshot():
+    return {name: {"calls": calls, "seconds": round(seconds, 6)} for name, (calls, seconds) in timings.items()}
+
+
+# Timers of a worker process since the last collection, sent to the main process with the results
+def collect():
+    collected = {name: tuple(timing) for name, timing in timings.items()}
+    timings.clear()
+    return collected
+
+
+# Add timers collected in another process
+def merge(collected):
+    with lock:
+        for name, (calls, seconds) in collected.items():
+            timing = timings.get(name)
+            if timing is None:
+                timing = timings[name] = [0, 0.0]
+            timing[0] += calls
+            timing[1] += seconds
+
+
+def start_profile():
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def dump_profile(profiler, path):
+    profiler.disable()
+    profiler.dump_stats(path)
+
+
+def worker_profile_path(prefix):
+    return f"{prefix}.worker-{os.getpid()}.prof"
+
+
+# Profile a pool worker from its start until it exits, into a file of its own
+# The profile is only written when the worker exits normally, so the pool has to be closed and joined
+def profile_worker(prefix):
+    profiler = start_profile()
+    multiprocessing.util.Finalize(None, dump_profile, args=(profiler, worker_profile_path(prefix)),
+                                  exitpriority=10)
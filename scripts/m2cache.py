@@ -0,0 +1,295 @@
+# This file is part of the EstGEC punctuation error synthesizer
+# Author: Christian-Enrique Hindremäe
+# 2024
+
+# file: m2cache.py
+#
+# Parse-once cache of the annotated gold token files
+# Imported as a module in analyzer.py
+#
+# Every M2 file is parsed once into columns and stored in the cache directory under the SHA-256 hash of its
+# content, so a changed file is parsed again into a new entry and an unchanged one is read from the cache
+# wherever it is moved. The language level comes from the directory of the file and is not part of the entry
+#
+# Cache entry layout:
+#   magic bytes, format version and header length as little-endian uint32 numbers
+#   JSON header - byte order and the array layout
+#   arrays - flat int32 arrays aligned to 8 bytes, strings are stored as indexes into the interned strings
+#     string_offsets - start of every interned string in string_data, followed by the end of the last string
+#     tokens - tokens of every sentence, one sentence after another
+#     sentence_offsets - start of every sentence in tokens, followed by the end of the last sentence
+#     edit_sentences - sentence of every edit, edits before the first sentence are left out
+#     edit_starts, edit_ends - token span of every edit
+#     edit_types, edit_corrections, edit_annotators - error type, correction and annotator of every edit
+#   string_data - interned strings of the file (tokens, error types, corrections and annotators) in UTF-8
+
+import io
+import os
+import sys
+import json
+import array
+import struct
+import hashlib
+import itertools
+import multiprocessing
+import instrumentation
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MAGIC = b"ESTM2CAC"
+FORMAT_VERSION = 1
+CACHE_EXTENSION = ".m2c"
+
+PREFIX = struct.Struct("<8sII")
+ALIGNMENT = 8
+INDEX_TYPE = "i"
+
+ARRAY_NAMES = ["string_offsets", "tokens", "sentence_offsets", "edit_sentences", "edit_starts", "edit_ends",
+               "edit_types", "edit_corrections", "edit_annotators"]
+STRING_COLUMNS = ["edit_types", "edit_corrections", "edit_annotators"]
+
+
+def align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+# Columns of a single gold token file
+#   string_data - interned strings in UTF-8, string i is string_data[string_offsets[i]:string_offsets[i + 1]]
+#   arrays - the columns by their names in ARRAY_NAMES, every string column holds indexes of interned strings
+#   cached - whether the columns were read from the cache rather than parsed
+class ParsedFile:
+
+    def __init__(self, string_data, arrays, cached=False):
+        self.string_data = string_data
+        self.arrays = arrays
+        self.cached = cached
+
+    @property
+    def sentence_count(self):
+        return len(self.arrays["sentence_offsets"]) - 1
+
+    @property
+    def string_count(self):
+        return len(self.arrays["string_offsets"]) - 1
+
+
+# Parse the text of an M2 file into columns, splitting the lines the same way analyzer.count_file does
+# Strings are interned once the whole file is read, with a single dictionary lookup for each of them
+def parse_text(text):
+    tokens = []
+    sentence_offsets = [0]
+    edit_columns = {name: [] for name in ARRAY_NAMES if name.startswith("edit_")}
+    sentence = -1
+
+    # Lines are split like those of a file read in text mode
+    for line in io.StringIO(text, newline=None):
+        line = line.strip()
+        if not line:
+            continue
+        parts = line.split("|||")
+        parameters = parts[0].split()
+
+        if parameters[0] == "S":
+            sentence += 1
+            tokens.extend(parameters[1:])
+            sentence_offsets.append(len(tokens))
+
+        elif parameters[0] == "A" and sentence >= 0:
+            edit_columns["edit_sentences"].append(sentence)
+            edit_columns["edit_starts"].append(int(parameters[1]))
+            edit_columns["edit_ends"].append(int(parameters[2]))
+            edit_columns["edit_types"].append(parts[1])
+            edit_columns["edit_corrections"].append(parts[2])
+            edit_columns["edit_annotators"].append(parts[-1])
+
+    string_indexes = dict.fromkeys(itertools.chain(tokens, *(edit_columns[name] for name in STRING_COLUMNS)))
+    string_indexes.update(zip(string_indexes, itertools.count()))
+    encoded = [string.encode("utf8") for string in string_indexes]
+
+    arrays = {"string_offsets": array.array(INDEX_TYPE, itertools.accumulate(map(len, encoded), initial=0)),
+              "tokens": array.array(INDEX_TYPE, map(string_indexes.__getitem__, tokens)),
+              "sentence_offsets": array.array(INDEX_TYPE, sentence_offsets)}
+    for name, values in edit_columns.items():
+        if name in STRING_COLUMNS:
+            values = map(string_indexes.__getitem__, values)
+        arrays[name] = array.array(INDEX_TYPE, values)
+    return ParsedFile(b"".join(encoded), arrays)
+
+
+# Write the columns into a cache entry, renamed over the old entry so readers never see a partial one
+def write_entry(parsed, path):
+    layout = {}
+    offset = 0
+    for name in ARRAY_NAMES:
+        values = parsed.arrays[name]
+        layout[name] = {"offset": offset, "length": len(values)}
+        offset = align(offset + len(values) * values.itemsize)
+    layout["string_data"] = {"offset": offset, "length": len(parsed.string_data)}
+
+    header = json.dumps({"byteorder": sys.byteorder, "arrays": layout}).encode("utf8")
+    data_start = align(PREFIX.size + len(header))
+
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "wb") as f:
+        f.write(PREFIX.pack(MAGIC, FORMAT_VERSION, len(header)))
+        f.write(header)
+        f.write(b"\0" * (data_start - PREFIX.size - len(header)))
+        for name in ARRAY_NAMES:
+            f.write(parsed.arrays[name].tobytes())
+            f.write(b"\0" * (align(f.tell() - data_start) - (f.tell() - data_start)))
+        f.write(parsed.string_data)
+    os.replace(temporary_path, path)
+
+
+# Read a cache entry, raising ValueError if it is not a complete entry of the current format version
+def read_entry(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < PREFIX.size:
+        raise ValueError(f"{path} is not an M2 cache entry")
+    magic, version, header_length = PREFIX.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not an M2 cache entry")
+    if version != FORMAT_VERSION:
+        raise ValueError(f"{path} has cache format version {version}, expected {FORMAT_VERSION}")
+
+    header = json.loads(data[PREFIX.size:PREFIX.size + header_length].decode("utf8"))
+    data_start = align(PREFIX.size + header_length)
+    layout = header["arrays"]
+    arrays = {}
+    for name in ARRAY_NAMES:
+        values = array.array(INDEX_TYPE)
+        start = data_start + layout[name]["offset"]
+        values.frombytes(data[start:start + layout[name]["length"] * values.itemsize])
+        if header["byteorder"] != sys.byteorder:
+            values.byteswap()
+        arrays[name] = values
+    start = data_start + layout["string_data"]["offset"]
+    string_data = data[start:start + layout["string_data"]["length"]]
+    if (not arrays["string_offsets"] or not arrays["sentence_offsets"]
+            or arrays["string_offsets"][-1] != len(string_data)):
+        raise ValueError(f"{path} is not a complete M2 cache entry")
+    return ParsedFile(string_data, arrays, cached=True)
+
+
+# Columns of a gold token file, from its cache entry if there is one for the content of the file
+# Without a cache directory the file is always parsed
+def load_file(path, cache_dir=None):
+    with open(path, "rb") as f:
+        content = f.read()
+    if not cache_dir:
+        return parse_text(content.decode("utf-8"))
+
+    entry_path = os.path.join(cache_dir, hashlib.sha256(content).hexdigest() + CACHE_EXTENSION)
+    if os.path.exists(entry_path):
+        try:
+            return read_entry(entry_path)
+        except ValueError:
+            pass
+    parsed = parse_text(content.decode("utf-8"))
+    os.makedirs(cache_dir, exist_ok=True)
+    write_entry(parsed, entry_path)
+    return parsed
+
+
+def load_file_star(arguments):
+    return load_file(*arguments)
+
+
+# Columns of every file in the order of the paths, in worker processes if more than one worker is given
+# Workers are profiled into files of their own when a profile prefix is given
+def load_files(paths, cache_dir=None, workers=1, profile_prefix=None):
+    arguments = [(path, cache_dir) for path in paths]
+    if workers > 1:
+        initializer = instrumentation.profile_worker if profile_prefix else None
+        with multiprocessing.Pool(workers, initializer=initializer, initargs=(profile_prefix,)) as pool:
+            files = list(pool.imap(load_file_star, arguments, chunksize=max(1, len(paths) // (workers * 8))))
+            # Workers write their profiles only when they exit normally
+            pool.close()
+            pool.join()
+        return files
+    return [load_file(*argument) for argument in arguments]
+
+
+# Columns of many files joined into NumPy arrays
+# The string tables of the files are joined one after another, so a string of several files has several
+# indexes. Only the strings an aggregation needs are decoded and turned into symbols, which are distinct
+#   string_data, string_offsets - joined strings of the files, which the string columns index
+#   symbols, symbol_indexes - distinct strings and the index of every symbol
+#   levels - language level of every file, file_sentences - number of sentences of every file
+#   sentence_levels - index of the level of every sentence into level_names, in the order of first appearance
+#   tokens, sentence_offsets and the edit columns as in a single file, indexes are into the joined tables
+class Corpus:
+
+    def __init__(self, files, levels):
+        if numpy is None:
+            raise RuntimeError("Joining cached files needs NumPy")
+        self.symbols = []
+        self.symbol_indexes = {}
+        self.levels = list(levels)
+        self.level_names = list(dict.fromkeys(self.levels))
+        self.file_sentences = [parsed.sentence_count for parsed in files]
+        self.string_data = b"".join(parsed.string_data for parsed in files)
+
+        columns = {name: [] for name in ARRAY_NAMES}
+        sentence_levels = []
+        string_base = 0
+        byte_base = 0
+        sentence_base = 0
+        token_base = 0
+        for parsed, level in zip(files, self.levels):
+            arrays = {name: numpy.frombuffer(parsed.arrays[name], dtype=numpy.int32).astype(numpy.int64)
+                      for name in ARRAY_NAMES}
+            columns["string_offsets"].append(arrays["string_offsets"][:-1] + byte_base)
+            columns["tokens"].append(arrays["tokens"] + string_base)
+            columns["sentence_offsets"].append(arrays["sentence_offsets"][:-1] + token_base)
+            columns["edit_sentences"].append(arrays["edit_sentences"] + sentence_base)
+            columns["edit_starts"].append(arrays["edit_starts"])
+            columns["edit_ends"].append(arrays["edit_ends"])
+            for name in STRING_COLUMNS:
+                columns[name].append(arrays[name] + string_base)
+            sentence_levels.append(numpy.full(parsed.sentence_count, self.level_names.index(level),
+                                              dtype=numpy.int64))
+            string_base += parsed.string_count
+            byte_base += len(parsed.string_data)
+            sentence_base += parsed.sentence_count
+            token_base += len(arrays["tokens"])
+        columns["string_offsets"].append(numpy.array([byte_base], dtype=numpy.int64))
+        columns["sentence_offsets"].append(numpy.array([token_base], dtype=numpy.int64))
+
+        for name, parts in columns.items():
+            setattr(self, name, numpy.concatenate(parts) if parts else numpy.zeros(0, dtype=numpy.int64))
+        self.sentence_levels = (numpy.concatenate(sentence_levels) if sentence_levels
+                                else numpy.zeros(0, dtype=numpy.int64))
+        self.sentence_lengths = numpy.diff(self.sentence_offsets)
+
+    def string(self, index):
+        return self.string_data[self.string_offsets[index]:self.string_offsets[index + 1]].decode("utf8")
+
+    def intern(self, symbol):
+        index = self.symbol_indexes.get(symbol)
+        if index is None:
+            index = self.symbol_indexes[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+        return index
+
+    # Symbols of the strings at the given string indexes, each distinct index is decoded once
+    def symbols_of(self, string_indexes):
+        unique, inverse = numpy.unique(string_indexes, return_inverse=True)
+        data = self.string_data
+        starts = self.string_offsets[unique].tolist()
+        ends = self.string_offsets[unique + 1].tolist()
+        symbols = numpy.array([self.intern(data[start:end].decode("utf8")) for start, end in zip(starts, ends)],
+                              dtype=numpy.int64)
+        return symbols[inverse.reshape(-1)]
+
+    @property
+    def sentence_count(self):
+        return len(self.sentence_levels)
+
+    # String index of the token at a position of every given sentence
+    def token_at(self, sentences, positions):
+        return self.tokens[self.sentence_offsets[sentences] + positions]
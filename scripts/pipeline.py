@@ -0,0 +1,122 @@
+# This file is part of the EstGEC punctuation error synthesizer
+# Author: Christian-Enrique Hindremäe
+# 2024
+
+# file: pipeline.py
+#
+# Stages of a synthesis run in threads of their own, connected by bounded queues
+# Imported as a module in main file synthesizer.py
+#
+# A stage runs an iterator in its thread and hands the items to the next stage through a queue of a few
+# items. A full queue blocks the stage filling it, so no stage runs further ahead of the next one than the
+# queue holds. Every stage is a single thread taking items in order, so the items come out of the last stage
+# in the order they went into the first one
+#
+# An error in a stage is passed on in place of the next item and raised in the stage reading it, so it
+# reaches the code reading the last stage. Closing the pipeline stops every stage and waits for its thread,
+# also when a stage is blocked on a full or empty queue
+#
+# Reading the source and compressing the output release the GIL, so a stage reading the source and a stage
+# synthesizing the errors let the main thread write the output in the meantime
+
+import queue
+import threading
+
+# Items held by the queue after a stage, chunks of sentences for the stages of the synthesizer
+QUEUE_SIZE = 4
+
+# Seconds a stage blocked on a full queue waits before checking whether the pipeline is closing
+POLL_INTERVAL = 0.1
+
+# Kinds of the entries of a queue
+ITEM = 0
+END = 1
+ERROR = 2
+
+
+# Raised in a stage reading from a stage that was closed
+class PipelineClosed(Exception):
+    pass
+
+
+# Iterator run in a thread, iterating the stage yields its items from the queue
+class Stage:
+
+    def __init__(self, iterable, name, size=QUEUE_SIZE):
+        self.name = name
+        self.queue = queue.Queue(size)
+        self.closing = threading.Event()
+        self.thread = threading.Thread(target=self.run, args=(iterable,), name=name, daemon=True)
+        self.thread.start()
+
+    def run(self, iterable):
+        iterator = iter(iterable)
+        try:
+            for item in iterator:
+                if not self.put((ITEM, item)):
+                    break
+            else:
+                self.put((END, None))
+        except BaseException as error:
+            self.put((ERROR, error))
+        finally:
+            # A generator stopped early is closed in its own thread, so it can release what it holds
+            if hasattr(iterator, "close"):
+                iterator.close()
+
+    # Put an entry into the queue, returns False if the stage was closed before there was room for it
+    def put(self, entry):
+        while not self.closing.is_set():
+            try:
+                self.queue.put(entry, timeout=POLL_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def __iter__(self):
+        while True:
+            kind, value = self.queue.get()
+            if kind == END:
+                return
+            if kind == ERROR:
+                raise value
+            yield value
+
+    # Wait for the thread of a closing stage, and wake a stage waiting for its items
+    def join(self):
+        self.thread.join()
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+        self.queue.put_nowait((ERROR, PipelineClosed(f"{self.name} stage was closed")))
+
+
+# Stages of a run, closed together once the run ends or fails
+# Stages are added from the first to the last, each one usually iterating the stage before it
+class Pipeline:
+
+    def __init__(self):
+        self.stages = []
+
+    def stage(self, iterable, name, size=QUEUE_SIZE):
+        stage = Stage(iterable, name, size)
+        self.stages.append(stage)
+        return stage
+
+    # Every stage is told to stop before any is waited for, so a stage blocked on the queue of the next
+    # stage stops, and a stage blocked on the queue of the previous stage is woken by its join
+    def close(self):
+        for stage in self.stages:
+            stage.closing.set()
+        for stage in self.stages:
+            stage.join()
+        self.stages = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
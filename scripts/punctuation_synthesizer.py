@@ -0,0 +1,117 @@
+# This file is part of the EstGEC punctuation error synthesizer
+# Author: Christian-Enrique Hindremäe
+# 2024
+
+# file: punctuation_synthesizer.py
+#
+# In-memory synthesis of punctuation errors, for adding fresh noise to sentences while training
+# Imported as a module by code embedding the synthesizer, with the scripts directory on sys.path
+#
+# Usage:
+#   from punctuation_synthesizer import PunctuationSynthesizer
+#   noise = PunctuationSynthesizer("statistics.bin", seed=1)
+#   correct, incorrect, error_types = noise.synthesize("Ta ütles, et tuleb homme.")
+#   pairs = noise.synthesize_batch(sentences, first_index=index, epoch=epoch)
+#
+# The sentences are already segmented, every sentence is synthesized on its own and gets a pair back,
+# the same sentence twice when no error was drawn for it or could be placed. Errors are drawn from
+# counter_rng streams of the seed and the index of the sentence, so a sentence given with its index in
+# the dataset gets the same error in any dataloader worker, and another epoch gives it another error.
+# The errors of epoch 0 are those a synthesizer.py run with the same seed, statistics and --max-errors
+# writes for the first variant of the sentence at that index, unless the sentence before it asked for
+# lowercasing
+#
+# Sentences given without an index are numbered by a counter of the process. A copy of the synthesizer
+# in a dataloader worker, forked or unpickled, starts a counter of its own with a seed drawn for the
+# worker, so workers never repeat each other's errors; give the indexes for errors that can be repeated
+
+import os
+import statistics_store
+import counter_rng
+import error_generator
+import synthesizer
+import tokenizer
+
+
+# Statistics, samplers and tokenizer are built once. Forked workers share the mapped statistics file,
+# a copy unpickled in another process maps the file at statistics_path again
+#   statistics_path - statistics file made by the analyzer
+#   seed - seed of the errors, drawn if not given
+#   max_errors - errors stacked into a sentence at most, as with --max-errors
+#   tokenizer_name - nltk or regex to tokenize the pairs as in the written corpora, None for the
+#                    sentences as they are
+class PunctuationSynthesizer:
+
+    def __init__(self, statistics_path=statistics_store.STATISTICS_FILE, seed=None, max_errors=1,
+                 tokenizer_name="regex"):
+        if max_errors < 1:
+            raise ValueError("max_errors must be at least 1")
+        store = statistics_store.load_statistics(statistics_path)
+        self.stats = synthesizer.map_statistics(store)
+        self.statistics_path = statistics_path
+        self.statistics_hash = store.source_hash
+        self.seed = counter_rng.random_seed() if seed is None else seed
+        self.max_errors = max_errors
+        self.tokenizer_name = tokenizer_name
+        self.tokenize = tokenizer.get_tokenizer(tokenizer_name) if tokenizer_name else None
+        self.pid = os.getpid()
+        self.counter_seed = self.seed
+        self.next_index = 0
+
+    # Statistics and tokenizers are loaded again after unpickling, and the counter starts anew in the new process
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state["stats"]
+        del state["tokenize"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.stats = synthesizer.map_statistics(statistics_store.load_statistics(self.statistics_path))
+        self.tokenize = tokenizer.get_tokenizer(self.tokenizer_name) if self.tokenizer_name else None
+
+    # Indexes of sentences given without one, from the counter of the current process
+    def take_indexes(self, count):
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.counter_seed = counter_rng.random_seed()
+            self.next_index = 0
+        first_index = self.next_index
+        self.next_index += count
+        return self.counter_seed, first_index
+
+    # Synthesize an error into a sentence
+    # Returns a (correct, incorrect, error types) tuple, where the error types are e.g. "r" or "mr",
+    # or None with the sentence unchanged
+    def synthesize(self, sentence, index=None, epoch=0):
+        return self.synthesize_batch([sentence], index, epoch)[0]
+
+    # Synthesize errors into a list of sentences, numbered from first_index if it is given
+    # The decisions of the whole batch are drawn at once. Returns a tuple for every sentence as synthesize does
+    def synthesize_batch(self, sentences, first_index=None, epoch=0):
+        if first_index is None:
+            seed, first_index = self.take_indexes(len(sentences))
+        else:
+            seed = self.seed
+        seed = counter_rng.epoch_seed(seed, epoch)
+        stats = self.stats
+        introduce_errors, type_draws = error_generator.determine_batch_errors(
+            stats["punctuation_error"], seed, first_index, len(sentences))
+
+        pairs = []
+        for index, (sentence, introduce_error, type_draw) in enumerate(zip(sentences, introduce_errors, type_draws)):
+            error_sentence = None
+            if introduce_error:
+                parsed = error_generator.parse_sentence(sentence)
+                u_candidates = error_generator.find_unnecessary_candidates(parsed, stats["u_combinations"])
+                rng = counter_rng.StreamRandom(seed, first_index + index, counter_rng.VARIANT_STREAM)
+                error_sentence, error_types, _ = synthesizer.place_errors(
+                    parsed, u_candidates, stats, type_draw, self.max_errors, rng)
+            if error_sentence is None:
+                correct = " ".join(self.tokenize(sentence)) if self.tokenize else sentence
+                pairs.append((correct, correct, None))
+            elif self.tokenize:
+                pairs.append((*tokenizer.tokenize_pair(sentence, error_sentence, self.tokenize), error_types))
+            else:
+                pairs.append((sentence, error_sentence, error_types))
+        return pairs
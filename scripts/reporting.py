@@ -0,0 +1,152 @@
+# This file is part of the EstGEC punctuation error synthesizer
+# Author: Christian-Enrique Hindremäe
+# 2024
+
+# file: reporting.py
+#
+# Logging setup, progress reports and metrics of a synthesis run
+# Imported as a module in main file synthesizer.py and analyzer.py
+
+import json
+import time
+import logging
+from contextlib import contextmanager
+import instrumentation
+
+LOG_FORMAT = "%(asctime)s    %(levelname)s %(name)s: %(message)s"
+LOG_LEVELS = ["DEBUG", "INFO", "WARNING", "ERROR"]
+
+logger = logging.getLogger(__name__)
+
+
+# Send the log records of every module to stderr, debug output is off unless asked for
+def configure_logging(level="INFO"):
+    logging.basicConfig(level=level, format=LOG_FORMAT)
+
+
+# Logs the progress at most once per interval, however often it is updated
+# The rate is given in sentences per second, the remaining time is estimated from the share of the
+# source read so far when the size of the source and a function returning the read position are given
+# A run continued from a checkpoint gives the sentences and the position it started from, so the rate
+# and the estimate only cover the work done since
+class ProgressReporter:
+
+    def __init__(self, total_bytes=None, position=None, interval=10.0, start_sentences=0):
+        self.total_bytes = total_bytes
+        self.position = position
+        self.interval = interval
+        self.start = time.monotonic()
+        self.last_report = self.start
+        self.start_sentences = start_sentences
+        self.start_bytes = position() if position else 0
+
+    def update(self, sentence_count, pair_count):
+        now = time.monotonic()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            self.report(sentence_count, pair_count, now)
+
+    def report(self, sentence_count, pair_count, now=None):
+        elapsed = (now or time.monotonic()) - self.start
+        rate = (sentence_count - self.start_sentences) / elapsed if elapsed > 0 else 0.0
+        message = f"Progress: {sentence_count} sentences, {pair_count} pairs, {rate:.0f} sentences/s"
+
+        if self.total_bytes and self.position:
+            read_bytes = self.position()
+            if self.start_bytes < read_bytes <= self.total_bytes:
+                remaining = elapsed * (self.total_bytes - read_bytes) / (read_bytes - self.start_bytes)
+                message += f", {read_bytes / self.total_bytes:.1%} read, ETA {format_duration(remaining)}"
+        logger.info(message)
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+# Counters and stage timings of a synthesis run, summarized as JSON at the end of the run
+class RunMetrics:
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.sentences_read = 0
+        self.pairs_written = 0
+        self.errors = {"u": 0, "m": 0, "r": 0}
+        # Sentences drawn for an error which could not be placed into them, counted for every variant
+        self.skipped_sentences = 0
+        # Variants equal to an earlier variant of the same sentence
+        self.duplicate_variants = 0
+        # Source sentences dropped as repeats of an earlier sentence, not counted as read
+        self.duplicate_sentences = 0
+        self.stage_times = {}
+        # Sentences written before the checkpoint a run was continued from
+        self.resumed_sentences = 0
+
+    # Time a stage of the run, repeated stages are added together
+    @contextmanager
+    def stage(self, name):
+        stage_start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.stage_times[name] = self.stage_times.get(name, 0.0) + time.monotonic() - stage_start
+
+    # Count the results of a single sentence, an (error types, tokenized pair) tuple for every variant an
+    # error was drawn for, where the pair is None if the error could not be placed
+    def count(self, variants, duplicates=0):
+        self.sentences_read += 1
+        for error_types, tokenized_pair in variants:
+            if tokenized_pair is not None:
+                self.pairs_written += 1
+                for error_type in error_types:
+                    self.errors[error_type] += 1
+            else:
+                self.skipped_sentences += 1
+        self.duplicate_variants += duplicates
+
+    # Counters of the run, kept in checkpoints
+    def counters(self):
+        return {"sentences_read": self.sentences_read, "pairs_written": self.pairs_written,
+                "errors": dict(self.errors), "skipped_sentences": self.skipped_sentences,
+                "duplicate_variants": self.duplicate_variants}
+
+    # Continue the counters of a checkpoint, the rate of the run only counts the sentences after it
+    def restore(self, counters):
+        self.sentences_read = self.resumed_sentences = counters["sentences_read"]
+        self.pairs_written = counters["pairs_written"]
+        self.errors = dict(counters["errors"])
+        self.skipped_sentences = counters["skipped_sentences"]
+        self.duplicate_variants = counters["duplicate_variants"]
+
+    def summary(self):
+        wall_time = time.monotonic() - self.start
+        synthesis_time = self.stage_times.get("synthesis", 0.0)
+        synthesized = self.sentences_read - self.resumed_sentences
+        summary = {
+            "sentences_read": self.sentences_read,
+            "pairs_written": self.pairs_written,
+            "errors": dict(self.errors),
+            "skipped_sentences": self.skipped_sentences,
+            "duplicate_variants": self.duplicate_variants,
+            "duplicate_sentences": self.duplicate_sentences,
+            "sentences_per_second": round(synthesized / synthesis_time, 1) if synthesis_time else None,
+            "stage_seconds": {name: round(seconds, 3) for name, seconds in self.stage_times.items()},
+            "wall_seconds": round(wall_time, 3),
+        }
+        if self.resumed_sentences:
+            summary["resumed_from_sentence"] = self.resumed_sentences
+        # Seconds of the stages are summed over every process in a parallel run
+        if instrumentation.enabled:
+            summary["stage_timers"] = instrumentation.snapshot()
+        return summary
+
+    # Log the summary and write it into a JSON file if a path is given
+    def write(self, path=None):
+        summary = self.summary()
+        logger.info("Metrics: %s", json.dumps(summary))
+        if path:
+            with open(path, "w", encoding="utf8") as f:
+                json.dump(summary, f, indent=2)
+                f.write("\n")
+        return summary
@@ -0,0 +1,139 @@
+# This file is part of the EstGEC punctuation error synthesizer
+# Author: Christian-Enrique Hindremäe
+# 2024
+
+# file: sampler.py
+#
+# Weighted samplers drawing from the alias tables stored in the statistics file
+# Imported as a module in statistics_store.py and synthesizer.py
+
+import random
+
+
+# Walker/Vose alias table of a list of weights
+# Returns the probability of keeping every column and the column drawn instead, the alias
+def alias_table(weights):
+    size = len(weights)
+    total = sum(weights)
+    if size == 0 or total <= 0:
+        raise ValueError("Sampler needs at least one choice with a positive weight")
+
+    scaled = [weight * size / total for weight in weights]
+    probabilities = [1.0] * size
+    aliases = list(range(size))
+    small = [i for i, weight in enumerate(scaled) if weight < 1]
+    large = [i for i, weight in enumerate(scaled) if weight >= 1]
+    while small and large:
+        less = small.pop()
+        more = large.pop()
+        probabilities[less] = scaled[less]
+        aliases[less] = more
+        scaled[more] = scaled[more] + scaled[less] - 1
+        if scaled[more] < 1:
+            small.append(more)
+        else:
+            large.append(more)
+    return probabilities, aliases
+
+
+# Sampler over an alias table, every draw takes constant time
+# The probabilities and aliases are lists, or views of the arrays precomputed in the statistics file
+class AliasSampler:
+    __slots__ = ("choices", "probabilities", "aliases", "size")
+
+    def __init__(self, choices, probabilities, aliases):
+        self.choices = choices
+        self.probabilities = probabilities
+        self.aliases = aliases
+        self.size = len(choices)
+
+    # Draw one choice, the integer part of a single uniform number picks the column
+    # and the fractional part decides between the column and its alias
+    def sample(self, rng=random):
+        position = rng.random() * self.size
+        column = int(position)
+        if position - column < self.probabilities[column]:
+            return self.choices[column]
+        return self.choices[self.aliases[column]]
+
+
+# Build a sampler from a dictionary of weights, or None if nothing can be drawn
+def build_sampler(weights):
+    options = {key: value for key, value in weights.items() if value > 0}
+    if not options:
+        return None
+    probabilities, aliases = alias_table(list(options.values()))
+    return AliasSampler(list(options), probabilities, aliases)
+
+
+# Samplers of punctuation marks for every error type, drawing from the tables of a statistics file
+# Draws from every mark of a table use the alias table stored in the file. Draws restricted to the marks
+# present in a sentence use a sampler built for that subset of marks, which is cached. Subsets are
+# intersected with the marks known from statistics first, so the number of cached samplers is bounded
+# by the statistics rather than by the input text
+class PunctuationSamplers:
+
+    def __init__(self, store):
+        self.unnecessary_punctuation = store.weights("unnecessaryPunctuation")
+        self.missing_punctuation = store.weights("missingPunctuation")
+        self.replacement_punctuation = store.weights("replacementPunctuation")
+        self.total_fixes = store.nested("fixesTotalPunctuation")
+        self.middle_fixes = store.nested("fixesMiddlePunctuation")
+        self.end_fixes = store.nested("fixesEndPunctuation")
+
+        # Every character which has been used as a correction
+        self.fix_characters = self.total_fixes.inner_marks
+
+        self.unnecessary_cache = {}
+        self.missing_cache = {}
+        self.wrong_cache = {}
+        self.correct_cache = {}
+        self.position_cache = {}
+
+    # Draw an unnecessary character out of the characters given as options
+    def unnecessary(self, options, rng=random):
+        key = frozenset(options).intersection(self.unnecessary_punctuation.marks)
+        if key not in self.unnecessary_cache:
+            self.unnecessary_cache[key] = self.unnecessary_punctuation.sampler(key)
+        sampler = self.unnecessary_cache[key]
+        return sampler.sample(rng) if sampler else None
+
+    # Draw a missing character out of the punctuation marks present in the sentence
+    def missing(self, correct_punctuations, rng=random):
+        key = frozenset(correct_punctuations).intersection(self.missing_punctuation.marks)
+        if key not in self.missing_cache:
+            self.missing_cache[key] = self.missing_punctuation.sampler(key)
+        sampler = self.missing_cache[key]
+        return sampler.sample(rng) if sampler else None
+
+    # Draw the wrong character, the correct character it replaces and the position of the replacement
+    # Wrong characters are limited to those whose corrections contain any of the present punctuation marks
+    def replacement(self, correct_punctuations, rng=random):
+        present = frozenset(correct_punctuations).intersection(self.fix_characters)
+        if present not in self.wrong_cache:
+            self.wrong_cache[present] = self.replacement_punctuation.sampler(
+                {key for key in self.replacement_punctuation.marks if present & self.total_fixes.row(key).marks})
+        wrong_sampler = self.wrong_cache[present]
+        if wrong_sampler is None:
+            return None, None, None
+        wrong_choice = wrong_sampler.sample(rng)
+
+        correct_key = (wrong_choice, present)
+        if correct_key not in self.correct_cache:
+            self.correct_cache[correct_key] = self.total_fixes.row(wrong_choice).sampler(present)
+        correct_sampler = self.correct_cache[correct_key]
+        if correct_sampler is None:
+            return None, None, None
+        correct_choice = correct_sampler.sample(rng)
+
+        position_key = (wrong_choice, correct_choice)
+        if position_key not in self.position_cache:
+            end_percentage = self.end_fixes.row(wrong_choice).get(correct_choice, 0)
+            middle_percentage = self.middle_fixes.row(wrong_choice).get(correct_choice, 0)
+            self.position_cache[position_key] = build_sampler(
+                {"end": end_percentage, "middle": middle_percentage})
+        position_sampler = self.position_cache[position_key]
+        if position_sampler is None:
+            return None, None, None
+
+        return correct_choice, wrong_choice, position_sampler.sample(rng)
@@ -0,0 +1,108 @@
+# This file is part of the EstGEC punctuation error synthesizer
+# Author: Christian-Enrique Hindremäe
+# 2024
+
+# file: segmenter.py
+#
+# Streaming sentence segmentation of source text
+# Imported as a module in main file synthesizer.py
+
+import os
+
+# Characters punkt considers as possible sentence boundaries
+SENTENCE_END_CHARACTERS = (".", "?", "!")
+
+# Upper bound for the unfinished text kept in the buffer. Text without any sentence boundary
+# longer than this is emitted as it is, which keeps both memory and re-tokenization cost bounded
+MAX_BUFFER_CHARACTERS = 10000
+
+
+# Sentence tokenizer, loaded on first use so importing the module does not touch nltk
+sentence_tokenizer = None
+
+
+# Load the punkt sentence tokenizer from local nltk data, nothing is downloaded
+# The directory given here is searched before NLTK_DATA and nltk's default locations
+def load_sentence_tokenizer(nltk_data_dir=None):
+    global sentence_tokenizer
+    import nltk
+    if nltk_data_dir:
+        nltk.data.path.insert(0, os.path.abspath(nltk_data_dir))
+    try:
+        try:
+            from nltk.tokenize import PunktTokenizer
+            sentence_tokenizer = PunktTokenizer("english").tokenize
+        except ImportError:
+            # nltk versions before 3.8.2 only ship the pickled model
+            sentence_tokenizer = nltk.data.load("tokenizers/punkt/english.pickle").tokenize
+    except LookupError:
+        raise SystemExit("Punkt sentence tokenizer data not found. Download it once with "
+                         "'python -m nltk.downloader -d DIR punkt punkt_tab' and pass --nltk-data DIR "
+                         "or set NLTK_DATA=DIR")
+    return sentence_tokenizer
+
+
+def contains_sentence_end(text):
+    for character in SENTENCE_END_CHARACTERS:
+        if character in text:
+            return True
+    return False
+
+
+# Sentence segmentation of a stream of lines, fed one line at a time
+# As the necessary format for Fairseq is having one sentence per line, unfinished text is kept in a
+# buffer to prevent splitting a sentence across multiple lines. Only the unfinished tail is ever
+# passed to the tokenizer, and only when the new line can change where a sentence ends: either the
+# line contains a boundary character or the previous line ended with a token containing one
+# The buffer is the whole state of the segmenter, so segmentation can be continued from state()
+class Segmenter:
+
+    def __init__(self, max_buffer_characters=MAX_BUFFER_CHARACTERS):
+        self.sent_tokenize = sentence_tokenizer or load_sentence_tokenizer()
+        self.max_buffer_characters = max_buffer_characters
+        self.sentence_buffer = ""
+        self.open_boundary = False  # Last token of the buffer contains a boundary character
+
+    # Sentences finished by the line
+    def feed(self, line):
+        line = line.strip()
+        if not line:
+            return []
+
+        self.sentence_buffer += (" " + line)
+        line_has_boundary = contains_sentence_end(line)
+        sentences = []
+
+        if self.open_boundary or line_has_boundary:
+            buffer_sentences = self.sent_tokenize(self.sentence_buffer)
+            sentences = [sentence.strip() for sentence in buffer_sentences[:-1]]
+            self.sentence_buffer = buffer_sentences[-1] if buffer_sentences else ""
+
+        if len(self.sentence_buffer) > self.max_buffer_characters:
+            sentences.append(self.sentence_buffer.strip())
+            self.sentence_buffer = ""
+
+        self.open_boundary = line_has_boundary and contains_sentence_end(line.rsplit(None, 1)[-1])
+        return sentences
+
+    # The tail left in the buffer at the end of input
+    def flush(self):
+        tail = self.sentence_buffer.strip()
+        self.sentence_buffer = ""
+        self.open_boundary = False
+        return [tail] if tail else []
+
+    def state(self):
+        return {"buffer": self.sentence_buffer, "open_boundary": self.open_boundary}
+
+    def restore(self, state):
+        self.sentence_buffer = state["buffer"]
+        self.open_boundary = state["open_boundary"]
+
+
+# Yield sentences one at a time from an iterable of lines
+def segment_lines(lines, max_buffer_characters=MAX_BUFFER_CHARACTERS):
+    segmenter = Segmenter(max_buffer_characters)
+    for line in lines:
+        yield from segmenter.feed(line)
+    yield from segmenter.flush()
@@ -0,0 +1,507 @@
+# This file is part of the EstGEC punctuation error synthesizer
+# Author: Christian-Enrique Hindremäe
+# 2024
+
+# file: server.py
+#
+# Long-lived synthesis server, keeping the statistics, samplers and tokenizers loaded between requests
+# Executed separately, requests are sent with client.py or any HTTP client
+#
+# Usage: python server.py [--host HOST] [--port N] [--socket PATH] [--workers N] [--batch-size N] [--batch-wait MS]
+#                         [--statistics FILE] [--seed N] [--max-errors N] [--tokenizer nltk|regex|none]
+#                         [--nltk-data DIR] [--log-level LEVEL]
+# Where
+#   --host, --port - address of the HTTP server, 127.0.0.1 and 8765 by default
+#   --socket - serve HTTP on a Unix socket at PATH instead of a TCP port
+#   --workers - processes synthesizing the batches, 1 by default synthesizes in the server process
+#   --batch-size - sentences of several requests joined into a batch, 1000 by default. A larger request is a batch alone
+#   --batch-wait - milliseconds a batch waits for more requests, 0 by default joins only the requests already waiting
+#   --statistics - statistics file made by the analyzer, statistics.bin by default
+#   --seed - seed of the errors, drawn if not given
+#   --max-errors - errors stacked into a sentence at most, 1 by default
+#   --tokenizer - word tokenizer of the returned pairs, regex by default, none for untokenized sentences
+#   --nltk-data - local directory containing the punkt sentence tokenizer data, used to segment documents
+#   --log-level - DEBUG, INFO, WARNING or ERROR, INFO by default
+#
+# Endpoints:
+#   POST /synthesize - JSON object with "sentences", a list of segmented sentences, or "documents", a list of texts
+#                      segmented into sentences first. "first_index" numbers the sentences for repeatable errors,
+#                      "epoch" draws other errors for the same indexes. Returns {"pairs": [[correct, incorrect,
+#                      error types], ...]}, or {"documents": [[pairs of the document], ...]} for documents
+#   GET /health - status, workers and the statistics used
+#   GET /metrics - counters of requests, sentences, errors and batches, and request latencies
+#
+# Requests are handled in threads of their own and queued for a batching thread, which joins the waiting
+# requests into batches synthesized in the server process or in the worker pool. While the workers are busy
+# the requests queue up, so batches grow with the load without delaying a single request
+
+import os
+import json
+import time
+import queue
+import signal
+import socket
+import logging
+import argparse
+import threading
+import socketserver
+import multiprocessing
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import counter_rng
+import segmenter
+import reporting
+import statistics_store
+import tokenizer
+from punctuation_synthesizer import PunctuationSynthesizer
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_BATCH_SIZE = 1000
+
+# Largest request body accepted, in bytes
+MAX_REQUEST_BYTES = 64 * 1024 * 1024
+
+# Seconds the queued and running batches are waited for when the server stops, the rest are failed
+DRAIN_SECONDS = 10.0
+
+logger = logging.getLogger("server")
+
+
+# Synthesizer of a worker process, built once when the worker starts
+worker_synthesizer = None
+
+
+def init_worker(statistics_path, seed, max_errors, tokenizer_name, log_level):
+    global worker_synthesizer
+    reporting.configure_logging(log_level)
+    worker_synthesizer = PunctuationSynthesizer(statistics_path, seed, max_errors, tokenizer_name)
+
+
+# Pairs of every job of a batch, a job is a (sentences, first index, epoch) tuple
+def synthesize_jobs(synthesizer, jobs):
+    return [synthesizer.synthesize_batch(sentences, first_index, epoch) for sentences, first_index, epoch in jobs]
+
+
+def synthesize_worker_jobs(jobs):
+    return synthesize_jobs(worker_synthesizer, jobs)
+
+
+# Counters of the server, read by /metrics while requests are updating them
+class ServerMetrics:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = time.monotonic()
+        self.requests = 0
+        self.failed_requests = 0
+        self.sentences = 0
+        self.pairs_with_errors = 0
+        self.errors = {"u": 0, "m": 0, "r": 0}
+        self.batches = 0
+        self.batch_sentences = 0
+        self.largest_batch = 0
+        self.latency_seconds = 0.0
+        self.max_latency_seconds = 0.0
+
+    def count_request(self, pairs, seconds):
+        with self.lock:
+            self.requests += 1
+            self.sentences += len(pairs)
+            for _, _, error_types in pairs:
+                if error_types:
+                    self.pairs_with_errors += 1
+                    for error_type in error_types:
+                        self.errors[error_type] += 1
+            self.latency_seconds += seconds
+            self.max_latency_seconds = max(self.max_latency_seconds, seconds)
+
+    def count_failure(self):
+        with self.lock:
+            self.failed_requests += 1
+
+    def count_batch(self, sentences):
+        with self.lock:
+            self.batches += 1
+            self.batch_sentences += sentences
+            self.largest_batch = max(self.largest_batch, sentences)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "uptime_seconds": round(time.monotonic() - self.start, 3),
+                "requests": self.requests,
+                "failed_requests": self.failed_requests,
+                "sentences": self.sentences,
+                "pairs_with_errors": self.pairs_with_errors,
+                "errors": dict(self.errors),
+                "batches": self.batches,
+                "mean_batch_sentences": round(self.batch_sentences / self.batches, 1) if self.batches else None,
+                "largest_batch_sentences": self.largest_batch,
+                "mean_latency_ms": round(self.latency_seconds / self.requests * 1000, 3) if self.requests else None,
+                "max_latency_ms": round(self.max_latency_seconds * 1000, 3),
+            }
+
+
+# Raised for requests the server stopped before synthesizing, answered with 503
+class ServerClosing(Exception):
+    pass
+
+
+# Joins the queued requests into batches and synthesizes them, in the pool if one is given
+# At most in_flight batches are synthesized at once, the requests arriving meanwhile wait for the next batch
+# Sentences without a first index are numbered by a counter of the server
+class Batcher:
+
+    def __init__(self, synthesizer, metrics, batch_size=DEFAULT_BATCH_SIZE, batch_wait=0.0, pool=None, in_flight=1):
+        self.synthesizer = synthesizer
+        self.metrics = metrics
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.pool = pool
+        self.slots = threading.BoundedSemaphore(in_flight)
+        self.jobs = queue.Queue()
+        self.index_lock = threading.Lock()
+        self.next_index = 0
+        # Batches sent to the pool and not finished yet, by their id
+        self.lock = threading.Condition()
+        self.running = {}
+        self.closing = False
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, name="batcher", daemon=True)
+        self.thread.start()
+
+    # Queue the sentences of a request, the future gets their pairs
+    def submit(self, sentences, first_index=None, epoch=0):
+        if first_index is None:
+            with self.index_lock:
+                first_index = self.next_index
+                self.next_index += len(sentences)
+        future = Future()
+        with self.lock:
+            if self.closing:
+                future.set_exception(ServerClosing("the server is stopping"))
+            else:
+                self.jobs.put(((sentences, first_index, epoch), future))
+        return future
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            self.slots.acquire()
+            job = self.jobs.get()
+            if job is None:
+                self.slots.release()
+                break
+            batch = [job]
+            size = len(job[0][0])
+            deadline = time.monotonic() + self.batch_wait
+            while size < self.batch_size:
+                try:
+                    remaining = deadline - time.monotonic()
+                    job = self.jobs.get(timeout=remaining) if remaining > 0 else self.jobs.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    stopping = True
+                    break
+                batch.append(job)
+                size += len(job[0][0])
+            self.metrics.count_batch(size)
+            self.dispatch(batch)
+
+    def dispatch(self, batch):
+        jobs = [job for job, _ in batch]
+        with self.lock:
+            if self.closed:
+                self.slots.release()
+                fail_futures(batch, ServerClosing("the server is stopping"))
+                return
+            self.running[id(batch)] = batch
+        if self.pool:
+            self.pool.apply_async(synthesize_worker_jobs, (jobs,), callback=lambda results: self.finish(batch, results),
+                                  error_callback=lambda error: self.fail(batch, error))
+            return
+        try:
+            results = synthesize_jobs(self.synthesizer, jobs)
+        except Exception as error:
+            self.fail(batch, error)
+        else:
+            self.finish(batch, results)
+
+    # The futures of a batch are only set if close has not failed them already
+    def finish(self, batch, results):
+        try:
+            if self.take_running(batch):
+                for (_, future), pairs in zip(batch, results):
+                    future.set_result(pairs)
+        finally:
+            self.slots.release()
+
+    def fail(self, batch, error):
+        try:
+            if self.take_running(batch):
+                fail_futures(batch, error)
+        finally:
+            self.slots.release()
+
+    def take_running(self, batch):
+        with self.lock:
+            found = self.running.pop(id(batch), None) is not None
+            self.lock.notify_all()
+            return found
+
+    # Stop taking requests and wait up to timeout seconds for the queued and running batches, then fail the
+    # requests left with ServerClosing so that no request waits for a pool which is terminated
+    def close(self, timeout=DRAIN_SECONDS):
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            self.closing = True
+            self.jobs.put(None)
+        self.thread.join(timeout)
+        with self.lock:
+            self.lock.wait_for(lambda: not self.running, max(deadline - time.monotonic(), 0))
+            self.closed = True
+            left = [job for batch in self.running.values() for job in batch]
+            self.running.clear()
+        while True:
+            try:
+                job = self.jobs.get_nowait()
+            except queue.Empty:
+                break
+            if job is not None:
+                left.append(job)
+        if left:
+            logger.warning("Failing %d requests left when stopping", len(left))
+        fail_futures(left, ServerClosing("the server stopped before synthesizing the request"))
+
+
+def fail_futures(batch, error):
+    for _, future in batch:
+        future.set_exception(error)
+
+
+# Validated requests of /synthesize, errors in a request raise ValueError
+class SynthesisService:
+
+    def __init__(self, batcher, metrics, info):
+        self.batcher = batcher
+        self.metrics = metrics
+        self.info = info
+
+    def health(self):
+        return {"status": "ok", **self.info}
+
+    def synthesize(self, request):
+        if not isinstance(request, dict):
+            raise ValueError("the request must be a JSON object")
+        first_index = request.get("first_index")
+        epoch = request.get("epoch", 0)
+        for name, value in (("first_index", first_index), ("epoch", epoch)):
+            if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < 0):
+                raise ValueError(f"{name} must be a non-negative integer")
+
+        documents = request.get("documents")
+        if documents is not None:
+            check_strings(documents, "documents")
+            segmented = [list(segmenter.segment_lines(document.splitlines())) for document in documents]
+            sentences = [sentence for document in segmented for sentence in document]
+        else:
+            sentences = request.get("sentences")
+            check_strings(sentences, "sentences")
+
+        pairs = self.batcher.submit(sentences, first_index, epoch).result() if sentences else []
+        if documents is None:
+            return {"pairs": pairs}
+        document_pairs = []
+        start = 0
+        for document in segmented:
+            document_pairs.append(pairs[start:start + len(document)])
+            start += len(document)
+        return {"documents": document_pairs}
+
+
+def check_strings(values, name):
+    if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+        raise ValueError(f"{name} must be a list of strings")
+
+
+class SynthesisHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.send_json(200, self.server.service.health())
+        elif self.path == "/metrics":
+            self.send_json(200, self.server.service.metrics.snapshot())
+        else:
+            self.send_json(404, {"error": f"no endpoint {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/synthesize":
+            self.send_json(404, {"error": f"no endpoint {self.path}"})
+            return
+        service = self.server.service
+        started = time.monotonic()
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            if length > MAX_REQUEST_BYTES:
+                raise ValueError(f"the request is larger than {MAX_REQUEST_BYTES} bytes")
+            request = json.loads(self.rfile.read(length).decode("utf8"))
+            response = service.synthesize(request)
+        except ValueError as error:
+            service.metrics.count_failure()
+            self.send_json(400, {"error": str(error)})
+            return
+        except ServerClosing as error:
+            service.metrics.count_failure()
+            self.send_json(503, {"error": str(error)})
+            return
+        except Exception as error:
+            logger.exception("Synthesis failed")
+            service.metrics.count_failure()
+            self.send_json(500, {"error": f"synthesis failed: {error}"})
+            return
+        pairs = response.get("pairs") or [pair for document in response.get("documents", []) for pair in document]
+        service.metrics.count_request(pairs, time.monotonic() - started)
+        self.send_json(200, response)
+
+    def send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode("utf8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.debug("%s %s", self.address_string(), format % args)
+
+    # Clients of a Unix socket have no address
+    def address_string(self):
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix socket"
+
+
+# Both servers keep as many connections waiting to be accepted as the system allows, so that many clients
+# connecting at once are queued rather than refused, as the requests they send are batched anyway
+class UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+    request_queue_size = socket.SOMAXCONN
+
+
+class TCPHTTPServer(ThreadingHTTPServer):
+    request_queue_size = socket.SOMAXCONN
+
+
+# Create the HTTP server of the service on a Unix socket or a TCP address
+# A socket file left behind by a stopped server is replaced
+def create_server(service, host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None):
+    if socket_path:
+        if os.path.exists(socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(socket_path)
+            except OSError:
+                os.unlink(socket_path)
+            else:
+                raise OSError(f"a server is already listening on {socket_path}")
+            finally:
+                probe.close()
+        server = UnixHTTPServer(socket_path, SynthesisHandler)
+    else:
+        server = TCPHTTPServer((host, port), SynthesisHandler)
+    server.service = service
+    return server
+
+
+def stop_on_signal(signum, frame):
+    raise KeyboardInterrupt
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serves punctuation error synthesis over HTTP, keeping the statistics loaded between requests")
+    parser.add_argument("--host", default=DEFAULT_HOST,
+                        help=f"address of the HTTP server, {DEFAULT_HOST} by default")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT,
+                        help=f"port of the HTTP server, {DEFAULT_PORT} by default")
+    parser.add_argument("--socket", metavar="PATH",
+                        help="serve HTTP on a Unix socket at PATH instead of a TCP port")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes synthesizing the batches, 1 synthesizes in the server process")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, metavar="N",
+                        help=f"sentences of several requests joined into a batch, {DEFAULT_BATCH_SIZE} by default")
+    parser.add_argument("--batch-wait", type=float, default=0.0, metavar="MS",
+                        help="milliseconds a batch waits for more requests, 0 by default")
+    parser.add_argument("--statistics", default=statistics_store.STATISTICS_FILE, metavar="FILE",
+                        help="statistics file made by the analyzer, statistics.bin by default")
+    parser.add_argument("--seed", type=int, metavar="N",
+                        help="seed of the errors, drawn if not given")
+    parser.add_argument("--max-errors", type=int, default=1, metavar="N",
+                        help="errors stacked into a sentence at most, 1 by default")
+    parser.add_argument("--tokenizer", choices=sorted(tokenizer.TOKENIZERS) + ["none"], default="regex",
+                        help="word tokenizer of the returned pairs, regex by default, none for untokenized sentences")
+    parser.add_argument("--nltk-data", metavar="DIR",
+                        help="local directory containing the punkt sentence tokenizer data")
+    parser.add_argument("--log-level", choices=reporting.LOG_LEVELS, default="INFO",
+                        help="level of the logged messages, DEBUG logs every request")
+    args = parser.parse_args()
+    if args.workers < 1 or args.batch_size < 1 or args.max_errors < 1:
+        parser.error("--workers, --batch-size and --max-errors must be positive")
+    if args.batch_wait < 0:
+        parser.error("--batch-wait must not be negative")
+    if args.seed is not None and args.seed < 0:
+        parser.error("--seed must be non-negative")
+    if not os.path.exists(args.statistics):
+        parser.error(f"statistics file {args.statistics} not found, generate it with analyzer.py")
+    reporting.configure_logging(args.log_level)
+
+    tokenizer_name = None if args.tokenizer == "none" else args.tokenizer
+    seed = counter_rng.random_seed() if args.seed is None else args.seed
+    logger.info("Loading statistics and tokenizers...")
+    try:
+        synthesizer = PunctuationSynthesizer(args.statistics, seed, args.max_errors, tokenizer_name)
+    except ValueError as error:
+        parser.error(str(error))
+    segmenter.load_sentence_tokenizer(args.nltk_data)
+
+    # Workers are forked before any thread of the server is started
+    pool = None
+    if args.workers > 1:
+        pool = multiprocessing.Pool(args.workers, initializer=init_worker,
+                                    initargs=(args.statistics, seed, args.max_errors, tokenizer_name, args.log_level))
+    metrics = ServerMetrics()
+    batcher = Batcher(synthesizer, metrics, args.batch_size, args.batch_wait / 1000, pool,
+                      args.workers * 2 if pool else 1)
+    service = SynthesisService(batcher, metrics, {
+        "workers": args.workers,
+        "seed": seed,
+        "max_errors": args.max_errors,
+        "tokenizer": args.tokenizer,
+        "statistics": {"path": args.statistics, "source_hash": synthesizer.statistics_hash},
+    })
+    try:
+        server = create_server(service, args.host, args.port, args.socket)
+    except OSError as error:
+        parser.error(str(error))
+
+    signal.signal(signal.SIGTERM, stop_on_signal)
+    logger.info("Serving on %s", args.socket or f"http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Stopping")
+    finally:
+        # Requests still waiting are answered before the pool is terminated
+        batcher.close()
+        if pool:
+            pool.terminate()
+            pool.join()
+        server.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.unlink(args.socket)
+    logger.info("Metrics: %s", json.dumps(metrics.snapshot()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,505 @@
+# This file is part of the EstGEC punctuation error synthesizer
+# Author: Christian-Enrique Hindremäe
+# 2024
+
+# file: statistics_store.py
+#
+# Versioned binary file of the statistics, memory mapped when loaded
+# Imported as a module in main file synthesizer.py
+# When executed separately, converts a statistics.pkl made by earlier versions or prints the header of a statistics file
+
+# Usage: python statistics_store.py SOURCE.pkl [DESTINATION.bin] [--source DIR ...]
+#        python statistics_store.py --info FILE
+# Where
+#   SOURCE.pkl - pickled statistics, only convert pickles made by yourself
+#   DESTINATION.bin - converted statistics file, statistics.bin by default
+#   --source - directories of the gold token files the statistics were made of, stored as a hash in the header
+#   --info - print the header of a statistics file
+
+# File layout:
+#   magic bytes, format version and header length as little-endian uint32 numbers
+#   JSON header - source data hash, key order of the statistics, scalar statistics, and the array layout
+#                 of the symbol table and of every table
+#   arrays - flat uint8, uint32 and float64 arrays, aligned to 8 bytes. Marks and words are stored as
+#            indexes into the symbol table
+#
+# Hash tables are open addressing tables by the crc32 of the UTF-8 text of the keys, with a power of two
+#   slots holding the index of the key plus one, or 0 for an empty slot
+#
+# Symbol table of every punctuation mark and word: text (UTF-8 of every symbol one after another),
+#   offsets into the text (one more than symbols), slots of a hash table of the symbols
+#
+# Table kinds:
+#   weights - mark to percentage: keys, values, and the alias table of the marks with a positive percentage:
+#             choices, probabilities, aliases
+#   nested - mark to a weights table: rows, offsets into the inner arrays (one more than rows), keys, values,
+#            and the alias table of every row: choice_offsets (one more than rows), choices, probabilities, aliases
+#   combinations - list of (mark, word, count): marks, words, counts, and the rows grouped by word:
+#                  group_words (word symbols), group_offsets (one more than groups), word_marks, word_counts,
+#                  and word_slots, a hash table of the groups by their word
+
+import os
+import sys
+import json
+import mmap
+import zlib
+import array
+import struct
+import pickle
+import argparse
+from datetime import datetime
+import sampler
+
+MAGIC = b"ESTPUNCT"
+FORMAT_VERSION = 3
+STATISTICS_FILE = "statistics.bin"
+
+PREFIX = struct.Struct("<8sII")
+ALIGNMENT = 8
+
+# Array types: symbol text, symbol indexes and counts, and percentages
+TEXT_TYPE = "B"
+INDEX_TYPE = "I"
+VALUE_TYPE = "d"
+
+
+def align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+# Kind of a table of the statistics, by the type of its values
+def table_kind(value):
+    if isinstance(value, (int, float)):
+        return "scalar"
+    if isinstance(value, list):
+        return "combinations"
+    if isinstance(value, dict):
+        first = next(iter(value.values()), 0.0)
+        if isinstance(first, dict):
+            return "nested"
+        return "weights"
+    raise ValueError(f"Statistics value of type {type(value).__name__} can't be stored")
+
+
+# Alias table of the marks with a positive weight, the table sampler.build_sampler makes of them
+def alias_arrays(keys, values):
+    positive = [(key, value) for key, value in zip(keys, values) if value > 0]
+    choices = array.array(INDEX_TYPE, (key for key, _ in positive))
+    probabilities = array.array(VALUE_TYPE)
+    aliases = array.array(INDEX_TYPE)
+    if positive:
+        column_probabilities, column_aliases = sampler.alias_table([value for _, value in positive])
+        probabilities.extend(column_probabilities)
+        aliases.extend(column_aliases)
+    return choices, probabilities, aliases
+
+
+# Split a table into flat arrays, symbols are interned into the shared symbol table
+def table_arrays(kind, table, intern):
+    if kind == "weights":
+        keys = array.array(INDEX_TYPE, map(intern, table))
+        values = array.array(VALUE_TYPE, table.values())
+        choices, probabilities, aliases = alias_arrays(keys, values)
+        return {"keys": keys, "values": values,
+                "choices": choices, "probabilities": probabilities, "aliases": aliases}
+    if kind == "nested":
+        offsets = array.array(INDEX_TYPE, [0])
+        keys = array.array(INDEX_TYPE)
+        values = array.array(VALUE_TYPE)
+        choice_offsets = array.array(INDEX_TYPE, [0])
+        choices = array.array(INDEX_TYPE)
+        probabilities = array.array(VALUE_TYPE)
+        aliases = array.array(INDEX_TYPE)
+        for row in table.values():
+            row_keys = array.array(INDEX_TYPE, map(intern, row))
+            row_values = array.array(VALUE_TYPE, row.values())
+            keys.extend(row_keys)
+            values.extend(row_values)
+            offsets.append(len(keys))
+            row_choices, row_probabilities, row_aliases = alias_arrays(row_keys, row_values)
+            choices.extend(row_choices)
+            probabilities.extend(row_probabilities)
+            aliases.extend(row_aliases)
+            choice_offsets.append(len(choices))
+        return {"rows": array.array(INDEX_TYPE, map(intern, table)),
+                "offsets": offsets, "keys": keys, "values": values, "choice_offsets": choice_offsets,
+                "choices": choices, "probabilities": probabilities, "aliases": aliases}
+
+    marks = array.array(INDEX_TYPE, (intern(mark) for mark, _, _ in table))
+    words = array.array(INDEX_TYPE, (intern(word) for _, word, _ in table))
+    counts = array.array(INDEX_TYPE, (count for _, _, count in table))
+    # Groups of the rows of every word, in the order of the word symbols, and the rows of a word in their
+    # order in the table, so the marks of a word stay in the order of their counts
+    by_word = sorted(range(len(table)), key=lambda row: words[row])
+    group_words = array.array(INDEX_TYPE)
+    group_offsets = array.array(INDEX_TYPE, [0])
+    group_texts = []
+    for position, row in enumerate(by_word):
+        if group_words and group_words[-1] == words[row]:
+            group_offsets[-1] = position + 1
+        else:
+            group_words.append(words[row])
+            group_offsets.append(position + 1)
+            group_texts.append(table[row][1])
+    return {"marks": marks, "words": words, "counts": counts,
+            "group_words": group_words, "group_offsets": group_offsets,
+            "word_marks": array.array(INDEX_TYPE, (marks[row] for row in by_word)),
+            "word_counts": array.array(INDEX_TYPE, (counts[row] for row in by_word)),
+            "word_slots": hash_slots(group_texts)}
+
+
+# Slots of a hash table of the given texts, at least four times as many as texts, so most lookups of
+# a missing text end at an empty slot
+def hash_slots(texts):
+    size = 1
+    while size < 4 * len(texts):
+        size *= 2
+    slots = array.array(INDEX_TYPE, [0] * size)
+    for index, text in enumerate(texts):
+        slot = zlib.crc32(text.encode("utf8")) & (size - 1)
+        while slots[slot]:
+            slot = (slot + 1) & (size - 1)
+        slots[slot] = index + 1
+    return slots
+
+
+# Arrays of the symbol table
+def symbol_arrays(symbols):
+    text = array.array(TEXT_TYPE)
+    offsets = array.array(INDEX_TYPE, [0])
+    for symbol in symbols:
+        text.frombytes(symbol.encode("utf8"))
+        offsets.append(len(text))
+    return {"text": text, "offsets": offsets, "slots": hash_slots(symbols)}
+
+
+# Write the statistics made by analyzer.generate_statistics into a statistics file
+# The file is written next to the destination and renamed over it, so readers never see a partial file
+def write_statistics(statistics, path=STATISTICS_FILE, source_hash=""):
+    symbols = []
+    symbol_indexes = {}
+
+    def intern(symbol):
+        if symbol not in symbol_indexes:
+            symbol_indexes[symbol] = len(symbols)
+            symbols.append(symbol)
+        return symbol_indexes[symbol]
+
+    scalars = {}
+    tables = {}
+    table_data = []
+    for name, value in statistics.items():
+        kind = table_kind(value)
+        if kind == "scalar":
+            scalars[name] = value
+            continue
+        tables[name] = {"kind": kind, "arrays": {}}
+        for array_name, values in table_arrays(kind, value, intern).items():
+            table_data.append((tables[name]["arrays"], array_name, values))
+
+    symbol_table = {"count": len(symbols), "arrays": {}}
+    for array_name, values in symbol_arrays(symbols).items():
+        table_data.append((symbol_table["arrays"], array_name, values))
+
+    # Offsets are relative to the start of the arrays, which follows the header
+    offset = 0
+    for layout, array_name, values in table_data:
+        layout[array_name] = {"type": values.typecode, "offset": offset, "length": len(values)}
+        offset = align(offset + len(values) * values.itemsize)
+
+    header = json.dumps({
+        "source_hash": source_hash,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "byteorder": sys.byteorder,
+        "order": list(statistics),
+        "symbols": symbol_table,
+        "scalars": scalars,
+        "tables": tables,
+    }, ensure_ascii=False).encode("utf8")
+    data_start = align(PREFIX.size + len(header))
+
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "wb") as f:
+        f.write(PREFIX.pack(MAGIC, FORMAT_VERSION, len(header)))
+        f.write(header)
+        f.write(b"\0" * (data_start - PREFIX.size - len(header)))
+        for layout, array_name, values in table_data:
+            f.write(values.tobytes())
+            f.write(b"\0" * (align(f.tell() - data_start) - (f.tell() - data_start)))
+    os.replace(temporary_path, path)
+
+
+# Statistics file mapped into memory
+# The arrays are views of the mapped file, so every process loading the same file shares one copy of
+# them through the page cache. The samplers and the combination lookups of the synthesizer read the
+# alias tables and indexes stored in the file, tables are turned into dictionaries only on request
+class StatisticsStore:
+
+    def __init__(self, path=STATISTICS_FILE):
+        self.path = path
+        with open(path, "rb") as f:
+            self.mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.mapping) < PREFIX.size:
+            raise ValueError(f"{path} is not a statistics file")
+        magic, version, header_length = PREFIX.unpack_from(self.mapping)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a statistics file")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"{path} has statistics format version {version}, "
+                             f"this version of the synthesizer reads version {FORMAT_VERSION}")
+
+        self.header = json.loads(bytes(self.mapping[PREFIX.size:PREFIX.size + header_length]).decode("utf8"))
+        self.data_start = align(PREFIX.size + header_length)
+        self.scalars = self.header["scalars"]
+        self.tables = self.header["tables"]
+        self.source_hash = self.header["source_hash"]
+        self.view = memoryview(self.mapping)
+
+        symbol_layout = self.header["symbols"]["arrays"]
+        self.symbol_count = self.header["symbols"]["count"]
+        # Symbol text is read as bytes from the mapping, which needs no conversion of byte order
+        self.symbol_text_start = self.data_start + symbol_layout["text"]["offset"]
+        self.symbol_offsets = self.read_array(symbol_layout["offsets"])
+        self.symbol_slots = self.read_array(symbol_layout["slots"])
+
+    # Flat array at a layout of the header, a view of the mapped file unless the file was written
+    # with another byte order
+    def read_array(self, layout):
+        start = self.data_start + layout["offset"]
+        end = start + layout["length"] * array.array(layout["type"]).itemsize
+        if self.header["byteorder"] == sys.byteorder:
+            return self.view[start:end].cast(layout["type"])
+        values = array.array(layout["type"])
+        values.frombytes(self.view[start:end])
+        values.byteswap()
+        return values
+
+    # Flat array of a table
+    def array(self, table_name, array_name):
+        return self.read_array(self.tables[table_name]["arrays"][array_name])
+
+    # UTF-8 text of a symbol
+    def symbol_bytes(self, index):
+        start = self.symbol_text_start
+        return self.mapping[start + self.symbol_offsets[index]:start + self.symbol_offsets[index + 1]]
+
+    # Text of a symbol
+    def symbol(self, index):
+        return self.symbol_bytes(index).decode("utf8")
+
+    def symbols_of(self, indexes):
+        return [self.symbol(index) for index in indexes]
+
+    # Look up the UTF-8 text in a hash table of the file, whose keys are the symbols at the given indexes,
+    # or every symbol if no indexes are given. Returns the index of the key, or None
+    def probe(self, slots, encoded, symbols=None):
+        mask = len(slots) - 1
+        slot = zlib.crc32(encoded) & mask
+        while slots[slot]:
+            index = slots[slot] - 1
+            symbol = index if symbols is None else symbols[index]
+            if self.symbol_bytes(symbol) == encoded:
+                return index
+            slot = (slot + 1) & mask
+        return None
+
+    # Index of the symbol with the given text, or None
+    def symbol_index(self, text):
+        return self.probe(self.symbol_slots, text.encode("utf8"))
+
+    # Views of the tables read by the synthesizer
+    def weights(self, name):
+        return WeightsView(self, self.array(name, "keys"), self.array(name, "values"), self.array(name, "choices"),
+                           self.array(name, "probabilities"), self.array(name, "aliases"))
+
+    def nested(self, name):
+        return NestedView(self, name)
+
+    def combinations(self, name):
+        return CombinationsView(self, name)
+
+    # Table in the form made by analyzer.generate_statistics
+    def table(self, name):
+        if name in self.scalars:
+            return self.scalars[name]
+        kind = self.tables[name]["kind"]
+        if kind == "weights":
+            return dict(zip(self.symbols_of(self.array(name, "keys")), self.array(name, "values")))
+        if kind == "nested":
+            offsets = self.array(name, "offsets")
+            keys = self.symbols_of(self.array(name, "keys"))
+            values = self.array(name, "values")
+            return {row: dict(zip(keys[offsets[i]:offsets[i + 1]], values[offsets[i]:offsets[i + 1]]))
+                    for i, row in enumerate(self.symbols_of(self.array(name, "rows")))}
+        return list(zip(self.symbols_of(self.array(name, "marks")),
+                        self.symbols_of(self.array(name, "words")),
+                        self.array(name, "counts")))
+
+    # Every statistic, in the key order of the original statistics
+    def to_dict(self):
+        return {name: self.table(name) for name in self.header["order"]}
+
+    # Samplers of punctuation marks reading the alias tables of the file
+    def samplers(self):
+        return sampler.PunctuationSamplers(self)
+
+
+# Weights table of a statistics file, or a row of a nested table
+# The arrays are views of the file, only the marks of the table are decoded
+class WeightsView:
+
+    def __init__(self, store, keys, values, choices, probabilities, aliases):
+        self.store = store
+        self.keys = keys
+        self.values = values
+        self.choices = choices
+        self.probabilities = probabilities
+        self.aliases = aliases
+        self.marks = frozenset(store.symbols_of(keys))
+
+    def items(self):
+        return zip(self.store.symbols_of(self.keys), self.values)
+
+    def get(self, mark, default=None):
+        for key, value in self.items():
+            if key == mark:
+                return value
+        return default
+
+    # Sampler of the marks in the given set, the alias table of the file if the set holds every mark
+    # with a positive weight, otherwise one built for the subset. None if nothing can be drawn
+    def sampler(self, marks):
+        choices = self.store.symbols_of(self.choices)
+        if marks.issuperset(choices):
+            return sampler.AliasSampler(choices, self.probabilities, self.aliases) if choices else None
+        return sampler.build_sampler({mark: value for mark, value in self.items() if mark in marks})
+
+
+# Nested table of a statistics file, rows are looked up by their mark
+class NestedView:
+
+    def __init__(self, store, name):
+        self.store = store
+        self.rows = store.array(name, "rows")
+        self.offsets = store.array(name, "offsets")
+        self.keys = store.array(name, "keys")
+        self.values = store.array(name, "values")
+        self.choice_offsets = store.array(name, "choice_offsets")
+        self.choices = store.array(name, "choices")
+        self.probabilities = store.array(name, "probabilities")
+        self.aliases = store.array(name, "aliases")
+        # Every mark of the inner tables
+        self.inner_marks = frozenset(store.symbols_of(self.keys))
+
+    # Row of a mark as a weights table, empty if the mark has no row
+    def row(self, mark):
+        symbol = self.store.symbol_index(mark)
+        for position, row_symbol in enumerate(self.rows):
+            if row_symbol == symbol:
+                start, end = self.offsets[position], self.offsets[position + 1]
+                choices_start, choices_end = self.choice_offsets[position], self.choice_offsets[position + 1]
+                return WeightsView(self.store, self.keys[start:end], self.values[start:end],
+                                   self.choices[choices_start:choices_end],
+                                   self.probabilities[choices_start:choices_end],
+                                   self.aliases[choices_start:choices_end])
+        return WeightsView(self.store, self.keys[0:0], self.values[0:0], self.choices[0:0],
+                           self.probabilities[0:0], self.aliases[0:0])
+
+
+# Combinations of a statistics file, looked up by the following word in the hash table of its groups of rows
+class CombinationsView:
+
+    def __init__(self, store, name):
+        self.store = store
+        self.length = len(store.array(name, "counts"))
+        self.group_words = store.array(name, "group_words")
+        self.group_offsets = store.array(name, "group_offsets")
+        self.word_marks = store.array(name, "word_marks")
+        self.word_counts = store.array(name, "word_counts")
+        self.word_slots = store.array(name, "word_slots")
+        self.slot_mask = len(self.word_slots) - 1
+        # Text of the marks decoded so far, there are only as many as punctuation marks
+        self.mark_texts = {}
+
+    def __len__(self):
+        return self.length
+
+    # Range of the rows of a word, empty if the word is not combined with any mark
+    # Most words of a sentence are not, which an empty slot of the hash table tells without probing further
+    def word_rows(self, word):
+        encoded = word.encode("utf8")
+        if not self.word_slots[zlib.crc32(encoded) & self.slot_mask]:
+            return ()
+        group = self.store.probe(self.word_slots, encoded, self.group_words)
+        if group is None:
+            return ()
+        return range(self.group_offsets[group], self.group_offsets[group + 1])
+
+    def mark(self, row):
+        symbol = self.word_marks[row]
+        if symbol not in self.mark_texts:
+            self.mark_texts[symbol] = self.store.symbol(symbol)
+        return self.mark_texts[symbol]
+
+    # Marks seen before a word, the most frequent first
+    def marks(self, word):
+        return [self.mark(row) for row in self.word_rows(word)]
+
+    # Count of a mark before a word, or None if the pair is not among the combinations
+    def count(self, mark, word):
+        for row in self.word_rows(word):
+            if self.mark(row) == mark:
+                return self.word_counts[row]
+        return None
+
+
+# Load a statistics file, raising ValueError if it is not a statistics file of a readable version
+def load_statistics(path=STATISTICS_FILE):
+    return StatisticsStore(path)
+
+
+# Convert pickled statistics into a statistics file
+# Earlier versions kept a single unnecessary character per following word, without its count,
+# these become combinations with a count of one
+def convert_pickle(source_path, destination_path=STATISTICS_FILE, source_hash=""):
+    with open(source_path, "rb") as fp:
+        statistics = pickle.load(fp)
+    if isinstance(statistics.get("unnecessaryCombinations"), dict):
+        statistics["unnecessaryCombinations"] = [
+            (mark, word, 1) for word, mark in statistics["unnecessaryCombinations"].items()]
+    write_statistics(statistics, destination_path, source_hash)
+    return statistics
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Converts pickled statistics into a statistics file, or prints the header of one")
+    parser.add_argument("source", metavar="SOURCE", help="pickled statistics, or a statistics file with --info")
+    parser.add_argument("destination", metavar="DESTINATION", nargs="?", default=STATISTICS_FILE,
+                        help="converted statistics file, statistics.bin by default")
+    parser.add_argument("--source", dest="source_dirs", nargs="+", metavar="DIR",
+                        help="directories of the gold token files the statistics were made of")
+    parser.add_argument("--info", action="store_true", help="print the header of a statistics file")
+    args = parser.parse_args()
+
+    if args.info:
+        try:
+            store = load_statistics(args.source)
+        except ValueError as error:
+            parser.error(str(error))
+        header = dict(store.header, symbols=store.symbol_count)
+        print(json.dumps(header, ensure_ascii=False, indent=2))
+        return
+
+    source_hash = ""
+    if args.source_dirs:
+        import analyzer
+        source_hash = analyzer.hash_sources(analyzer.collect_paths(args.source_dirs))
+    statistics = convert_pickle(args.source, args.destination, source_hash)
+    if load_statistics(args.destination).to_dict() != statistics:
+        raise SystemExit(f"Converted statistics in {args.destination} differ from {args.source}")
+    print(f"Converted {args.source} to {args.destination}")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,203 +6,584 @@
 # 
 # Synthesizes errors into correct source sentences using generated statistics
 
-# Usage: python synthesizer.py source_file
+# Usage: python synthesizer.py source_file [--workers N] [--chunk-size N] [--split-ratios TRAIN VALID TEST] [--no-all]
+#                               [--output-dir DIR] [--shard-lines N] [--shard-bytes N]
+#                               [--dedup] [--dedup-memory MB] [--variants K] [--max-errors N]
+#                               [--seed N] [--checkpoint-interval N] [--resume] [--pipeline]
+#                               [--compress gz|xz|bz2|zst] [--compress-level LEVEL] [--tokenizer nltk|regex]
+#                               [--statistics FILE] [--analyze] [--nltk-data DIR]
+#                               [--log-level LEVEL] [--progress-interval SECONDS] [--metrics-file FILE]
+#                               [--profile [PREFIX]]
 # Where
-#   source_file - source text file used for synthesizing errors into
+#   source_file - source text file used for synthesizing errors into, - for standard input. Sources compressed
+#                 with gzip, xz, bzip2 or zstd are decompressed while reading
+#   --workers - number of processes analyzing files and synthesizing errors in parallel, 1 by default
+#   --chunk-size - number of sentences in a shard given to a worker, or decided at once in a serial run
+#   --split-ratios - shares of the train, valid and test sets, 0.8 0.1 0.1 by default
+#   --no-all - skip the joint parallel corpora files
+#   --output-dir - directory of the output files and manifest.json, the current directory by default
+#   --shard-lines - write every data set into shards of N sentence pairs, e.g. train.00000.correct
+#   --shard-bytes - start a new shard once a shard holds N bytes of uncompressed text, alone or with --shard-lines
+#   --dedup - drop source sentences repeating an earlier sentence, ignoring case and whitespace, before synthesis
+#   --dedup-memory - memory limit of the table of sentence hashes in megabytes, 512 by default
+#   --variants - number of incorrect variants drawn for every sentence, variants equal to an earlier one are dropped
+#   --max-errors - errors stacked into a variant at most, every further error is added with the error probability
+#   --seed - seed of the random decisions, drawn and recorded in the manifest if not given. Every sentence draws
+#            from streams of the seed and its index, so the same seed gives the same output with any number of
+#            workers and chunk size
+#   --checkpoint-interval - sentences between checkpoints of the run in checkpoint.json, 100000 by default, 0 for none
+#   --resume - continue a stopped run from its checkpoint in the output directory, with the same arguments
+#   --pipeline - read the source, synthesize the errors and write the output in threads of their own at the same time
+#   --compress - compress the output files with gz, xz, bz2 or zst, the names of the files get the extension
+#   --compress-level - level of the output compression, the default of the compression if not given
+#   --tokenizer - word tokenizer of the output sentences, nltk by default or the faster compiled regex
+#   --statistics - statistics file made by the analyzer, statistics.bin by default
+#   --analyze - generate the statistics from ./source_test again and save them before synthesis
+#   --nltk-data - local directory containing the punkt sentence tokenizer data, nothing is downloaded
+#   --log-level - DEBUG, INFO, WARNING or ERROR, INFO by default. DEBUG logs the decisions made for every sentence
+#   --progress-interval - seconds between progress reports, 10 by default
+#   --metrics-file - JSON file for the summary of the run: sentences, errors by type, skipped sentences and stage times
+#   --profile - profile the run with cProfile into PREFIX.prof and PREFIX.worker-PID.prof files, synthesizer by default,
+#               and time every stage of the synthesis, the timers are added to the summary of the run
 
 # Output:
 #   joint parallel corpora files "all_correct" and "all_incorrect"
-#   three data sets - train, valid, test; divided by ratio 8:1:1
+#   three data sets - train, valid, test; divided by ratio 8:1:1 by default while the pairs are produced
+#   manifest.json - the files with their line counts and checksums, and the statistics used. Rewritten as
+#                   each shard is finished, shards listed in it can be read while synthesis is running
 
-import sys
-from nltk import sent_tokenize
-from nltk import word_tokenize
-from datetime import datetime
+import os
+import random
+import logging
+import argparse
+import itertools
+import multiprocessing
+from collections import deque
 import analyzer
 import error_generator
-import pickle
-import string
-import nltk
-import math
-nltk.download('punkt')
-
-# Call analyzer to generate and provide statistics, and save it in binary using pickle
-def receive_statistics():
-    statistics = analyzer.generate_statistics()
-
-    with open("statistics.pkl", "wb") as fp:
-        pickle.dump(statistics, fp)
-
-# Retrieve statistics from the binary file
-def import_percentages_data():
-    with open("statistics.pkl", "rb") as fp:
-        statistics = pickle.load(fp)
-    return statistics
-
-# Tokenize the source text using nltk
-def process_source_text(file_path):
-    group = []  # Group of sentences
-
-    with open(file_path, "r", encoding="utf8") as file:
-        # As the necessary format for Fairseq is having one sentence per line, script defines a buffer 
-        # to prevent splitting a sentence across multiple lines
-        sentence_buffer = ""
-        for line in file:
-            sentence_buffer += (" " + line)
-            buffer_sentences = sent_tokenize(sentence_buffer)
-
-            if len(buffer_sentences) > 1:
-                for sentence in buffer_sentences[:-1]:
-                    group.append(sentence.strip())
-                sentence_buffer = buffer_sentences[-1]
-        return group
-
-# Write correct and incorrect sentences in corresponding files
-def output_set(file, incorrect_file, sentence, incorrect_sentence):
-    tokenized_sentence = ' '.join(word_tokenize(sentence))
-    tokenized_incorrect_sentence = ' '.join(word_tokenize(incorrect_sentence))
-    file.write(f"{tokenized_sentence}\n")
-    incorrect_file.write(f"{tokenized_incorrect_sentence}\n")
-    
-def split_set(filename):
-    with open(filename, "r", encoding="utf8") as file:
-        sentences = [line.strip() for line in file]
-    
-    max_sentences = len(sentences)
-    max_train_set = math.floor(max_sentences * 0.8)
-    max_test_set = math.floor(max_sentences * 0.1) + max_train_set
-
-    with open("train_" + filename, "w", encoding="utf8") as train_file, \
-        open("valid_" + filename, "w", encoding="utf8") as valid_file, \
-        open("test_" + filename, "w", encoding="utf8") as test_file:
-
-        for i in range(max_sentences):
-            if i < max_train_set:
-                output_file = train_file
-            elif i < max_test_set:
-                output_file = test_file
-            else:
-                output_file = valid_file
-
-            output_file.write(sentences[i] + "\n")
-            
-    train_file.close()
-    valid_file.close()
-    test_file.close()
+import counter_rng
+import segmenter
+import writers
+import checkpoint
+import dedup
+import corpus_io
+import tokenizer
+import statistics_store
+import reporting
+import instrumentation
+import pipeline
 
-def main():
-    if len(sys.argv) != 2:
-        print_usage()
-        sys.exit(-1)
-    
-    print(f"{datetime.now()}    Retrieving statistics...")
-    receive_statistics()
-    statistics = import_percentages_data()
-
-    # Map statistics to variables
-    punctuation_error = round(float(statistics["totalPunctErrors"]), 2)
-    u_error = round(float(statistics["unnecessaryErrors"]), 2)
-    m_error = round(float(statistics["missingErrors"]), 2)
-    r_error = round(float(statistics["replacementErrors"]), 2)
-    m_punctuation = statistics["missingPunctuation"]
-    u_punctuation = statistics["unnecessaryPunctuation"]
-    r_punctuation = statistics["replacementPunctuation"]
-    r_punctuation_end = statistics["replacementEndPunctuation"]
-    r_punctuation_middle = statistics["replacementMiddlePunctuation"]
-    r_punctuation_total_fixes = statistics["fixesTotalPunctuation"]
-    r_punctuation_end_fixes = statistics["fixesEndPunctuation"]
-    r_punctuation_middle_fixes = statistics["fixesMiddlePunctuation"]
-    r_punctuation_total_fix_percentages = statistics["totalFixPercentages"]
-    r_punctuation_middle_fix_percentages = statistics["middleFixPercentages"]
-    r_punctuation_end_fix_percentages = statistics["endFixPercentages"]
-    u_combinations = statistics["unnecessaryCombinations"]
-    m_combinations = statistics["missingCombinations"]
-    
-    print(m_combinations)
-
-    # In case of replacing full stop at the end of the sentence, this variable indicates that next sentence should start lowercase
+logger = logging.getLogger("synthesizer")
+
+# Statistics file used when none is given
+STATISTICS_FILE = statistics_store.STATISTICS_FILE
+
+# Call analyzer to generate and provide statistics, and save it in the binary statistics file
+# together with the hash of the annotated files they were generated from
+def receive_statistics(workers=1, statistics_path=STATISTICS_FILE):
+    statistics = analyzer.generate_statistics(workers=workers, cache_dir=analyzer.CACHE_DIR)
+    source_hash = analyzer.hash_sources(analyzer.collect_paths())
+    statistics_store.write_statistics(statistics, statistics_path, source_hash)
+
+# Retrieve statistics from the binary file, the tables stay in the mapped file
+def import_percentages_data(statistics_path=STATISTICS_FILE):
+    return statistics_store.load_statistics(statistics_path)
+
+# Segment the source text into sentences using nltk, yielding them one at a time
+def process_source_text(file):
+    yield from segmenter.segment_lines(file)
+
+# Group the sentences into shards of a fixed size
+def chunk_sentences(sentences, chunk_size):
+    chunk = []
+    for sentence in sentences:
+        chunk.append(sentence)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+# Word tokenizer of the output sentences, chosen with --tokenizer
+tokenize = tokenizer.nltk_tokenize
+
+# Map a loaded statistics file to the values used during synthesis
+# Samplers and combinations read the arrays of the mapped file
+def map_statistics(store):
+    return {
+        "punctuation_error": round(float(store.table("totalPunctErrors")), 2),
+        "u_error": round(float(store.table("unnecessaryErrors")), 2),
+        "m_error": round(float(store.table("missingErrors")), 2),
+        "r_error": round(float(store.table("replacementErrors")), 2),
+        "samplers": store.samplers(),
+        "u_combinations": store.combinations("unnecessaryCombinations"),
+        "m_combinations": store.combinations("missingCombinations")
+    }
+
+# Place an error of the type picked by the draw into a parsed sentence
+# u_candidates are the positions of unnecessary punctuation found with find_unnecessary_candidates
+# Returns the sentence with the error or None if it could not be placed, the type of the error, and
+# whether the next sentence should start lowercase because the full stop at the end was replaced
+def place_error(parsed, u_candidates, stats, type_draw, rng=random):
+    connect_next_sentence = False
+    started = instrumentation.start()
+    error_type = error_generator.determine_error_type_from_draw(
+        type_draw, stats["u_error"], stats["m_error"], stats["r_error"], len(u_candidates) > 0)
+
+    match error_type:
+        case "u":
+            character = error_generator.determine_unnecessary_character(
+                stats["samplers"], [candidate[2] for candidate in u_candidates], rng)
+            if character == None:
+                instrumentation.lap("sampling", started)
+                return None, error_type, connect_next_sentence
+            word_index = error_generator.determine_unnecessary_position(u_candidates, character, rng)
+            started = instrumentation.lap("sampling", started)
+            error_sentence = error_generator.generate_u_error(
+                parsed, character, word_index)
+        case "m":
+            character, word, position = error_generator.determine_missing_character(
+                parsed, stats["samplers"], stats["m_combinations"], rng)
+            started = instrumentation.lap("sampling", started)
+            if character == None:
+                return None, error_type, connect_next_sentence
+            error_sentence = error_generator.generate_m_error(
+                parsed, position)
+        case "r":
+            correct_character, wrong_character, position = error_generator.determine_replacement_character(
+                stats["samplers"], parsed.punctuations, rng)
+            started = instrumentation.lap("sampling", started)
+            if wrong_character == None:
+                return None, error_type, connect_next_sentence
+            error_sentence = error_generator.generate_r_error(
+                parsed, correct_character, wrong_character, position, rng)
+            if error_sentence is not None and (position == "end" and wrong_character == "," or wrong_character == ":"):
+                connect_next_sentence = True
+    instrumentation.stop("generation", started)
+    return error_sentence, error_type, connect_next_sentence
+
+# Place the error picked by the draw and, up to max_errors, further errors into the sentence
+# Every further error is added with the error probability of the statistics and placed into the
+# sentence with the errors before it. Returns the sentence with the errors or None, the types of the
+# placed errors, e.g. "mr", and whether the next sentence should start lowercase
+# Marks, positions and further errors are drawn from rng, the stream of the variant in a run
+def place_errors(parsed, u_candidates, stats, type_draw, max_errors=1, rng=random):
+    error_sentence, error_types, connect_next_sentence = place_error(parsed, u_candidates, stats, type_draw, rng)
+    if error_sentence is None:
+        return None, error_types, connect_next_sentence
+
+    while len(error_types) < max_errors and rng.random() * 100 < stats["punctuation_error"]:
+        stacked = error_generator.parse_sentence(error_sentence)
+        stacked_candidates = error_generator.find_unnecessary_candidates(stacked, stats["u_combinations"])
+        stacked_sentence, error_type, connect = place_error(stacked, stacked_candidates, stats, rng.random(), rng)
+        if stacked_sentence is None:
+            break
+        error_sentence = stacked_sentence
+        error_types += error_type
+        connect_next_sentence = connect_next_sentence or connect
+
+    # A later error can undo an earlier one
+    if len(error_types) > 1 and error_sentence == parsed.text:
+        return None, error_types, False
+    return error_sentence, error_types, connect_next_sentence
+
+# Synthesize errors into a single sentence, using the decisions drawn for each of its variants by
+# determine_batch_errors. The sentence is parsed, searched for candidates and tokenized once for all
+# of its variants, and variants equal to an earlier variant of the sentence are dropped
+# address is the (run seed, index of the sentence in the source) pair giving the streams of the variants,
+# so a sentence synthesized again gets the same errors
+# Returns an (error types, tokenized pair) tuple for every variant an error was drawn for, where the pair
+# is None if the error could not be placed, the number of dropped duplicates, and whether the next
+# sentence should start lowercase because the first variant replaced the full stop at the end
+# Sentences without an error return before any string processing
+def synthesize_sentence(sentence, connect_previous_sentence, stats, introduce_errors, type_draws, address,
+                        max_errors=1):
     connect_next_sentence = False
+    if not any(introduce_errors):
+        return [], 0, connect_next_sentence
+    if connect_previous_sentence:
+        sentence = sentence[0].lower() + sentence[1:]
+
+    started = instrumentation.start()
+    parsed = error_generator.parse_sentence(sentence)
+    # Determine if the sentence contains words that are common for U_ERROR
+    u_candidates = error_generator.find_unnecessary_candidates(parsed, stats["u_combinations"])
+    instrumentation.stop("candidates", started)
+
+    variants = []
+    duplicates = 0
+    error_sentences = set()
+    tokens = None
+    for variant, (introduce_error, type_draw) in enumerate(zip(introduce_errors, type_draws)):
+        if not introduce_error:
+            continue
+        rng = counter_rng.StreamRandom(*address, counter_rng.VARIANT_STREAM + variant)
+        error_sentence, error_types, connect = place_errors(parsed, u_candidates, stats, type_draw, max_errors, rng)
+        if variant == 0:
+            connect_next_sentence = connect
+        if error_sentence is None:
+            variants.append((error_types, None))
+            continue
+        if error_sentence in error_sentences:
+            duplicates += 1
+            continue
+        error_sentences.add(error_sentence)
+
+        started = instrumentation.start()
+        if tokens is None:
+            tokens = tokenize(sentence)
+        tokenized_pair = tokenizer.tokenize_pair(sentence, error_sentence, tokenize, tokens)
+        instrumentation.stop("tokenization", started)
+        variants.append((error_types, tokenized_pair))
+    return variants, duplicates, connect_next_sentence
+
+# Statistics, run seed and variants of a worker process, set once when the worker starts
+worker_stats = None
+worker_seed = None
+worker_variants = (1, 1)
+
+
+def init_worker(tokenizer_name, statistics_path, log_level, profile_prefix=None, seed=None, variants=1,
+                max_errors=1):
+    global worker_stats, worker_seed, worker_variants, tokenize
+    reporting.configure_logging(log_level)
+    if profile_prefix:
+        instrumentation.enable()
+        instrumentation.profile_worker(profile_prefix)
+    worker_stats = map_statistics(import_percentages_data(statistics_path))
+    worker_seed = seed
+    worker_variants = (variants, max_errors)
+    tokenize = tokenizer.get_tokenizer(tokenizer_name)
+
+# Synthesize errors into a block of sentences starting at an index of the source, drawing the decisions
+# of the whole block at once. Every sentence draws from streams given by the run seed and its index, so
+# its errors do not depend on the block it is in, and a single sentence can be synthesized again alone
+# Returns the decisions and the result of every sentence
+def synthesize_block(sentences, connect_next_sentence, stats, seed, first_sentence, variants=1, max_errors=1):
+    started = instrumentation.start()
+    introduce_errors, type_draws = error_generator.determine_batch_errors(
+        stats["punctuation_error"], seed, first_sentence, len(sentences), variants)
+    instrumentation.stop("sampling", started)
+    results = []
+    for index, sentence in enumerate(sentences):
+        decisions = (introduce_errors[index * variants:(index + 1) * variants],
+                     type_draws[index * variants:(index + 1) * variants],
+                     (seed, first_sentence + index))
+        sentence_variants, duplicates, connect_next_sentence = synthesize_sentence(
+            sentence, connect_next_sentence, stats, *decisions, max_errors)
+        results.append((sentence, decisions, sentence_variants, duplicates, connect_next_sentence))
+    return results
+
+# Synthesize errors into a chunk of sentences
+# Every chunk starts as if the previous sentence did not ask for lowercasing, the result of each
+# sentence is kept so the start of the chunk can be corrected by merge_chunk if it did
+def synthesize_chunk_results(sentences, stats, seed, first_sentence, variants=1, max_errors=1):
+    return synthesize_block(sentences, False, stats, seed, first_sentence, variants, max_errors)
+
+# Synthesize errors into a chunk of sentences in a worker process
+# The stage timers of the worker are sent back with the results
+def synthesize_chunk(first_sentence, sentences):
+    return (synthesize_chunk_results(sentences, worker_stats, worker_seed, first_sentence, *worker_variants),
+            instrumentation.collect())
+
+# Results of a chunk from a worker, its stage timers are added to those of the main process
+def receive_chunk(async_result):
+    results, timings = async_result.get()
+    instrumentation.merge(timings)
+    return results
+
+# Chunks of sentences with the index of their first sentence in the source, counted from first_sentence
+def numbered_chunks(sentences, chunk_size, first_sentence):
+    for chunk in chunk_sentences(sentences, chunk_size):
+        yield first_sentence, chunk
+        first_sentence += len(chunk)
+
+# Synthesize chunks of sentences in the main process
+# Yields the (variants, duplicates) results of the sentences of every chunk and the lowercasing state after it
+# first_sentence is the index of the first of the sentences in the source, a seed is drawn if none is given
+def synthesize_serial(sentences, stats, chunk_size, seed=None, first_sentence=0, connect_next_sentence=False,
+                      variants=1, max_errors=1):
+    if seed is None:
+        seed = counter_rng.random_seed()
+    for first, chunk in numbered_chunks(sentences, chunk_size, first_sentence):
+        results = synthesize_chunk_results(chunk, stats, seed, first, variants, max_errors)
+        results, connect_next_sentence = merge_chunk(results, connect_next_sentence, stats, max_errors)
+        yield results, connect_next_sentence
+
+# Synthesize chunks of sentences in worker processes, yielding the results in source order as
+# synthesize_serial does. Only a bounded number of chunks is in flight at once, so the source is still read lazily
+def synthesize_parallel(sentences, stats, workers, chunk_size, tokenizer_name, statistics_path, log_level,
+                        profile_prefix=None, seed=None, first_sentence=0, connect_next_sentence=False,
+                        variants=1, max_errors=1):
+    if seed is None:
+        seed = counter_rng.random_seed()
+    with multiprocessing.Pool(workers, initializer=init_worker,
+                              initargs=(tokenizer_name, statistics_path, log_level, profile_prefix, seed,
+                                        variants, max_errors)) as pool:
+        pending = deque()
+        for first, chunk in numbered_chunks(sentences, chunk_size, first_sentence):
+            pending.append(pool.apply_async(synthesize_chunk, (first, chunk)))
+            if len(pending) >= workers * 2:
+                results, connect_next_sentence = merge_chunk(
+                    receive_chunk(pending.popleft()), connect_next_sentence, stats, max_errors)
+                yield results, connect_next_sentence
+        while pending:
+            results, connect_next_sentence = merge_chunk(
+                receive_chunk(pending.popleft()), connect_next_sentence, stats, max_errors)
+            yield results, connect_next_sentence
+        # Workers write their profiles only when they exit normally
+        pool.close()
+        pool.join()
+
+# Results of a chunk, honouring the lowercasing requested by the previous chunk
+# While the state entering a sentence differs from what the chunk assumed, the sentence is
+# synthesized again in the main process from the same streams; once they agree the chunk results are valid again
+# Returns the (variants, duplicates) results of the sentences and the lowercasing state after the chunk
+def merge_chunk(results, connect_next_sentence, stats, max_errors=1):
+    merged = []
+    assumed_connect = False
+    for sentence, decisions, sentence_variants, duplicates, chunk_connect in results:
+        if connect_next_sentence != assumed_connect:
+            sentence_variants, duplicates, connect_next_sentence = synthesize_sentence(
+                sentence, connect_next_sentence, stats, *decisions, max_errors)
+        else:
+            connect_next_sentence = chunk_connect
+        assumed_connect = chunk_connect
+        merged.append((sentence_variants, duplicates))
+    return merged, connect_next_sentence
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Synthesizes punctuation errors into correct source sentences")
+    parser.add_argument("source_file", help="source text file for synthesizing errors into, plain or compressed "
+                                            "with gzip, xz, bzip2 or zstd, - for standard input")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes analyzing files and synthesizing errors in parallel")
+    parser.add_argument("--chunk-size", type=int, default=1000,
+                        help="number of sentences in a shard given to a worker, or decided at once in a serial run")
+    parser.add_argument("--split-ratios", type=float, nargs=3, metavar=("TRAIN", "VALID", "TEST"),
+                        default=list(writers.DEFAULT_SPLIT_RATIOS.values()),
+                        help="shares of the train, valid and test sets, 0.8 0.1 0.1 by default")
+    parser.add_argument("--no-all", action="store_true",
+                        help="do not write the joint all_correct.txt and all_incorrect.txt files")
+    parser.add_argument("--output-dir", default=".", metavar="DIR",
+                        help="directory of the output files and the manifest, the current directory by default")
+    parser.add_argument("--shard-lines", type=int, metavar="N",
+                        help="write the data sets into shards of N sentence pairs")
+    parser.add_argument("--shard-bytes", type=int, metavar="N",
+                        help="start a new shard once it holds N bytes of uncompressed text")
+    parser.add_argument("--dedup", action="store_true",
+                        help="drop source sentences repeating an earlier sentence, ignoring case and whitespace")
+    parser.add_argument("--dedup-memory", type=int, default=dedup.DEFAULT_MEMORY_MB, metavar="MB",
+                        help=f"memory limit of the deduplication table, {dedup.DEFAULT_MEMORY_MB} MB by default")
+    parser.add_argument("--variants", type=int, default=1, metavar="K",
+                        help="incorrect variants drawn for every sentence, duplicates are dropped, 1 by default")
+    parser.add_argument("--max-errors", type=int, default=1, metavar="N",
+                        help="errors stacked into a variant at most, 1 by default")
+    parser.add_argument("--seed", type=int, metavar="N",
+                        help="seed of the random decisions, the same seed gives the same output")
+    parser.add_argument("--checkpoint-interval", type=int, default=100000, metavar="N",
+                        help="sentences between checkpoints of the run, 100000 by default, 0 for none")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue the run from the checkpoint in the output directory")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="read, synthesize and write in threads of their own connected by bounded queues")
+    parser.add_argument("--tokenizer", choices=sorted(tokenizer.TOKENIZERS), default="nltk",
+                        help="word tokenizer of the output sentences, nltk by default")
+    parser.add_argument("--statistics", default=STATISTICS_FILE, metavar="FILE",
+                        help="statistics file made by the analyzer, statistics.bin by default")
+    parser.add_argument("--analyze", action="store_true",
+                        help="generate the statistics again and save them to the statistics file before synthesis")
+    parser.add_argument("--nltk-data", metavar="DIR",
+                        help="local directory containing the punkt sentence tokenizer data")
+    parser.add_argument("--compress", choices=corpus_io.COMPRESSIONS,
+                        help="compress the output files, their names get the extension of the compression")
+    parser.add_argument("--compress-level", type=int, metavar="LEVEL",
+                        help="compression level, the default of the compression if not given")
+    parser.add_argument("--log-level", choices=reporting.LOG_LEVELS, default="INFO",
+                        help="level of the logged messages, DEBUG logs the decisions made for every sentence")
+    parser.add_argument("--progress-interval", type=float, default=10.0, metavar="SECONDS",
+                        help="seconds between progress reports, 10 by default")
+    parser.add_argument("--metrics-file", metavar="FILE",
+                        help="JSON file for the summary of the run")
+    parser.add_argument("--profile", nargs="?", const="synthesizer", metavar="PREFIX",
+                        help="profile the run into PREFIX.prof, and every worker into PREFIX.worker-PID.prof, "
+                             "and time the stages of the synthesis. PREFIX is synthesizer by default")
+    args = parser.parse_args()
+    if args.workers < 1 or args.chunk_size < 1:
+        parser.error("--workers and --chunk-size must be positive")
+    if min(args.split_ratios) < 0 or sum(args.split_ratios) <= 0:
+        parser.error("--split-ratios must be non-negative and not all zero")
+    if (args.shard_lines is not None and args.shard_lines < 1) or \
+            (args.shard_bytes is not None and args.shard_bytes < 1):
+        parser.error("--shard-lines and --shard-bytes must be positive")
+    if args.dedup_memory < 1:
+        parser.error("--dedup-memory must be positive")
+    if args.variants < 1 or args.max_errors < 1:
+        parser.error("--variants and --max-errors must be positive")
+    if args.seed is not None and args.seed < 0:
+        parser.error("--seed must be non-negative")
+    if args.checkpoint_interval < 0:
+        parser.error("--checkpoint-interval must not be negative")
+    if args.compress == "zst":
+        corpus_io.zstd_module()
+    reporting.configure_logging(args.log_level)
+    metrics = reporting.RunMetrics()
+    profiler = None
+    if args.profile:
+        instrumentation.enable()
+        profiler = instrumentation.start_profile()
+
+    global tokenize
+    tokenize = tokenizer.get_tokenizer(args.tokenizer)
+
+    if args.analyze:
+        logger.info("Generating statistics...")
+        with metrics.stage("analysis"):
+            receive_statistics(args.workers, args.statistics)
+    elif not os.path.exists(args.statistics):
+        parser.error(f"statistics file {args.statistics} not found, generate it with --analyze")
+    logger.info("Retrieving statistics...")
+    with metrics.stage("statistics"):
+        try:
+            store = statistics_store.load_statistics(args.statistics)
+        except ValueError as error:
+            parser.error(str(error))
+        stats = map_statistics(store)
+        segmenter.load_sentence_tokenizer(args.nltk_data)
+
+    logger.debug("Missing punctuation combinations: %d, unnecessary punctuation combinations: %d",
+                 len(stats["m_combinations"]), len(stats["u_combinations"]))
+
+    # Every run is seeded, a run without a seed records the one drawn for it
+    checkpoint_path = os.path.join(args.output_dir, checkpoint.CHECKPOINT_FILE)
+    dedup_log_path = os.path.join(args.output_dir, checkpoint.DEDUP_LOG_FILE)
+    resume = None
+    if args.resume:
+        try:
+            resume = checkpoint.read_checkpoint(checkpoint_path)
+        except FileNotFoundError:
+            parser.error(f"no checkpoint to resume from in {args.output_dir}")
+        except ValueError as error:
+            parser.error(str(error))
+    seed = args.seed
+    if seed is None:
+        seed = resume["settings"]["seed"] if resume else counter_rng.random_seed()
+    settings = {
+        "source": args.source_file,
+        "seed": seed,
+        "chunk_size": args.chunk_size,
+        "split_ratios": args.split_ratios,
+        "write_all": not args.no_all,
+        "tokenizer": args.tokenizer,
+        "compression": args.compress,
+        "compress_level": args.compress_level,
+        "shard_lines": args.shard_lines,
+        "shard_bytes": args.shard_bytes,
+        "variants": args.variants,
+        "max_errors": args.max_errors,
+        "dedup_memory": args.dedup_memory if args.dedup else None,
+        "statistics": store.source_hash,
+    }
+    if resume:
+        changed = checkpoint.changed_settings(resume, settings)
+        if changed:
+            parser.error("the run differs from the checkpoint: " + ", ".join(
+                f"{name} {old} != {new}" for name, old, new in changed))
+        metrics.restore(resume["metrics"])
+        logger.info("Resuming from sentence %d", resume["sentences"])
+
+    split_ratios = dict(zip(writers.DEFAULT_SPLIT_RATIOS, args.split_ratios))
+    manifest_info = {
+        "source": args.source_file,
+        "seed": seed,
+        "variants": args.variants,
+        "max_errors": args.max_errors,
+        "statistics": {
+            "path": args.statistics,
+            "format_version": statistics_store.FORMAT_VERSION,
+            "created": store.header.get("created"),
+            "source_hash": store.source_hash,
+        },
+    }
+    with corpus_io.open_source(args.source_file) as source, \
+            writers.SplitWriter(split_ratios, not args.no_all, args.compress, args.compress_level, args.output_dir,
+                                args.shard_lines, args.shard_bytes, manifest_info,
+                                resume["writer"] if resume else None) as writer, \
+            metrics.stage("synthesis"), \
+            pipeline.Pipeline() as stages:
+
+        logger.info("Starting error synthesis")
+        try:
+            deduplicator = None
+            if args.dedup:
+                deduplicator = dedup.Deduplicator(args.dedup_memory,
+                                                  dedup_log_path if args.checkpoint_interval else None,
+                                                  resume["input"]["deduplicated"] if resume else None)
+            reader = checkpoint.SentenceReader(source, segmenter.Segmenter(), resume["input"] if resume else None,
+                                               deduplicator)
+        except (ValueError, FileNotFoundError) as error:
+            parser.error(str(error))
+        progress = reporting.ProgressReporter(source.size, source.position, args.progress_interval,
+                                              metrics.sentences_read)
+        sentences = instrumentation.timed_iterator("segmentation", reader)
+        # Pipelined, the source is read and segmented in a stage of its own, which hands over chunks of
+        # sentences. The synthesis splits them into the same chunks again
+        if args.pipeline:
+            sentences = itertools.chain.from_iterable(
+                stages.stage(chunk_sentences(sentences, args.chunk_size), "reader"))
+        connect_next_sentence = resume["connect_next_sentence"] if resume else False
+        if args.workers > 1:
+            chunks = synthesize_parallel(sentences, stats, args.workers, args.chunk_size, args.tokenizer,
+                                         args.statistics, args.log_level, args.profile,
+                                         seed, metrics.sentences_read, connect_next_sentence, args.variants,
+                                         args.max_errors)
+        else:
+            chunks = synthesize_serial(sentences, stats, args.chunk_size, seed, metrics.sentences_read,
+                                       connect_next_sentence, args.variants, args.max_errors)
+        # The synthesized chunks are written in the main thread, while the next chunks are synthesized
+        if args.pipeline:
+            chunks = stages.stage(chunks, "synthesis")
+
+        # Checkpoints are taken after a fixed number of sentences rather than of seconds, so a continued
+        # run ends the compressed members at the same places as a run that was never stopped
+        last_checkpoint = metrics.sentences_read
+        for results, connect_next_sentence in chunks:
+            for sentence_variants, duplicates in results:
+                metrics.count(sentence_variants, duplicates)
+                tokenized_pairs = [tokenized_pair for _, tokenized_pair in sentence_variants
+                                   if tokenized_pair is not None]
+                if tokenized_pairs:
+                    started = instrumentation.start()
+                    writer.write_variants(tokenized_pairs)
+                    instrumentation.stop("write", started)
+                progress.update(metrics.sentences_read, metrics.pairs_written)
+            reader.release(metrics.sentences_read)
+
+            if args.checkpoint_interval and metrics.sentences_read - last_checkpoint >= args.checkpoint_interval:
+                with metrics.stage("checkpoint"):
+                    if deduplicator:
+                        deduplicator.checkpoint()
+                    checkpoint.write_checkpoint(checkpoint_path, {
+                        "settings": settings,
+                        "sentences": metrics.sentences_read,
+                        "connect_next_sentence": connect_next_sentence,
+                        "input": reader.position(metrics.sentences_read),
+                        "writer": writer.checkpoint(),
+                        "metrics": metrics.counters(),
+                    })
+                last_checkpoint = metrics.sentences_read
+                logger.debug("Checkpoint at sentence %d", last_checkpoint)
+        progress.report(metrics.sentences_read, metrics.pairs_written)
+        metrics.duplicate_sentences = reader.duplicates
+        if deduplicator:
+            deduplicator.close()
+    checkpoint.remove_checkpoint(checkpoint_path, dedup_log_path)
+    logger.info("Finished")
+    metrics.write(args.metrics_file)
+    if profiler:
+        instrumentation.dump_profile(profiler, f"{args.profile}.prof")
+        logger.info("Profile written to %s.prof", args.profile)
 
-    with open("all_correct.txt", "w", encoding="utf8") as all_file_correct, \
-        open("all_incorrect.txt", "w", encoding="utf8") as all_file_incorrect:
-        
-        file = sys.argv[1]
-        print(f"{datetime.now()}    Processing source...")
-        group = process_source_text(file)
-        sentence_counter = 0
-        print(f"Length of processed text: {len(group)}")     
-        max_sentences = len(group)
-        print(f"{datetime.now()}    Starting error synthesis")
-        for sentence in group:
-            print(f"Progress: {sentence_counter}/{max_sentences}", end="\r", flush=True)
-            
-            if connect_next_sentence:
-                sentence = sentence[0].lower() + sentence[1:]
-                connect_next_sentence = False
-            correct_punctuations = error_generator.collect_punctuations(
-                sentence)
-            correct_end_punctuation = sentence[-1]
-            words = sentence.split()
-            u_error_is_possible = False
-            u_words_options = []
-            u_punctuation_options = []
-
-            # Determine if the sentence contains words that are common for U_ERROR
-            for nextWord in u_combinations.keys():
-                if nextWord in words:
-                    preceding_word_index = words.index(nextWord) - 1
-                    if preceding_word_index >= 0 and words[preceding_word_index][-1] not in string.punctuation:
-                        u_error_is_possible = True
-                        u_words_options.append(nextWord)
-                        u_punctuation_options.append(u_combinations[nextWord])
-                
-            introduce_error = error_generator.determine_punct_error(punctuation_error)
-            error_type = "none"
-
-            match introduce_error:
-                case "yes":
-                    error_type = error_generator.determine_error_type(u_error, m_error, r_error, u_error_is_possible)
-                case "no":
-                    continue
-
-            match error_type:
-                case "u":
-                    character = error_generator.determine_unnecessary_character(
-                        u_punctuation, u_punctuation_options)
-                    word = u_words_options[u_punctuation_options.index(character)]
-                    error_sentence = error_generator.generate_u_error(
-                        sentence, words, character, word)
-                    output_set(all_file_correct, all_file_incorrect, sentence, error_sentence)
-                case "m":
-                    pair = error_generator.determine_missing_character(
-                        correct_punctuations, m_punctuation, correct_end_punctuation, sentence, m_combinations)
-                    character = pair[0]
-                    if character == None:
-                        continue
-                    word = pair[1]
-                    error_sentence = error_generator.generate_m_error(
-                        sentence, character, word)
-                    output_set(all_file_correct, all_file_incorrect, sentence, error_sentence)
-                case "r":
-                    correct_character, wrong_character, position = error_generator.determine_replacement_character(
-                        r_punctuation, r_punctuation_total_fix_percentages, correct_punctuations, r_punctuation_total_fixes, r_punctuation_middle_fixes, r_punctuation_end_fixes)
-                    error_sentence = error_generator.generate_r_error(sentence, correct_end_punctuation, correct_character, wrong_character, position)
-                    if position == "end" and wrong_character == "," or wrong_character == ":":
-                        connect_next_sentence = True
-                    output_set(all_file_correct, all_file_incorrect, sentence, error_sentence)
-                case "none":
-                    continue
-            sentence_counter += 1
-    all_file_correct.close()
-    all_file_incorrect.close()
-    print(f"{datetime.now()}    Error synthesis finished. Splitting data into train, valid, and test sets...")
-    split_set("all_correct.txt")
-    split_set("all_incorrect.txt")
-    print(f"{datetime.now()}    Finished")
-    
-def print_usage():
-    print("Usage: python synthesizer.py source_file")
-    print("Where")
-    print("     source_file - source text file for synthesizing errors into")
-    
-main()
+if __name__ == "__main__":
+    main()
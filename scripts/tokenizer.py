@@ -0,0 +1,314 @@
+# This file is part of the EstGEC punctuation error synthesizer
+# Author: Christian-Enrique Hindremäe
+# 2024
+
+# file: tokenizer.py
+#
+# Word tokenization of the output sentences
+# Imported as a module in main file synthesizer.py
+# When executed separately, checks the output parity of the regex tokenizer against nltk on the gold token files
+# and on sentences with quotes, abbreviations, stops inside the sentence and runs of punctuation marks
+
+# Usage: python tokenizer.py [--source DIR ...]
+# Where
+#   --source - directories of gold token files, grouped into subdirectories by language level
+
+import re
+import glob
+import os
+import random
+import argparse
+import segmenter
+
+# Characters which nltk always separates into tokens of their own
+SEPARATE_CHARACTERS = r";@#$%&?!*\[\](){}<>«“‘„»”’‒-―"
+# Closing characters allowed after the final full stop
+CLOSING_CHARACTERS = r"\]\)}>\"'»”’"
+# Rest of a sentence after its final full stop. nltk converts a quote after whitespace into a starting quote
+# before it separates the stop, so a stop followed by such a quote stays in its word
+FINAL_STOP_END = rf"""(?:[{CLOSING_CHARACTERS}]|\s(?!"|''))*$"""
+
+# Anything nltk pads with spaces before it splits off an apostrophe at the end of a word: whitespace, the
+# separated characters, quotes, commas and colons not followed by a digit, ellipses and the final full stop
+APOSTROPHE_END = rf"""(?=\s|$|[{SEPARATE_CHARACTERS}`"]|[:,](?!\d)|\.\.|--|\.(?={FINAL_STOP_END}))"""
+
+# Single compiled pattern following the rules of nltk's NLTKWordTokenizer for a single sentence
+# English contractions like "don't" are not split, they do not occur in Estonian text
+TOKEN_PATTERN = re.compile(rf"""
+    \.{{2,}}                                        # Ellipsis
+    | --                                            # Double dash
+    | `` | ` | '' | "                               # Quotes, runs of backticks in pairs. Converted to `` and '' afterwards
+    | [{SEPARATE_CHARACTERS}]
+    | [:,](?!\d)                                    # Comma and colon, unless followed by a digit
+    | (?<!\.)\.(?={FINAL_STOP_END})                 # Final full stop
+    | (?<!\w)'(?!(?i:re|ve|ll|m|t|s|d|n)\b)(?=\w)   # Starting apostrophe
+    | '(?:[sSmMdD]|ll|LL|re|RE|ve|VE){APOSTROPHE_END}   # Clitics
+    | '{APOSTROPHE_END}                             # Ending apostrophe
+    | (?:                                           # Anything else up to the next whitespace or separated character
+        [^\s{SEPARATE_CHARACTERS}`"':,.\-]
+        | [:,](?=\d)
+        | (?<!\.)\.(?!{FINAL_STOP_END})(?!\.)       # Stops of abbreviations, also before closing quotes
+        | -(?!-)
+        | '(?!')(?!(?:[sSmMdD]|ll|LL|re|RE|ve|VE)?{APOSTROPHE_END})
+      )+
+    | \S
+""", re.VERBOSE)
+
+# Characters whose quote tokens are converted to starting quotes when following them, nltk separates the
+# opening quotes and backticks from a following quote before converting it
+STARTING_QUOTE_CONTEXT = " ([{<«“‘„`"
+
+# Adjacent punctuation marks, quotes and other symbols. nltk applies its rules one after another, so such
+# runs depend on the order of the rules, and sentences containing one are tokenized with the rules of nltk
+# instead of the pattern
+IRREGULAR_PATTERN = re.compile(r"[^\w\s][^\w\s]")
+
+# Possible sentence boundaries inside a sentence, as found by punkt. nltk's word_tokenize splits the text
+# into punkt sentences first, which separates the stop of a word at such a boundary, so sentences
+# containing one are split with punkt before they are tokenized
+INNER_BOUNDARY_PATTERN = re.compile(r"""[.?!](?=[)";}\]*:@'({\[‘’“”«»!?]|\s+\S)""")
+
+# Word tokenizer of nltk, used for the sentences with irregular runs of marks
+nltk_word_tokenizer = None
+
+
+# Tokenize a sentence with nltk as word_tokenize does, splitting it into punkt sentences first
+# A "." inserted or replaced inside the sentence can end a punkt sentence, which separates it from its word
+def nltk_tokenize(sentence):
+    from nltk import word_tokenize
+    return word_tokenize(sentence)
+
+
+# Tokenize a sentence with the compiled pattern, sentences with a possible boundary inside are split with
+# the punkt tokenizer of the segmenter first, which is the one word_tokenize uses
+def regex_tokenize(sentence):
+    if INNER_BOUNDARY_PATTERN.search(sentence):
+        split_sentences = segmenter.sentence_tokenizer or segmenter.load_sentence_tokenizer()
+        return [token for part in split_sentences(sentence) for token in tokenize_part(part)]
+    return tokenize_part(sentence)
+
+
+# Tokenize a punkt sentence with the pattern, or with the rules of nltk if it has marks next to each other
+def tokenize_part(sentence):
+    global nltk_word_tokenizer
+    if IRREGULAR_PATTERN.search(sentence):
+        if nltk_word_tokenizer is None:
+            from nltk.tokenize import NLTKWordTokenizer
+            nltk_word_tokenizer = NLTKWordTokenizer()
+        return nltk_word_tokenizer.tokenize(sentence)
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(sentence):
+        token = match.group()
+        if token == '"' or token == "''":
+            start = match.start()
+            if (start == 0 and token == '"') or (start > 0 and sentence[start - 1] in STARTING_QUOTE_CONTEXT):
+                token = "``"
+            else:
+                token = "''"
+        tokens.append(token)
+    return tokens
+
+
+TOKENIZERS = {"nltk": nltk_tokenize, "regex": regex_tokenize}
+
+
+def get_tokenizer(name):
+    return TOKENIZERS[name]
+
+
+# Offsets of the tokens in the sentence, or None if the tokens can't be matched with the sentence
+# Quotes converted to `` and '' are matched with the original quote character
+def align_tokens(tokens, sentence):
+    spans = []
+    cursor = 0
+    length = len(sentence)
+    for token in tokens:
+        while cursor < length and sentence[cursor].isspace():
+            cursor += 1
+        if sentence.startswith(token, cursor):
+            end = cursor + len(token)
+        elif token in ("``", "''") and sentence.startswith('"', cursor):
+            end = cursor + 1
+        else:
+            return None
+        spans.append((cursor, end))
+        cursor = end
+    return spans
+
+
+# Whether nltk separates the character into its own token when inserted at the offset of the text
+def is_separate_token(text, position):
+    character = text[position]
+    following = text[position + 1:position + 2]
+    if character in "?!;":
+        return True
+    if character in ",:":
+        return not following.isdigit()
+    if character == ".":
+        # Only the full stop ending the sentence is separated
+        return position == len(text) - 1 and text[position - 1:position] != "."
+    return False
+
+
+# Apply the difference between the correct and incorrect sentence to the tokens of the correct sentence
+# Errors add, remove or replace a single punctuation mark, which is done on the tokens directly when the
+# mark is a token of its own on both sides. Returns None when the incorrect sentence has to be tokenized
+def apply_token_edit(sentence, tokens, error_sentence):
+    start = 0
+    shortest = min(len(sentence), len(error_sentence))
+    while start < shortest and sentence[start] == error_sentence[start]:
+        start += 1
+    end, error_end = len(sentence), len(error_sentence)
+    while end > start and error_end > start and sentence[end - 1] == error_sentence[error_end - 1]:
+        end -= 1
+        error_end -= 1
+    removed = sentence[start:end]
+    inserted = error_sentence[start:error_end]
+    if len(removed) > 1 or len(inserted) > 1 or not (removed or inserted):
+        return None
+    # Marks next to other marks are tokenized by the order of nltk's rules
+    if IRREGULAR_PATTERN.search(sentence, max(start - 1, 0), end + 1) \
+            or IRREGULAR_PATTERN.search(error_sentence, max(start - 1, 0), error_end + 1):
+        return None
+    # Punkt splits the sentences at possible boundaries inside them, which an edit can move
+    if INNER_BOUNDARY_PATTERN.search(sentence) or INNER_BOUNDARY_PATTERN.search(error_sentence):
+        return None
+    if inserted and not is_separate_token(error_sentence, start):
+        return None
+    # Removing a mark between two words would join them into a single token
+    if removed and not inserted and 0 < start < len(error_sentence) \
+            and not error_sentence[start - 1].isspace() and not error_sentence[start].isspace():
+        return None
+    # Edits at the end of the sentence, also before closing quotes and brackets, change whether the full stop
+    # before them is separated from its word
+    if re.fullmatch(FINAL_STOP_END, sentence[end:]) and re.search(rf"\.{FINAL_STOP_END}", sentence[:start]):
+        return None
+
+    spans = align_tokens(tokens, sentence)
+    if spans is None:
+        return None
+    index = 0
+    while index < len(spans) and spans[index][1] <= start:
+        index += 1
+    if removed:
+        if index == len(spans) or spans[index] != (start, start + 1) or tokens[index] != removed \
+                or not is_separate_token(sentence, start):
+            return None
+        return tokens[:index] + ([inserted] if inserted else []) + tokens[index + 1:]
+    if index < len(spans) and spans[index][0] < start:
+        return None
+    return tokens[:index] + [inserted] + tokens[index:]
+
+
+# Tokenize the correct sentence once and derive the incorrect sentence from its tokens
+# Tokens of the correct sentence can be given when it is paired with several incorrect sentences
+def tokenize_pair(sentence, incorrect_sentence, tokenize, tokens=None):
+    if tokens is None:
+        tokens = tokenize(sentence)
+    incorrect_tokens = apply_token_edit(sentence, tokens, incorrect_sentence)
+    if incorrect_tokens is None:
+        incorrect_tokens = tokenize(incorrect_sentence)
+    return ' '.join(tokens), ' '.join(incorrect_tokens)
+
+
+# Source sentences of the gold token files, with the spaces before punctuation removed again
+def read_gold_sentences(source_dirs):
+    sentences = []
+    for source_dir in source_dirs:
+        for src in glob.glob(os.path.join(source_dir, "*", "*.txt")):
+            with open(src, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.startswith("S "):
+                        sentence = re.sub(r" ([,.!?:;)])", r"\1", line[2:].strip())
+                        sentences.append(re.sub(r"\( ", "(", sentence))
+    return sentences
+
+
+# Sentences with quotes, abbreviations, stops inside the sentence and runs of punctuation marks, which the gold
+# token files hardly contain, checked with them
+PARITY_CASES = [
+    "Ta ütles: 'aasta'!",
+    "See oli 'hea aasta', ütles ta.",
+    "Kas see oli 'vana'?",
+    "Ta kirjutas 'tere';",
+    "Sõna 'kool'.",
+    "Ta ütles 'jah'...",
+    "Nad olid 'sõbrad' -- aga mitte kauaks.",
+    "Pealkiri oli \"Kool, nt.\".",
+    "Ta tõi näiteid, nt.'.",
+    "Raamat „\"Kevade\" ja teised\" ilmus.",
+    "Ta ütles: «\"Tere!\"»",
+    "Ta ütles: “\"Tere\", kuidas läheb?”",
+    "Ta ütles ‘\"jah\"’.",
+    "Tsitaat ``\"Kevadest\"`` on tuntud.",
+    "Koodis oli ````märk````.",
+    "Ta ütles 'mees's.",
+    "Näiteks 1990'ndad ja 2000'ndad.",
+    "Ta küsis: \"Kas tuled?\" ja läks.",
+    "See on (vt. 'lisa').",
+    "Ta ostis õunu, pirne jne. ”",
+    "Mees ütles. et tuleb homme.",
+    "Ta ütles? et tuleb homme!",
+    "Nt. Tallinnas ja Tartus.",
+    "Ta lõpetas 9. \"",
+    "Võitja oli 1. ''",
+    "\"\"Tere\"\"",
+    "Ta ütles::a ja läks.",
+    "Ta tuli,,ja läks,-",
+    "Hinnad: ,-ja :a.",
+    "'T oli 'tema' 'T.",
+    "Ta ütles.'a ja läks.",
+    "Ta ütles.»Tere« ja läks.",
+]
+
+
+# Compare the regex tokenizer with nltk, and token level edits with tokenizing the incorrect sentence
+def check_parity(sentences, shown=10):
+    mismatches = 0
+    edit_mismatches = 0
+    edits = 0
+    rng = random.Random(0)
+    for sentence in sentences:
+        expected = nltk_tokenize(sentence)
+        if regex_tokenize(sentence) != expected:
+            mismatches += 1
+            if mismatches <= shown:
+                print(f"nltk:  {expected}\nregex: {regex_tokenize(sentence)}\n")
+
+        # Remove, replace and add punctuation like the error generators do
+        marks = [i for i, char in enumerate(sentence) if char in ",.!?:;"]
+        spaces = [i for i, char in enumerate(sentence) if char == " "]
+        candidates = []
+        if marks:
+            position = rng.choice(marks)
+            candidates.append(sentence[:position] + sentence[position + 1:])
+            candidates.append(sentence[:position] + rng.choice(",.!?:") + sentence[position + 1:])
+        if spaces:
+            position = rng.choice(spaces)
+            candidates.append(sentence[:position] + rng.choice(",!?:") + sentence[position:])
+        for error_sentence in candidates:
+            edits += 1
+            expected = ' '.join(nltk_tokenize(error_sentence))
+            if tokenize_pair(sentence, error_sentence, nltk_tokenize)[1] != expected \
+                    or tokenize_pair(sentence, error_sentence, regex_tokenize)[1] != expected:
+                edit_mismatches += 1
+                if edit_mismatches <= shown:
+                    print(f"edit: {sentence!r} -> {error_sentence!r}\n")
+
+    print(f"Sentences: {len(sentences)}, regex tokenizer mismatches: {mismatches}")
+    print(f"Edits: {edits}, token level edit mismatches: {edit_mismatches}")
+    return mismatches == 0 and edit_mismatches == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Checks the regex tokenizer and token level edits against nltk")
+    parser.add_argument("--source", nargs="+", metavar="DIR", default=["./source_test"],
+                        help="directories of gold token files grouped by language level, ./source_test by default")
+    args = parser.parse_args()
+    if not check_parity(read_gold_sentences(args.source) + PARITY_CASES):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+# This file is part of the EstGEC punctuation error synthesizer
+# Author: Christian-Enrique Hindremäe
+# 2024
+
+# file: writers.py
+#
+# Writes the parallel corpora of correct and incorrect sentences
+# Imported as a module in main file synthesizer.py
+#
+# Every run writes manifest.json next to the corpora, listing each pair of files with its line count,
+# size and checksum. In the sharded mode the corpora are split into shards of a fixed number of lines
+# or bytes, and the manifest is rewritten whenever a shard is finished, so the finished shards can be
+# picked up by other processes while synthesis is still running. The manifest is always replaced
+# atomically, a reader never sees a partly written one
+#
+# checkpoint() returns the state of the writers, from which they are continued when given as resume
+
+import os
+import json
+import datetime
+import corpus_io
+
+# Data sets and their default share of the sentence pairs
+DEFAULT_SPLIT_RATIOS = {"train": 0.8, "valid": 0.1, "test": 0.1}
+
+MANIFEST_FILE = "manifest.json"
+MANIFEST_VERSION = 1
+
+
+# Pair of files where line N of the correct file matches line N of the incorrect file
+# Files are compressed when a compression is given, their names get its extension
+# The uncompressed size of the text is only counted when count_bytes is set
+class PairWriter:
+
+    def __init__(self, correct_path, incorrect_path, compression=None, level=None, count_bytes=False,
+                 resume=None):
+        resume = resume or {"correct": None, "incorrect": None, "lines": 0, "text_bytes": 0}
+        self.correct_file = corpus_io.open_output(corpus_io.output_path(correct_path, compression), compression,
+                                                  level, resume["correct"])
+        self.incorrect_file = corpus_io.open_output(corpus_io.output_path(incorrect_path, compression), compression,
+                                                    level, resume["incorrect"])
+        self.line_count = resume["lines"]
+        self.count_bytes = count_bytes
+        self.text_bytes = resume["text_bytes"]
+
+    def write(self, tokenized_pair):
+        tokenized_sentence, tokenized_incorrect_sentence = tokenized_pair
+        correct_line = f"{tokenized_sentence}\n"
+        incorrect_line = f"{tokenized_incorrect_sentence}\n"
+        self.correct_file.write(correct_line)
+        self.incorrect_file.write(incorrect_line)
+        self.line_count += 1
+        if self.count_bytes:
+            self.text_bytes += len(correct_line.encode("utf8")) + len(incorrect_line.encode("utf8"))
+
+    def close(self):
+        self.correct_file.close()
+        self.incorrect_file.close()
+
+    def checkpoint(self):
+        return {"correct": self.correct_file.checkpoint(), "incorrect": self.incorrect_file.checkpoint(),
+                "lines": self.line_count, "text_bytes": self.text_bytes}
+
+    # Manifest entry of the closed files, paths relative to the manifest directory
+    def entry(self, directory):
+        return {
+            "correct": os.path.relpath(self.correct_file.path, directory),
+            "incorrect": os.path.relpath(self.incorrect_file.path, directory),
+            "lines": self.line_count,
+            "bytes": {"correct": self.correct_file.size, "incorrect": self.incorrect_file.size},
+            "sha256": {"correct": self.correct_file.sha256(), "incorrect": self.incorrect_file.sha256()},
+        }
+
+
+# Manifest of the written corpora, written into a temporary file and renamed over the previous one
+#   info - description of the run: seed, statistics and compression used
+class Manifest:
+
+    def __init__(self, directory, info=None, files=None):
+        self.directory = directory
+        self.path = os.path.join(directory, MANIFEST_FILE)
+        self.info = info or {}
+        self.created = datetime.datetime.now().isoformat(timespec="seconds")
+        self.files = list(files or [])
+
+    def add(self, name, shard, entry):
+        self.files.append({"set": name, "shard": shard, **entry})
+
+    # complete is False while synthesis is running, every listed file is finished either way
+    def write(self, complete=False):
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "created": self.created,
+            "complete": complete,
+            **self.info,
+            "files": self.files,
+        }
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "w", encoding="utf8") as f:
+            json.dump(manifest, f, indent=2)
+            f.write("\n")
+        os.replace(temporary_path, self.path)
+
+
+# Data set written into shards of at most max_lines pairs or max_bytes of uncompressed text
+# Shards are named like train.00000.correct and train.00000.incorrect. A shard is opened when its first
+# pair is written, and added to the manifest as soon as it is full, so no empty shards are left behind
+class ShardedWriter:
+
+    def __init__(self, directory, name, manifest, max_lines=None, max_bytes=None, compression=None, level=None,
+                 resume=None):
+        self.directory = directory
+        self.name = name
+        self.manifest = manifest
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        self.compression = compression
+        self.level = level
+        self.shard = 0
+        self.current = None
+        self.line_count = 0
+        if resume:
+            self.shard = resume["shard"]
+            self.line_count = resume["lines"]
+            if resume["current"]:
+                self.open_shard(resume["current"])
+
+    def open_shard(self, resume=None):
+        path = os.path.join(self.directory, f"{self.name}.{self.shard:05d}")
+        self.current = PairWriter(f"{path}.correct", f"{path}.incorrect", self.compression, self.level,
+                                  count_bytes=bool(self.max_bytes), resume=resume)
+
+    def close_shard(self):
+        self.current.close()
+        self.manifest.add(self.name, self.shard, self.current.entry(self.directory))
+        self.manifest.write()
+        self.current = None
+        self.shard += 1
+
+    def write(self, tokenized_pair):
+        if self.current is None:
+            self.open_shard()
+        self.current.write(tokenized_pair)
+        self.line_count += 1
+        if (self.max_lines and self.current.line_count >= self.max_lines) \
+                or (self.max_bytes and self.current.text_bytes >= self.max_bytes):
+            self.close_shard()
+
+    def close(self):
+        if self.current is not None:
+            self.close_shard()
+
+    def checkpoint(self):
+        return {"shard": self.shard, "lines": self.line_count,
+                "current": self.current.checkpoint() if self.current else None}
+
+
+# Assigns sentence pairs to the data sets as they are produced
+# Every pair goes to the data set furthest behind its share, so any prefix of the output is split
+# by the given ratios within a single pair, and the assignment only depends on the pair counter.
+# Both sentences of a pair always go to the same data set
+# The data sets are sharded when shard_lines or shard_bytes is given, the joint set is then sharded as "all"
+class SplitWriter:
+
+    def __init__(self, ratios=None, write_all=True, compression=None, level=None, directory=".",
+                 shard_lines=None, shard_bytes=None, manifest_info=None, resume=None):
+        ratios = ratios or DEFAULT_SPLIT_RATIOS
+        total = sum(ratios.values())
+        if total <= 0 or min(ratios.values()) < 0:
+            raise ValueError("Split ratios must be non-negative and not all zero")
+        self.ratios = {name: ratio / total for name, ratio in ratios.items()}
+        self.pair_count = resume["pairs"] if resume else 0
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.manifest = Manifest(directory, {
+            **(manifest_info or {}),
+            "compression": compression,
+            "split_ratios": self.ratios,
+            "shard_lines": shard_lines,
+            "shard_bytes": shard_bytes,
+        }, resume["files"] if resume else None)
+        self.sharded = bool(shard_lines or shard_bytes)
+
+        names = (["all"] if write_all else []) + list(self.ratios)
+        writer_states = resume["writers"] if resume else {}
+        if self.sharded:
+            self.writers = {name: ShardedWriter(directory, name, self.manifest, shard_lines, shard_bytes,
+                                                compression, level, writer_states.get(name))
+                            for name in names}
+        else:
+            # File names follow the joint set, e.g. train_all_correct.txt
+            self.writers = {name: PairWriter(os.path.join(directory, self.file_prefix(name) + "correct.txt"),
+                                             os.path.join(directory, self.file_prefix(name) + "incorrect.txt"),
+                                             compression, level, resume=writer_states.get(name))
+                            for name in names}
+        self.all_writer = self.writers.get("all")
+        self.split_writers = {name: self.writers[name] for name in self.ratios}
+        self.manifest.write()
+
+    @staticmethod
+    def file_prefix(name):
+        return "all_" if name == "all" else f"{name}_all_"
+
+    # Data set of the next pairs
+    def assign(self, count=1):
+        self.pair_count += count
+        return max(self.ratios, key=lambda name: self.ratios[name] * self.pair_count
+                   - self.split_writers[name].line_count)
+
+    def write(self, tokenized_pair):
+        if self.all_writer:
+            self.all_writer.write(tokenized_pair)
+        self.split_writers[self.assign()].write(tokenized_pair)
+
+    # The variants of a sentence all go to the same data set, so no sentence is shared between the sets
+    def write_variants(self, tokenized_pairs):
+        split_writer = self.split_writers[self.assign(len(tokenized_pairs))]
+        for tokenized_pair in tokenized_pairs:
+            if self.all_writer:
+                self.all_writer.write(tokenized_pair)
+            split_writer.write(tokenized_pair)
+
+    # The manifest is marked complete unless the run failed
+    def close(self, complete=True):
+        for name, writer in self.writers.items():
+            writer.close()
+            if not self.sharded:
+                self.manifest.add(name, None, writer.entry(self.directory))
+        self.manifest.write(complete)
+
+    def checkpoint(self):
+        return {"pairs": self.pair_count, "files": list(self.manifest.files),
+                "writers": {name: writer.checkpoint() for name, writer in self.writers.items()}}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(exc_type is None)
+